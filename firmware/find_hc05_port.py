@@ -1,10 +1,14 @@
 """
 Find which COM port is receiving data from HC-05
-This will test all Bluetooth COM ports and show which one has data
+This will test all Bluetooth COM ports at once and show which one has data
 """
-import serial
+import os
+import sys
 import serial.tools.list_ports
-import time
+
+# Shared with the dashboard's auto-connect
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'piezo-dashboard', 'backend'))
+from port_probe import probe_ports_blocking  # noqa: E402
 
 def find_bluetooth_ports():
     """Find all Bluetooth COM ports"""
@@ -18,34 +22,19 @@ def find_bluetooth_ports():
     
     return bt_ports
 
-def test_port(port_name, timeout=3):
-    """Test if a port is receiving data"""
-    try:
-        ser = serial.Serial(port_name, 9600, timeout=1)
-        print(f"  Testing {port_name}...", end=" ")
-        
-        start_time = time.time()
-        data_received = False
-        
-        while time.time() - start_time < timeout:
-            if ser.in_waiting > 0:
-                data = ser.read(ser.in_waiting).decode('utf-8', errors='ignore')
-                if data.strip():
-                    print(f"✓ FOUND DATA!")
-                    print(f"  Sample: {data[:100]}")
-                    data_received = True
-                    break
-            time.sleep(0.1)
-        
-        if not data_received:
-            print("✗ No data")
-        
-        ser.close()
-        return data_received
-        
-    except Exception as e:
-        print(f"✗ Error: {e}")
-        return False
+def test_ports(ports, timeout=3):
+    """Listen on every port in parallel; one timeout for all of them"""
+    print(f"  Listening on {len(ports)} port(s) for up to {timeout}s...")
+    results = probe_ports_blocking(ports, 9600, timeout)
+    
+    for result in results:
+        if result.live:
+            print(f"  {result.port}: ✓ FOUND DATA! ({result.format}, {result.elapsed:.1f}s)")
+            print(f"  Sample: {result.sample}")
+        else:
+            print(f"  {result.port}: ✗ {result.error}")
+    
+    return results
 
 if __name__ == "__main__":
     print("=" * 60)
@@ -75,9 +64,9 @@ if __name__ == "__main__":
     
     active_port = None
     
-    for port, desc in bt_ports:
-        if test_port(port, timeout=3):
-            active_port = port
+    for result in test_ports([port for port, desc in bt_ports], timeout=3):
+        if result.live:
+            active_port = result.port
             break
     
     print("\n" + "=" * 60)
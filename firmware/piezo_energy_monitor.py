@@ -76,6 +76,7 @@ class PiezoEnergyMonitor:
         self._sample_count += 1
         
         return {
+            'ticks_ms': current_time,
             'voltage_v': voltage,
             'current_ma': current_a * 1000,  # Convert to mA
             'power_mw': power_w * 1000,  # Convert to mW
@@ -134,6 +135,8 @@ if __name__ == "__main__":
     print("Monitoring... Press Ctrl+C to stop and see summary.")
     print("-" * 60)
     
+    seq = 0  # Lets the dashboard count lost/out-of-order lines
+    
     try:
         while True:
             data = monitor.read_and_calculate()
@@ -143,8 +146,11 @@ if __name__ == "__main__":
                 f"V: {data['voltage_v']:.3f}V | "
                 f"I: {data['current_ma']:.2f}mA | "
                 f"P: {data['power_mw']:.2f}mW | "
-                f"E: {data['energy_mwh']:.3f}mWh"
+                f"E: {data['energy_mwh']:.3f}mWh | "
+                f"seq: {seq} | "
+                f"ticks: {data['ticks_ms']}"
             )
+            seq = (seq + 1) & 0xFFFF
             
             print(line)
             
@@ -1,5 +1,6 @@
 import machine
 import time
+import struct
        
 class VoltageSensor:
     def __init__(self, adc_gpio:int) -> None:
@@ -17,7 +18,11 @@ class VoltageSensor:
 
     def voltage(self, duration:float = 0.5, samples:int = 10) -> float:
         """Burst-samples analog reading and converts to voltage estimate."""
-        analog:int = self._sample_analog(duration, samples)
+        return self.to_voltage(self._sample_analog(duration, samples))
+
+    @staticmethod
+    def to_voltage(analog:int) -> float:
+        """Converts a raw u16 analog reading to voltage estimate."""
         max_analog:int = 65535
         min_analog:int = 600
         max_voltage:float = 16.3
@@ -36,12 +41,56 @@ if __name__ == "__main__":
     
     INTERVAL_S = 0.5  # Time interval: 0.5s = 2 readings per second (slower for Bluetooth)
     USE_BLUETOOTH = True  # Set False to disable BT
+    USE_BINARY = False  # Send binary frames from boot; the dashboard can also switch modes with "MODE BIN"/"MODE TEXT"
     
     # --- Bluetooth (HC-05) over UART helper ---
     class BTSerial:
+        # Binary frame: sync, seq u16, ticks_ms u32, raw ADC u16, then CRC-16 u16 (little-endian)
+        SYNC = 0xA5
+        FRAME_FMT = "<BHIH"
+
         def __init__(self, uart_id: int = 1, baud: int = 9600, tx_pin: int = 4, rx_pin: int = 5) -> None:
             # UART1 on Pico: TX=GP4, RX=GP5 (Changed from UART0 GP0/GP1)
             self._uart = machine.UART(uart_id, baudrate=baud, tx=machine.Pin(tx_pin), rx=machine.Pin(rx_pin))
+            self._rx = b""
+
+        @staticmethod
+        def _crc16(data) -> int:
+            # CRC-16/CCITT-FALSE, matches binascii.crc_hqx(data, 0xFFFF) on the backend
+            crc = 0xFFFF
+            for byte in data:
+                crc ^= byte << 8
+                for _ in range(8):
+                    if crc & 0x8000:
+                        crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+                    else:
+                        crc = (crc << 1) & 0xFFFF
+            return crc
+
+        def send_frame(self, seq: int, ticks: int, raw: int) -> None:
+            """Send one 11-byte binary sample frame."""
+            try:
+                frame = struct.pack(self.FRAME_FMT, self.SYNC, seq & 0xFFFF, ticks & 0xFFFFFFFF, raw & 0xFFFF)
+                self._uart.write(frame + struct.pack("<H", self._crc16(frame)))
+            except Exception:
+                pass
+
+        def poll_mode(self):
+            """Returns True/False when the host sent MODE BIN/MODE TEXT, else None."""
+            mode = None
+            try:
+                if self._uart.any():
+                    self._rx = (self._rx + self._uart.read())[-64:]
+                    while b"\n" in self._rx:
+                        line, self._rx = self._rx.split(b"\n", 1)
+                        line = line.strip()
+                        if line == b"MODE BIN":
+                            mode = True
+                        elif line == b"MODE TEXT":
+                            mode = False
+            except Exception:
+                pass
+            return mode
 
         def send_line(self, s: str) -> None:
             try:
@@ -60,6 +109,8 @@ if __name__ == "__main__":
     
     # Energy accumulator
     total_energy_j = 0.0
+    binary = USE_BINARY
+    seq = 0
     
     print("Voltage, Power & Energy Monitor")
     print("Load: {} Ohms | Interval: {}s".format(LOAD_RESISTANCE, INTERVAL_S))
@@ -68,7 +119,9 @@ if __name__ == "__main__":
     try:
         while True:
             # Measure voltage
-            v = sensor.voltage(duration=0.01, samples=10)
+            analog = sensor._sample_analog(duration=0.01, samples=10)
+            ticks = time.ticks_ms()
+            v = sensor.to_voltage(analog)
             
             # Calculate instantaneous power: P = V²/R
             power_w = (v * v) / LOAD_RESISTANCE
@@ -82,15 +135,22 @@ if __name__ == "__main__":
             total_energy_j += energy_instant_j
             total_energy_mwh = total_energy_j / 3.6  # Convert J to mWh
             
-            # Format output
-            msg = "V: {:.3f}V | P: {:.2f}mW | E_inst: {:.3f}mJ | E_total: {:.3f}mWh".format(
-                v, power_mw, energy_instant_mj, total_energy_mwh
+            # Format output (seq/ticks let the dashboard spot lost frames and timestamp samples)
+            msg = "V: {:.3f}V | P: {:.2f}mW | E_inst: {:.3f}mJ | E_total: {:.3f}mWh | seq: {} | ticks: {}".format(
+                v, power_mw, energy_instant_mj, total_energy_mwh, seq, ticks
             )
             
             print(msg)  # USB serial
             
             if USE_BLUETOOTH:
-                bt.send_line(msg)  # Bluetooth
+                mode = bt.poll_mode()
+                if mode is not None:
+                    binary = mode
+                if binary:
+                    bt.send_frame(seq, ticks, analog)  # 11 bytes instead of ~70
+                else:
+                    bt.send_line(msg)  # Bluetooth
+            seq = (seq + 1) & 0xFFFF  # Wraps like the binary frame's u16
             
             time.sleep(INTERVAL_S)
     except KeyboardInterrupt:
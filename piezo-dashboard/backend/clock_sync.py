@@ -0,0 +1,100 @@
+"""
+Map device ticks_ms onto host wall-clock time
+
+Host receive times are the device time plus an unknown, always-positive
+delay (Bluetooth buffering adds 10-100 ms of jitter). Taking the minimum of
+(host_time - device_time) over short buckets keeps only the least-delayed
+samples - the lower envelope - and a least-squares line through those
+minima gives the clock offset and drift.
+"""
+import logging
+from collections import deque
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# rp2 time.ticks_ms() wraps at 2**30
+TICKS_PERIOD = 1 << 30
+
+class ClockAligner:
+    """Online offset + drift estimate for one device clock"""
+
+    def __init__(self, bucket_s: float = 1.0, max_buckets: int = 120,
+                 period_ms: int = TICKS_PERIOD, restart_ms: int = 1000):
+        self.bucket_s = bucket_s
+        self.period_ms = period_ms
+        self.restart_ms = restart_ms  # Ticks going back further than this means the device rebooted
+        self.resets = 0
+        self._points = deque(maxlen=max_buckets)  # (device_s, min host - device) per bucket
+        self._reset_state()
+
+    def _reset_state(self):
+        self._points.clear()
+        self._last_raw: Optional[int] = None
+        self._wraps = 0
+        self._bucket: Optional[int] = None
+        self._bucket_x = 0.0
+        self._bucket_min = 0.0
+        self.offset = 0.0  # Host seconds at device time 0
+        self.drift = 0.0  # Host seconds gained per device second
+
+    def unwrap(self, ticks_ms: int) -> float:
+        """Device time in seconds since boot, continuous across ticks wraparound"""
+        last = self._last_raw
+        if last is not None and ticks_ms < last:
+            if last - ticks_ms > self.period_ms // 2:
+                self._wraps += 1
+            elif last - ticks_ms > self.restart_ms:
+                logger.info("Device clock went backwards - restarting clock alignment")
+                self.resets += 1
+                self._reset_state()
+            else:
+                # Late frame; don't let it move the wrap reference backwards
+                return (self._wraps * self.period_ms + ticks_ms) / 1000.0
+        self._last_raw = ticks_ms
+        return (self._wraps * self.period_ms + ticks_ms) / 1000.0
+
+    def align(self, ticks_ms: int, host_time: float) -> float:
+        """Feed one (device ticks, host receive time) pair and return corrected host time"""
+        device_s = self.unwrap(ticks_ms)
+        lag = host_time - device_s
+        bucket = int(device_s // self.bucket_s)
+
+        if bucket != self._bucket:
+            if self._bucket is not None:
+                self._points.append((self._bucket_x, self._bucket_min))
+                self._fit()
+            self._bucket = bucket
+            self._bucket_x = device_s
+            self._bucket_min = lag
+        elif lag < self._bucket_min:
+            self._bucket_x = device_s
+            self._bucket_min = lag
+
+        if not self._points:
+            # Nothing fitted yet: best guess is the current bucket's minimum
+            return device_s + self._bucket_min
+        return device_s + self.offset + self.drift * device_s
+
+    def _fit(self):
+        """Least-squares line through the bucket minima"""
+        points = self._points
+        n = len(points)
+        mean_x = sum(x for x, _ in points) / n
+        mean_y = sum(y for _, y in points) / n
+        sxx = sum((x - mean_x) ** 2 for x, _ in points)
+        if n < 2 or sxx == 0:
+            self.drift = 0.0
+            self.offset = mean_y
+            return
+        sxy = sum((x - mean_x) * (y - mean_y) for x, y in points)
+        self.drift = sxy / sxx
+        self.offset = mean_y - self.drift * mean_x
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "offset_s": round(self.offset, 4),
+            "drift_ppm": round(self.drift * 1e6, 2),
+            "buckets": len(self._points),
+            "resets": self.resets
+        }
@@ -0,0 +1,346 @@
+"""
+Registry of concurrently connected serial devices (one per piezo tile)
+
+Each SerialDevice owns its port, reader task, StreamDecoder (format
+detection, sequence and clock tracking) and reconnect setting. Raw chunks
+are handed, with the device they came from, to a single `on_chunk`
+coroutine supplied by the server (the ingest pipeline, which decodes them
+with the device's StreamDecoder), so the servers no longer keep a global
+serial_connection.
+
+The reader task doubles as a supervisor: a read error or a stall (no bytes
+for `stall_timeout` seconds) closes the port, which is then reopened with
+jittered exponential backoff. The StreamDecoder survives the reopen, so a
+line or frame cut in half by the drop is completed by the next bytes.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Optional, Dict, Any, Callable, Awaitable, Iterable, List
+
+import serial
+
+from sensor_parser import DeviceParser, MODE_BINARY_COMMAND
+from serial_ingest import open_reader, StreamDecoder, READER_THREAD
+from serial_io import open_serial, write_serial, close_serial
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEVICE_ID = "default"
+
+ChunkHandler = Callable[["SerialDevice", bytes], Awaitable[None]]
+VerifiedHandler = Callable[["SerialDevice"], None]
+
+def backoff_delay(attempt: int, initial: float, maximum: float) -> float:
+    """Exponential backoff with jitter: uniform in [d/2, d] for d = initial * 2**attempt"""
+    delay = min(maximum, initial * (2 ** attempt))
+    return random.uniform(delay / 2, delay)
+
+class LinkHealth:
+    """Reconnects, stalls and downtime for one device"""
+
+    def __init__(self):
+        self.reconnects = 0
+        self.failed_attempts = 0
+        self.errors = 0
+        self.stalls = 0
+        self.last_error: Optional[str] = None
+        self.downtime = 0.0
+        self.down_since: Optional[float] = None
+
+    def link_down(self, reason: str):
+        self.last_error = reason
+        if self.down_since is None:
+            self.down_since = time.monotonic()
+
+    def link_up(self) -> float:
+        """Record a successful reopen; returns how long the link was down"""
+        if self.down_since is None:
+            return 0.0
+        outage = time.monotonic() - self.down_since
+        self.downtime += outage
+        self.down_since = None
+        self.reconnects += 1
+        return outage
+
+    def as_dict(self) -> Dict[str, Any]:
+        current = time.monotonic() - self.down_since if self.down_since is not None else 0.0
+        return {
+            "reconnects": self.reconnects,
+            "failed_attempts": self.failed_attempts,
+            "errors": self.errors,
+            "stalls": self.stalls,
+            "last_error": self.last_error,
+            "downtime_s": round(self.downtime + current, 2),
+            "down_for_s": round(current, 2)
+        }
+
+class SerialDevice:
+    """One serial link and the task that reads it"""
+
+    def __init__(self, device_id: str, port: str, baudrate: int = 9600,
+                 reader_mode: str = READER_THREAD, poll_interval: float = 0.01,
+                 prefer_binary: bool = False, reconnect: bool = True,
+                 backoff_initial: float = 0.5, backoff_max: float = 30.0,
+                 stall_timeout: Optional[float] = 10.0, open_timeout: float = 5.0,
+                 detect_frames: int = 3, redetect_failures: int = 20):
+        self.device_id = device_id
+        self.port = port
+        self.baudrate = baudrate
+        self.reader_mode = reader_mode
+        self.poll_interval = poll_interval
+        self.prefer_binary = prefer_binary
+        self.reconnect = reconnect
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.stall_timeout = stall_timeout  # None or 0 disables stall detection
+        self.open_timeout = open_timeout
+        self.detect_frames = detect_frames
+        self.redetect_failures = redetect_failures
+        self.connection: Optional[serial.Serial] = None
+        self.reader = None
+        self.decoder: Optional[StreamDecoder] = None
+        self.task: Optional[asyncio.Task] = None
+        self.health = LinkHealth()
+        self.verified = False  # Has this port produced a valid frame yet
+        self.on_verified: Optional[VerifiedHandler] = None
+        self._verified_event = asyncio.Event()
+        self.last_data_at: Optional[float] = None
+        self._stopping = False
+        self._stalled = False
+
+    @property
+    def is_connected(self) -> bool:
+        return self.connection is not None and self.connection.is_open
+
+    async def open(self):
+        """Open the port off the loop; parsing state is kept across reopens"""
+        self.connection = await open_serial(self.port, self.baudrate, self.open_timeout, timeout=1)
+        if self.decoder is None:
+            self.decoder = StreamDecoder(DeviceParser(detect_frames=self.detect_frames,
+                                                      max_failures=self.redetect_failures))
+
+    def mark_verified(self):
+        """Called by the parse stage once the port has produced valid frames"""
+        if self.verified:
+            return
+        self.verified = True
+        self._verified_event.set()
+        if self.on_verified:
+            self.on_verified(self)
+
+    async def wait_verified(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for the port's first valid frame"""
+        try:
+            await asyncio.wait_for(self._verified_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.verified
+
+    def start(self, on_chunk: ChunkHandler):
+        """Start the background reader task (the port must already be open)"""
+        self._stopping = False
+        self.task = asyncio.create_task(self._run(on_chunk))
+
+    async def _run(self, on_chunk: ChunkHandler):
+        attempt = 0
+        while not self._stopping:
+            if self.is_connected:
+                reason = await self._read(on_chunk)
+                if self._stopping:
+                    break
+                self.health.link_down(reason)
+                logger.warning(f"[{self.device_id}] Link to {self.port} lost: {reason}")
+                attempt = 0
+            if not self.reconnect:
+                break
+
+            delay = backoff_delay(attempt, self.backoff_initial, self.backoff_max)
+            attempt += 1
+            await asyncio.sleep(delay)
+            if self._stopping:
+                break
+            try:
+                await self.open()
+            except Exception as e:
+                self.health.failed_attempts += 1
+                self.connection = None
+                logger.warning(f"[{self.device_id}] Reconnect to {self.port} failed "
+                               f"(attempt {attempt}): {e}")
+                continue
+            outage = self.health.link_up()
+            logger.info(f"[{self.device_id}] Reconnected to {self.port} after {outage:.1f}s")
+
+    async def _watch_stall(self, reader):
+        """Stop `reader` once no bytes have arrived for stall_timeout seconds"""
+        timeout = self.stall_timeout
+        while True:
+            idle = time.monotonic() - self.last_data_at
+            if idle >= timeout:
+                self._stalled = True
+                reader.stop()
+                return
+            await asyncio.sleep(timeout - idle)
+
+    async def _read(self, on_chunk: ChunkHandler) -> str:
+        """Read and decode until the port closes, errors or stalls; returns why it ended"""
+        reader = open_reader(self.connection, self.reader_mode, self.poll_interval)
+        self.reader = reader
+        device_id = self.device_id
+        self.last_data_at = time.monotonic()
+        self._stalled = False
+        watchdog = asyncio.create_task(self._watch_stall(reader)) if self.stall_timeout else None
+        reason = "port closed"
+
+        try:
+            if self.prefer_binary:
+                await write_serial(self.connection, MODE_BINARY_COMMAND, self.open_timeout)
+
+            async for chunk in reader.chunks():
+                self.last_data_at = time.monotonic()
+                await on_chunk(self, chunk)
+
+        except Exception as e:
+            if not self._stopping:
+                self.health.errors += 1
+                logger.error(f"[{device_id}] Error reading serial data: {e}")
+            reason = str(e) or type(e).__name__
+        finally:
+            if watchdog:
+                watchdog.cancel()
+            reader.stop()
+            if self.connection and self.connection.is_open and not self._stopping:
+                await close_serial(self.connection, self.open_timeout)
+
+        if self._stalled:
+            self.health.stalls += 1
+            reason = f"no data for {self.stall_timeout:g}s"
+        return reason
+
+    async def stop(self):
+        """Stop the reader task and close the port"""
+        self._stopping = True
+        if self.reader:
+            self.reader.stop()
+        if self.connection and self.connection.is_open:
+            await close_serial(self.connection, self.open_timeout)
+        if self.task and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self.task = None
+
+    def status(self) -> Dict[str, Any]:
+        decoder = self.decoder
+        reader = self.reader
+        return {
+            "device_id": self.device_id,
+            "port": self.port,
+            "baudrate": self.baudrate,
+            "connected": self.is_connected,
+            "reconnect": self.reconnect,
+            "last_data_age_s": round(time.monotonic() - self.last_data_at, 2) if self.last_data_at else None,
+            "supervisor": self.health.as_dict(),
+            "format": decoder.format if decoder else None,
+            "reader": {"mode": reader.mode, **reader.stats.as_dict()} if reader else None,
+            "link": decoder.sequence.as_dict() if decoder else None,
+            "clock": decoder.clock.as_dict() if decoder else None
+        }
+
+class DeviceRegistry:
+    """Manage N concurrent serial devices keyed by device id"""
+
+    def __init__(self, on_chunk: ChunkHandler, on_verified: Optional[VerifiedHandler] = None,
+                 **device_defaults):
+        self.on_chunk = on_chunk
+        self.on_verified = on_verified
+        self.device_defaults = device_defaults
+        self.devices: Dict[str, SerialDevice] = {}
+        self._lock: Optional[asyncio.Lock] = None  # Serializes add/remove across their awaits
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def get(self, device_id: str) -> Optional[SerialDevice]:
+        return self.devices.get(device_id)
+
+    def ids(self) -> List[str]:
+        return list(self.devices)
+
+    def ports(self) -> Dict[str, str]:
+        """Port -> id of the device reading it"""
+        return {device.port: device_id for device_id, device in self.devices.items()}
+
+    def connected_port(self, ports: Iterable[str]) -> Optional[str]:
+        """The first of `ports` that a connected device is reading, if any"""
+        by_port = {device.port: device for device in self.devices.values()}
+        for port in ports:
+            device = by_port.get(port)
+            if device is not None and device.is_connected:
+                return port
+        return None
+
+    @property
+    def any_connected(self) -> bool:
+        return any(device.is_connected for device in self.devices.values())
+
+    async def add(self, device_id: str, port: str, baudrate: int = 9600, **options) -> SerialDevice:
+        """Open `port` as `device_id`, replacing any existing device with that id
+
+        The new port is opened before the old device is stopped, so a wrong
+        or busy port leaves the existing device running. Only when the port
+        is unchanged (e.g. a new baud rate) is the old device closed first,
+        since the port can't be open twice. Concurrent calls run one at a
+        time, so the port checks still hold when the swap happens.
+        """
+        async with self.lock:
+            return await self._add(device_id, port, baudrate, **options)
+
+    async def _add(self, device_id: str, port: str, baudrate: int, **options) -> SerialDevice:
+        for other in self.devices.values():
+            if other.port == port and other.device_id != device_id:
+                raise ValueError(f"Port {port} is already used by device '{other.device_id}'")
+
+        current = self.devices.get(device_id)
+        if current is not None and current.port == port:
+            await self._remove(device_id)
+            current = None
+
+        settings = dict(self.device_defaults)
+        settings.update(options)
+        device = SerialDevice(device_id, port, baudrate, **settings)
+        device.on_verified = self.on_verified
+        await device.open()
+        if current is not None:
+            await current.stop()
+            logger.info(f"[{device_id}] Disconnected from {current.port}")
+        self.devices[device_id] = device
+        device.start(self.on_chunk)
+        logger.info(f"[{device_id}] Connected to {port} at {baudrate} baud")
+        return device
+
+    async def remove(self, device_id: str) -> bool:
+        async with self.lock:
+            return await self._remove(device_id)
+
+    async def _remove(self, device_id: str) -> bool:
+        device = self.devices.pop(device_id, None)
+        if device is None:
+            return False
+        await device.stop()
+        logger.info(f"[{device_id}] Disconnected from {device.port}")
+        return True
+
+    async def close_all(self):
+        async with self.lock:
+            for device_id in list(self.devices):
+                await self._remove(device_id)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {device_id: device.status() for device_id, device in self.devices.items()}
@@ -0,0 +1,914 @@
+"""
+Broadcast core shared by the WebSocket servers
+
+Clients are grouped into channels by what they subscribed to (rate,
+batching). A published sample goes through each channel once - decimated,
+batched and serialized there - and the resulting frame is handed to every
+matching client's own small outbound queue. Each client has a writer task,
+so publishing never waits on a socket and a slow viewer only ever delays
+itself:
+
+    - while a client keeps up it gets every frame
+    - once its queue is full, further samples are coalesced per device into
+      the latest sample plus a min/max/count summary of what was skipped
+      (batch frames can't be merged, so the oldest one is dropped instead)
+    - a client that stays behind for `evict_after` seconds, or whose send
+      takes longer than `send_timeout`, is evicted
+
+Clients may change their subscription by sending JSON such as
+
+    {"type": "subscribe", "rate": 10, "batch": {"ms": 250, "max": 100}}
+
+`rate` (Hz, or "full") decimates to at most one frame per device per
+1/rate seconds, carrying the latest sample and the min/max of everything in
+between, so short piezo spikes still show up. `batch` (or `true` for the
+defaults) packs a device's samples into column-oriented frames flushed
+every `ms` milliseconds or `max` samples:
+
+    {"type": "batch", "device": "tile1", "t0": <epoch ms>, "dt": [0, 1, ...],
+     "v": [...], "p": [...], "e": [...], "s": [...], "led": "OFF"}
+
+Decimated batches also carry "vmin"/"vmax" columns and "esum", the energy
+of all the samples each entry stands for (the summary's "energy_sum"). With
+`"encoding": "delta"` the numeric columns are instead quantised to integers
+at the dashboard's display precision (mV, uW, ...; see DELTA_SCALE) and
+sent as differences from the previous sample, which compresses far better
+under permessage-deflate:
+
+    {"type": "batch", "encoding": "delta", "scale": {"v": 1000, ...},
+     "dt": [0, 1, 1, ...], "v": [1234, -3, 2, ...], ...}
+
+A running sum of a column divided by its scale gives the values back.
+Each batch starts from an absolute value, so deltas only pay off across
+many samples: a delta subscription without `batch` is batched with the
+defaults (BATCH_MS / BATCH_MAX), widened at low rates to hold
+DELTA_BATCH_SAMPLES decimated samples.
+
+A subscription can also narrow what a client receives: `"devices": ["tile1"]`
+(null for every device) and `"fields": ["voltage"]` (null for all fields).
+Fields are part of the channel, so each projected frame is still built once
+for every client that asked for the same thing; batch frames leave out the
+columns for fields that were not asked for. Timing ("timestamp", or "t0" and
+"dt" in batches) is always sent, like "device".
+
+With a History attached, every published sample is also kept in a
+per-device ring buffer, and a client that connects first receives one
+"snapshot" frame per device - a batch with "type": "snapshot" covering the
+last `History.seconds` - so its chart starts full instead of empty.
+
+Clients that negotiate the `piezo.binary.v1` WebSocket subprotocol get the
+same batches as binary frames (see Columns.pack): a little-endian header
+followed by uint32/float32 columns aligned so a browser can wrap them in
+typed-array views without copying. Without batching, binary clients get
+each sample as a batch of one. JSON stays the default and is
+easier to debug.
+
+Clients are transport-agnostic - anything with an async `send(frame)`
+(Starlette's send_text/send_bytes, websockets' send) can be registered.
+Server-Sent Events clients (Fanout.add_stream) have no writer task: the
+HTTP response iterates FanoutClient.stream, which pulls everything queued
+since its last write as one chunk. Their frames are wrapped as
+"data: ...\n\n" events in their own channels, so that too happens once
+per frame rather than once per client. The subscription comes from the URL
+query (see query_subscription) instead of a message.
+"""
+import sys
+import json
+import time
+import struct
+import math
+import asyncio
+import logging
+from array import array
+from datetime import datetime
+from collections import deque
+from typing import (Optional, Dict, Any, Callable, Awaitable, List, Hashable, Tuple, Union, FrozenSet,
+                    Mapping, AsyncIterator)
+
+from history import History
+
+logger = logging.getLogger(__name__)
+
+Frame = Union[str, bytes]
+SendFunc = Callable[[Frame], Awaitable[None]]
+CloseFunc = Callable[[], Awaitable[None]]
+
+# Fields whose range is kept while samples are coalesced
+SUMMARY_FIELDS = ('voltage', 'power')
+
+RATE_FULL = "full"
+MAX_RATE = 1000.0
+
+# Defaults for {"batch": true}
+BATCH_MS = 100
+BATCH_MAX = 100
+# A delta subscription without `batch` gets a window holding at least this
+# many decimated samples, so a low rate still has something to delta against
+DELTA_BATCH_SAMPLES = 10
+
+ENCODING_JSON = "json"
+ENCODING_DELTA = "delta"
+ENCODING_BINARY = "binary"
+TEXT_ENCODINGS = (ENCODING_JSON, ENCODING_DELTA)
+
+# Batch column -> the sample field it carries
+# (t0/dt are timing, sent like the device id whatever the subscribed fields)
+COLUMN_FIELDS = {"v": "voltage", "p": "power", "e": "energy", "s": "steps",
+                 "led": "led", "vmin": "voltage", "vmax": "voltage", "esum": "energy"}
+
+# Integer steps per unit for delta batches: mV, uW and a millionth of the
+# energy unit - the precision app.js displays
+DELTA_SCALE = {"v": 1000, "p": 1000000, "e": 1000000, "vmin": 1000, "vmax": 1000, "esum": 1000000}
+SUBPROTOCOL_BINARY = "piezo.binary.v1"
+
+# Binary batch header: magic, version, flags, sample count, t0 (epoch ms),
+# LED state, device id length; then the device id (UTF-8), zero padding to a
+# multiple of 4 bytes and the columns: dt uint32, v/p/e float32, s uint32,
+# vmin/vmax float32 if FLAG_RANGE is set and esum float32 if FLAG_ENERGY_SUM is
+BINARY_MAGIC = b'PZ'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<2sBBIdBB')
+FLAG_RANGE = 0x01
+FLAG_SNAPSHOT = 0x40
+FLAG_ENERGY_SUM = 0x80
+# Set when a column was left out by a field-selective subscription (0x02 is unused)
+FLAG_NO_COLUMN = {"v": 0x04, "p": 0x08, "e": 0x10, "s": 0x20}
+LED_STATES = {'OFF': 0, 'ON': 1}
+LED_UNKNOWN = 255
+
+# Server-Sent Events: comment written to idle streams so proxies keep them
+# open, and the reconnect delay (ms) sent to EventSource when a stream opens
+SSE_HEARTBEAT = ": keepalive\n\n"
+SSE_RETRY_MS = 2000
+
+def rate_interval(rate: Any) -> float:
+    """Seconds between frames for a subscribed rate; 0 means every sample"""
+    if rate is None or rate == RATE_FULL:
+        return 0.0
+    rate = float(rate)
+    if rate <= 0:
+        raise ValueError(f"rate must be positive or '{RATE_FULL}', got {rate:g}")
+    return 0.0 if rate >= MAX_RATE else 1.0 / rate
+
+def quantised_deltas(values: List[Any], scale: int) -> List[int]:
+    """round(value * scale), each as the difference from the previous one"""
+    deltas = []
+    previous = 0
+    for value in values:
+        current = round((value or 0) * scale)
+        deltas.append(current - previous)
+        previous = current
+    return deltas
+
+def project(message: Dict[str, Any], fields: Optional[Tuple[str, ...]]) -> Dict[str, Any]:
+    """Only the subscribed fields of a sample (plus its device, timestamp and any summary of them)"""
+    if fields is None:
+        return message
+    projected = {field: message[field] for field in fields if field in message}
+    for key in ('device', 'timestamp'):
+        if key in message:
+            projected[key] = message[key]
+    summary = message.get('summary')
+    if summary is not None:
+        projected['summary'] = {key: value for key, value in summary.items()
+                                if key == 'count' or key.rsplit('_', 1)[0] in fields}
+    return projected
+
+def sse_event(data: str) -> str:
+    """One Server-Sent Event carrying a JSON frame (which never contains a newline)"""
+    return f"data: {data}\n\n"
+
+def query_subscription(params: Mapping[str, str]) -> Dict[str, Any]:
+    """Subscribe message from URL query parameters
+
+    e.g. ?rate=10&fields=voltage,power&devices=tile1&batch=250&batch_max=100
+    &encoding=delta; `batch` is a window in ms, or "true"/"false".
+    """
+    message: Dict[str, Any] = {"type": "subscribe"}
+    if "rate" in params:
+        message["rate"] = params["rate"]
+    for name in ("fields", "devices"):
+        if name in params:
+            message[name] = [value for value in params[name].split(',') if value]
+    batch = params.get("batch")
+    if batch in ("true", "false"):
+        message["batch"] = batch == "true"
+    elif batch is not None:
+        try:
+            message["batch"] = {"ms": int(batch), "max": int(params.get("batch_max", BATCH_MAX))}
+        except ValueError:
+            raise ValueError(f"batch must be a number of ms, 'true' or 'false', got {batch!r}")
+    if "encoding" in params:
+        message["encoding"] = params["encoding"]
+    return message
+
+def sample_time(message: Dict[str, Any]) -> float:
+    """Epoch seconds of a sample, from its ISO timestamp"""
+    timestamp = message.get('timestamp')
+    if timestamp:
+        try:
+            return datetime.fromisoformat(timestamp).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+class Coalesced:
+    """Latest sample for one device plus the range of everything folded into it"""
+
+    __slots__ = ("latest", "count", "low", "high", "energy_sum")
+
+    def __init__(self, message: Dict[str, Any]):
+        self.latest = message
+        self.count = 0
+        self.low: Dict[str, Any] = {}
+        self.high: Dict[str, Any] = {}
+        self.energy_sum: Optional[float] = None  # Energy is per sample, so skipped samples' is added up
+        self.fold(message)
+
+    def fold(self, message: Dict[str, Any]):
+        """Add a sample, or an already decimated one whose summary covers several"""
+        self.latest = message
+        low = self.low
+        high = self.high
+        summary = message.get('summary')
+        if summary is None:
+            self.count += 1
+            energy = message.get('energy')
+            if energy is not None:
+                self.energy_sum = energy if self.energy_sum is None else self.energy_sum + energy
+            for field in SUMMARY_FIELDS:
+                value = message.get(field)
+                if value is None:
+                    continue
+                if field not in low:
+                    low[field] = high[field] = value
+                elif value < low[field]:
+                    low[field] = value
+                elif value > high[field]:
+                    high[field] = value
+            return
+
+        # Merge ranges rather than keep only the newest, so a spike survives a second fold
+        self.count += summary.get('count', 1)
+        energy = summary.get('energy_sum', message.get('energy'))
+        if energy is not None:
+            self.energy_sum = energy if self.energy_sum is None else self.energy_sum + energy
+        for field in SUMMARY_FIELDS:
+            value_low = summary.get(f"{field}_min", message.get(field))
+            value_high = summary.get(f"{field}_max", message.get(field))
+            if value_low is None:
+                continue
+            if field not in low:
+                low[field] = value_low
+                high[field] = value_high
+            else:
+                if value_low < low[field]:
+                    low[field] = value_low
+                if value_high > high[field]:
+                    high[field] = value_high
+
+    def message(self) -> Dict[str, Any]:
+        message = dict(self.latest)
+        summary = {"count": self.count}
+        for field, value in self.low.items():
+            summary[f"{field}_min"] = value
+            summary[f"{field}_max"] = self.high[field]
+        if self.energy_sum is not None:
+            summary["energy_sum"] = self.energy_sum
+        message["summary"] = summary
+        return message
+
+class Columns:
+    """One device's samples, column by column, waiting for a batch frame"""
+
+    __slots__ = ("kind", "t0", "dt", "v", "p", "e", "s", "vmin", "vmax", "esum", "led")
+
+    def __init__(self, kind: str = "batch"):
+        self.kind = kind
+        self.t0: Optional[float] = None
+        self.dt: List[int] = []
+        self.v: List[float] = []
+        self.p: List[float] = []
+        self.e: List[float] = []
+        self.s: List[int] = []
+        self.vmin: List[float] = []
+        self.vmax: List[float] = []
+        self.esum: List[float] = []  # Energy of every sample a decimated one stands for
+        self.led = None
+
+    def __len__(self) -> int:
+        return len(self.dt)
+
+    @classmethod
+    def from_window(cls, window: Dict[str, Any], led: Any = None) -> "Columns":
+        """A snapshot from History.window() columns"""
+        columns = cls("snapshot")
+        t = window["t"]
+        t0 = columns.t0 = t[0]
+        columns.dt = [max(0, round((x - t0) * 1000)) for x in t]
+        for name in ("v", "p", "e"):
+            setattr(columns, name, [None if math.isnan(x) else x for x in window[name]])
+        columns.s = window["s"].tolist()
+        columns.vmin = window.get("vmin", [])
+        columns.vmax = window.get("vmax", [])
+        columns.led = led
+        return columns
+
+    def append(self, message: Dict[str, Any]):
+        t = sample_time(message)
+        if self.t0 is None:
+            self.t0 = t
+        self.dt.append(max(0, round((t - self.t0) * 1000)))
+        voltage = message.get('voltage')
+        energy = message.get('energy')
+        self.v.append(voltage)
+        self.p.append(message.get('power'))
+        self.e.append(energy)
+        self.s.append(message.get('steps'))
+        self.led = message.get('led', self.led)
+        summary = message.get('summary')
+        if summary is None:
+            if self.vmax:
+                # Range columns already started: a plain sample's range is just its value
+                self.vmin.append(voltage)
+                self.vmax.append(voltage)
+                self.esum.append(energy)
+            return
+        start = len(self.vmax)
+        if start < len(self.v) - 1:
+            # The first summarised sample of the batch: earlier ones get their own values
+            self.vmin.extend(self.v[start:-1])
+            self.vmax.extend(self.v[start:-1])
+            self.esum.extend(self.e[start:-1])
+        self.vmin.append(summary.get('voltage_min', voltage))
+        self.vmax.append(summary.get('voltage_max', voltage))
+        self.esum.append(summary.get('energy_sum', energy))
+
+    def frame(self, device_id: Optional[str], fields: Optional[Tuple[str, ...]] = None) -> Dict[str, Any]:
+        frame = {
+            "type": self.kind,
+            "device": device_id,
+            "t0": round(self.t0 * 1000, 3),
+            "dt": self.dt,
+            "v": self.v,
+            "p": self.p,
+            "e": self.e,
+            "s": self.s,
+            "led": self.led
+        }
+        if self.vmax:
+            frame["vmin"] = self.vmin
+            frame["vmax"] = self.vmax
+        if self.esum:
+            frame["esum"] = self.esum
+        if fields is not None:
+            for column, field in COLUMN_FIELDS.items():
+                if field not in fields:
+                    frame.pop(column, None)
+        return frame
+
+    def delta_frame(self, device_id: Optional[str], fields: Optional[Tuple[str, ...]] = None) -> Dict[str, Any]:
+        """frame() with quantised, delta-coded columns"""
+        frame = self.frame(device_id, fields)
+        frame["encoding"] = ENCODING_DELTA
+        for column in ("dt", "s"):
+            if column in frame:
+                frame[column] = quantised_deltas(frame[column], 1)
+        scales = {}
+        for column, scale in DELTA_SCALE.items():
+            if column in frame:
+                frame[column] = quantised_deltas(frame[column], scale)
+                scales[column] = scale
+        frame["scale"] = scales
+        return frame
+
+    def encode(self, device_id: Optional[str], encoding: str, fields: Optional[Tuple[str, ...]] = None) -> Frame:
+        if encoding == ENCODING_BINARY:
+            return self.pack(device_id, fields)
+        if encoding == ENCODING_DELTA:
+            return json.dumps(self.delta_frame(device_id, fields), separators=(',', ':'))
+        return json.dumps(self.frame(device_id, fields))
+
+    def pack(self, device_id: Optional[str], fields: Optional[Tuple[str, ...]] = None) -> bytes:
+        """The batch as a binary frame (layout at BINARY_HEADER)"""
+        name = (device_id or '').encode('utf-8')[:255]
+        wanted = {column for column, field in COLUMN_FIELDS.items() if fields is None or field in fields}
+        flags = FLAG_RANGE if self.vmax and "vmax" in wanted else 0
+        if self.esum and "esum" in wanted:
+            flags |= FLAG_ENERGY_SUM
+        if self.kind == "snapshot":
+            flags |= FLAG_SNAPSHOT
+        for column, flag in FLAG_NO_COLUMN.items():
+            if column not in wanted:
+                flags |= flag
+        header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, flags, len(self.dt), self.t0 * 1000,
+                                    LED_STATES.get(self.led, LED_UNKNOWN), len(name)) + name
+        parts = [header, b'\0' * (-len(header) % 4)]
+        nan = float('nan')
+
+        def floats(values: List[Any]) -> array:
+            # Missing values (a sample without that field) are sent as NaN
+            return array('f', [nan if x is None else x for x in values])
+
+        columns = []
+        columns.append(array('I', self.dt))
+        for column in ("v", "p", "e"):
+            if column in wanted:
+                columns.append(floats(getattr(self, column)))
+        if "s" in wanted:
+            columns.append(array('I', [x or 0 for x in self.s]))
+        if flags & FLAG_RANGE:
+            columns.append(floats(self.vmin))
+            columns.append(floats(self.vmax))
+        if flags & FLAG_ENERGY_SUM:
+            columns.append(floats(self.esum))
+        for column in columns:
+            if sys.byteorder == 'big':
+                column.byteswap()
+            parts.append(column.tobytes())
+        return b''.join(parts)
+
+class Subscription:
+    """What a client asked for; clients with equal keys share one Channel"""
+
+    __slots__ = ("rate", "interval", "batch_ms", "batch_max", "encoding", "fields", "sse")
+
+    def __init__(self, rate: Any = RATE_FULL, batch_ms: int = 0, batch_max: int = 0,
+                 encoding: str = ENCODING_JSON, fields: Optional[List[str]] = None, sse: bool = False):
+        self.encoding = encoding
+        self.sse = sse  # Frames are wrapped as Server-Sent Events
+        if fields is not None:
+            if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+                raise ValueError(f"fields must be a list of field names, got {fields!r}")
+            fields = tuple(sorted(set(fields)))
+        self.fields: Optional[Tuple[str, ...]] = fields
+        self.interval = rate_interval(rate)
+        self.rate = rate if self.interval else RATE_FULL
+        if (batch_ms or batch_max) and (batch_ms <= 0 or batch_max <= 0):
+            raise ValueError("batch needs positive 'ms' and 'max'")
+        if encoding == ENCODING_DELTA and not batch_max:
+            # A batch of one starts from an absolute value, so there would be nothing to delta
+            batch_ms = max(BATCH_MS, round(self.interval * 1000 * DELTA_BATCH_SAMPLES))
+            batch_max = BATCH_MAX
+        self.batch_ms = int(batch_ms)
+        self.batch_max = int(batch_max)
+
+    @classmethod
+    def from_message(cls, message: Dict[str, Any], encoding: str = ENCODING_JSON,
+                     sse: bool = False) -> "Subscription":
+        """Parse a subscribe message; `encoding` is the connection's (binary can't change)"""
+        requested = message.get("encoding", encoding)
+        if requested != encoding and (encoding == ENCODING_BINARY or requested not in TEXT_ENCODINGS):
+            raise ValueError(f"encoding '{requested}' is not available on a {encoding} connection")
+        batch = message.get("batch")
+        if batch is True:
+            batch = {}
+        if batch is None or batch is False:
+            batch_ms = batch_max = 0
+        elif isinstance(batch, dict):
+            batch_ms = batch.get("ms", BATCH_MS)
+            batch_max = batch.get("max", BATCH_MAX)
+        else:
+            raise ValueError(f"batch must be true, false or {{'ms': ..., 'max': ...}}, got {batch!r}")
+        return cls(message.get("rate", RATE_FULL), batch_ms, batch_max, requested, message.get("fields"), sse)
+
+    @property
+    def key(self) -> Tuple:
+        return (self.interval, self.batch_ms, self.batch_max, self.encoding, self.fields, self.sse)
+
+    @property
+    def batched(self) -> bool:
+        return self.batch_max > 0
+
+    def describe(self) -> str:
+        batch = f", batch {self.batch_ms} ms/{self.batch_max}" if self.batched else ""
+        fields = f", fields {','.join(self.fields)}" if self.fields is not None else ""
+        transport = "sse " if self.sse else ""
+        return f"{transport}{self.encoding}, rate {self.rate}{batch}{fields}"
+
+class FanoutClient:
+    """One connected viewer: its outbound queue and writer task (or stream)"""
+
+    def __init__(self, key: Hashable, send: Optional[SendFunc], device_id: Optional[str] = None,
+                 close: Optional[CloseFunc] = None, max_queue: int = 32, encoding: str = ENCODING_JSON,
+                 sse: bool = False):
+        self.key = key
+        self.send = send
+        self.close = close
+        self.encoding = encoding  # Fixed by the WebSocket subprotocol
+        self.sse = sse
+        self.devices: Optional[FrozenSet[str]] = None if device_id is None else frozenset([device_id])
+        self.max_queue = max_queue
+        self.channel: Optional["Channel"] = None
+        self.queue = deque()
+        self.coalesced: Dict[Optional[str], Coalesced] = {}
+        self.behind_since: Optional[float] = None
+        self.sending_since: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.send_timeout = 1.0
+        self.timed_out = False
+        self._watchdog: Optional[asyncio.TimerHandle] = None
+        self._wake = asyncio.Event()
+        self.sent = 0
+        self.folded = 0
+        self.dropped = 0
+
+    def wants(self, device_id: Optional[str]) -> bool:
+        return self.devices is None or device_id in self.devices
+
+    def offer(self, frame: Frame, message: Optional[Dict[str, Any]], device_id: Optional[str]):
+        """Queue an encoded frame; `message` is the single sample it holds (None for batches)"""
+        if not self.coalesced and len(self.queue) < self.max_queue:
+            self.queue.append(frame)
+        elif message is None:
+            if len(self.queue) >= self.max_queue:
+                self.queue.popleft()
+                self.dropped += 1
+            self.queue.append(frame)
+            self._fell_behind()
+        else:
+            entry = self.coalesced.get(device_id)
+            if entry is None:
+                self.coalesced[device_id] = Coalesced(message)
+            else:
+                entry.fold(message)
+            self.folded += 1
+            self._fell_behind()
+        self._wake.set()
+
+    def _fell_behind(self):
+        if self.behind_since is None:
+            self.behind_since = time.monotonic()
+
+    def _next_frame(self) -> Optional[Frame]:
+        if self.queue:
+            return self.queue.popleft()
+        if self.coalesced:
+            device_id = next(iter(self.coalesced))
+            frame = json.dumps(self.coalesced.pop(device_id).message())
+            return sse_event(frame) if self.sse else frame
+        return None
+
+    async def run(self, fanout: "Fanout"):
+        """Writer task: drain the queue, then any coalesced samples; evicts itself on a send error or timeout"""
+        self.send_timeout = fanout.send_timeout
+        try:
+            while True:
+                await self._wake.wait()
+                self._wake.clear()
+                while True:
+                    frame = self._next_frame()
+                    if frame is None:
+                        break
+                    self.sending_since = time.monotonic()
+                    if self._watchdog is None:
+                        self._watchdog = asyncio.get_running_loop().call_later(self.send_timeout, self._check_send)
+                    try:
+                        await self.send(frame)
+                    except asyncio.CancelledError:
+                        if not self.timed_out:
+                            raise
+                        fanout.timeouts += 1
+                        logger.warning(f"WebSocket send timed out after {self.send_timeout:g}s - dropping client")
+                        self.sending_since = None
+                        fanout.evict(self)
+                        return
+                    except Exception as e:
+                        fanout.errors += 1
+                        logger.error(f"Error sending to WebSocket: {e}")
+                        self.sending_since = None
+                        fanout.evict(self)
+                        return
+                    self.sending_since = None
+                    self.sent += 1
+                self.behind_since = None  # Caught up
+        finally:
+            if self._watchdog is not None:
+                self._watchdog.cancel()
+
+    def _check_send(self):
+        """Cancel the writer task if its current send has taken longer than send_timeout
+
+        Like wrapping each send in asyncio.wait_for, but one timer per
+        client, re-armed at most once per timeout, instead of a task and a
+        timer for every frame.
+        """
+        self._watchdog = None
+        if self.sending_since is None:
+            return  # Idle; the next send re-arms it
+        remaining = self.sending_since + self.send_timeout - time.monotonic()
+        if remaining > 0:
+            self._watchdog = asyncio.get_running_loop().call_later(remaining, self._check_send)
+        else:
+            self.timed_out = True
+            self.task.cancel()
+
+    async def stream(self, heartbeat: float = 15.0) -> AsyncIterator[str]:
+        """Writer for streaming HTTP responses, pulled by the server instead of a task
+
+        Each item is everything queued since the previous one joined into a
+        single chunk, or SSE_HEARTBEAT when a whole `heartbeat` period went
+        by without a write. While the server writes a chunk, new frames
+        queue and coalesce as they would behind a slow WebSocket. Ends once
+        the client is removed.
+        """
+        loop = asyncio.get_running_loop()
+        idle = False
+        beat: Optional[asyncio.TimerHandle] = None
+
+        def check_idle():
+            # One timer per stream rather than a timeout per wakeup
+            nonlocal idle, beat
+            if idle:
+                self._wake.set()
+            idle = True
+            beat = loop.call_later(heartbeat, check_idle)
+
+        check_idle()
+        try:
+            while self.channel is not None:
+                await self._wake.wait()
+                self._wake.clear()
+                frames = []
+                frame = self._next_frame()
+                while frame is not None:
+                    frames.append(frame)
+                    frame = self._next_frame()
+                if frames:
+                    self.sent += len(frames)
+                    self.behind_since = None  # Caught up
+                elif idle and self.channel is not None:
+                    frames.append(SSE_HEARTBEAT)
+                else:
+                    continue
+                idle = False
+                self.sending_since = time.monotonic()
+                yield ''.join(frames)
+                self.sending_since = None
+        finally:
+            beat.cancel()
+
+class Channel:
+    """Clients sharing one subscription; every frame is built and encoded once for all of them"""
+
+    def __init__(self, subscription: Subscription):
+        self.subscription = subscription
+        self.clients: Dict[Hashable, FanoutClient] = {}
+        self.pending: Dict[Optional[str], Coalesced] = {}  # Being decimated
+        self.next_slot = 0.0
+        self.columns: Dict[Optional[str], Columns] = {}  # Being batched
+        self._decimate_timer: Optional[asyncio.TimerHandle] = None
+        self._batch_timers: Dict[Optional[str], asyncio.TimerHandle] = {}
+        self.frames = 0
+        self.decimated = 0
+
+    def wants(self, device_id: Optional[str]) -> bool:
+        return any(client.wants(device_id) for client in self.clients.values())
+
+    def publish(self, message: Dict[str, Any], device_id: Optional[str]):
+        interval = self.subscription.interval
+        if not interval:
+            self.emit(message, device_id)
+            return
+        entry = self.pending.get(device_id)
+        if entry is None:
+            self.pending[device_id] = Coalesced(message)
+        else:
+            entry.fold(message)
+        self.decimated += 1
+        if self._decimate_timer is None:
+            delay = max(0.0, self.next_slot - time.monotonic())
+            self._decimate_timer = asyncio.get_running_loop().call_later(delay, self._flush_decimated)
+
+    def _flush_decimated(self):
+        self._decimate_timer = None
+        self.next_slot = time.monotonic() + self.subscription.interval
+        pending = self.pending
+        self.pending = {}
+        for device_id, entry in pending.items():
+            self.emit(entry.message(), device_id)
+
+    def emit(self, message: Dict[str, Any], device_id: Optional[str]):
+        """Send one (possibly decimated) sample on, directly or via a batch"""
+        subscription = self.subscription
+        if not subscription.batched:
+            if subscription.encoding == ENCODING_JSON:
+                message = project(message, subscription.fields)
+                self.deliver(json.dumps(message), message, device_id)
+            else:
+                columns = Columns()
+                columns.append(message)
+                self.deliver(columns.encode(device_id, subscription.encoding, subscription.fields), None, device_id)
+            return
+        columns = self.columns.get(device_id)
+        if columns is None:
+            columns = self.columns[device_id] = Columns()
+            self._batch_timers[device_id] = asyncio.get_running_loop().call_later(
+                subscription.batch_ms / 1000, self._flush_batch, device_id)
+        columns.append(message)
+        if len(columns) >= subscription.batch_max:
+            self._flush_batch(device_id)
+
+    def _flush_batch(self, device_id: Optional[str]):
+        timer = self._batch_timers.pop(device_id, None)
+        if timer is not None:
+            timer.cancel()
+        columns = self.columns.pop(device_id, None)
+        if columns:
+            subscription = self.subscription
+            self.deliver(columns.encode(device_id, subscription.encoding, subscription.fields), None, device_id)
+
+    def deliver(self, frame: Frame, message: Optional[Dict[str, Any]], device_id: Optional[str]):
+        self.frames += 1
+        if self.subscription.sse:
+            frame = sse_event(frame)
+        for client in self.clients.values():
+            if client.wants(device_id):
+                client.offer(frame, message, device_id)
+
+    def close(self):
+        if self._decimate_timer is not None:
+            self._decimate_timer.cancel()
+        for timer in self._batch_timers.values():
+            timer.cancel()
+        self._batch_timers.clear()
+
+class Fanout:
+    """Build each frame once per subscription, queue it to every matching client, never wait on a socket"""
+
+    def __init__(self, send_timeout: float = 1.0, max_queue: int = 32, evict_after: float = 10.0,
+                 history: Optional[History] = None):
+        self.send_timeout = send_timeout
+        self.max_queue = max_queue
+        self.evict_after = evict_after
+        self.history = history  # Recent samples for snapshots on connect
+        self.clients: Dict[Hashable, FanoutClient] = {}
+        self.channels: Dict[Tuple, Channel] = {}
+        self.messages = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def add(self, key: Hashable, send: SendFunc, device_id: Optional[str] = None,
+            close: Optional[CloseFunc] = None, encoding: str = ENCODING_JSON) -> FanoutClient:
+        """Register a client at full rate and start its writer task (call from the event loop)
+
+        `send` must accept bytes for ENCODING_BINARY clients, text otherwise.
+        """
+        self.remove(key)
+        client = FanoutClient(key, send, device_id, close, self.max_queue, encoding)
+        client.task = asyncio.get_running_loop().create_task(client.run(self))
+        self.clients[key] = client
+        self._join(client, Subscription(encoding=encoding))
+        self._hydrate(client)
+        return client
+
+    def add_stream(self, key: Hashable, message: Optional[Dict[str, Any]] = None,
+                   close: Optional[CloseFunc] = None) -> FanoutClient:
+        """Register a Server-Sent Events client; the response iterates `client.stream()`
+
+        `message` is an optional subscription (see query_subscription);
+        raises ValueError, leaving nothing registered, if it is invalid.
+        """
+        self.remove(key)
+        client = FanoutClient(key, None, None, close, self.max_queue, ENCODING_JSON, sse=True)
+        self.clients[key] = client
+        self._join(client, Subscription(sse=True))
+        try:
+            self.subscribe(key, message or {})
+        except ValueError:
+            self.remove(key)
+            raise
+        self._hydrate(client)
+        return client
+
+    def _hydrate(self, client: FanoutClient):
+        """Queue a snapshot of each wanted device's recent samples, encoded as the client subscribed"""
+        history = self.history
+        if history is None:
+            return
+        subscription = client.channel.subscription
+        for device_id in history.devices():
+            if not client.wants(device_id):
+                continue
+            window = history.window(device_id)
+            if window is None:
+                continue
+            columns = Columns.from_window(window, history.rings[device_id].led)
+            frame = columns.encode(device_id, subscription.encoding, subscription.fields)
+            client.offer(sse_event(frame) if client.sse else frame, None, device_id)
+
+    def remove(self, key: Hashable) -> Optional[FanoutClient]:
+        client = self.clients.pop(key, None)
+        if client is None:
+            return None
+        if client.task is not None:
+            client.task.cancel()
+        self._leave(client)
+        client._wake.set()  # Ends a stream
+        return client
+
+    def _join(self, client: FanoutClient, subscription: Subscription):
+        self._leave(client)
+        channel = self.channels.get(subscription.key)
+        if channel is None:
+            channel = self.channels[subscription.key] = Channel(subscription)
+        channel.clients[client.key] = client
+        client.channel = channel
+
+    def _leave(self, client: FanoutClient):
+        channel = client.channel
+        if channel is None:
+            return
+        channel.clients.pop(client.key, None)
+        client.channel = None
+        if not channel.clients:
+            channel.close()
+            del self.channels[channel.subscription.key]
+
+    def subscribe(self, key: Hashable, message: Dict[str, Any]):
+        """Apply a client's subscription message; raises ValueError if it is invalid"""
+        client = self.clients.get(key)
+        if client is None:
+            return
+        subscription = Subscription.from_message(message, client.encoding, client.sse)
+        if "devices" in message:
+            devices = message["devices"]
+            if devices is not None and (not isinstance(devices, list)
+                                        or not all(isinstance(device, str) for device in devices)):
+                raise ValueError(f"devices must be a list of device ids, got {devices!r}")
+            client.devices = None if devices is None else frozenset(devices)
+        self._join(client, subscription)
+        devices = ','.join(sorted(client.devices)) if client.devices is not None else "all"
+        logger.info(f"{'Stream' if client.sse else 'WebSocket'} subscribed: {subscription.describe()}, devices {devices}")
+
+    def handle_message(self, key: Hashable, text: str):
+        """Handle text received from a client: subscriptions, anything else is ignored"""
+        try:
+            message = json.loads(text)
+            if isinstance(message, dict) and message.get("type") == "subscribe":
+                self.subscribe(key, message)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Ignoring bad WebSocket message {text[:100]!r}: {e}")
+
+    def publish(self, message: Dict[str, Any], device_id: Optional[str] = None):
+        """Run `message` through every channel with a matching client; never blocks"""
+        if self.history is not None:
+            self.history.record(device_id, sample_time(message), message)
+        now = time.monotonic()
+        for client in list(self.clients.values()):
+            # Writer tasks time out their own sends; this catches streams, whose writes the server awaits
+            if client.sending_since is not None and now - client.sending_since > self.send_timeout:
+                self.timeouts += 1
+                logger.warning(f"WebSocket send timed out after {self.send_timeout:g}s - dropping client")
+                self.evict(client)
+            elif client.behind_since is not None and now - client.behind_since > self.evict_after:
+                logger.warning(f"WebSocket client behind for {self.evict_after:g}s - dropping client")
+                self.evict(client)
+
+        published = False
+        for channel in list(self.channels.values()):
+            if channel.wants(device_id):
+                channel.publish(message, device_id)
+                published = True
+        if published:
+            self.messages += 1
+
+    async def broadcast(self, message: Dict[str, Any], device_id: Optional[str] = None):
+        self.publish(message, device_id)
+
+    def evict(self, client: FanoutClient):
+        if self.clients.get(client.key) is not client:
+            return
+        self.remove(client.key)
+        self.evicted += 1
+        if client.close is not None:
+            asyncio.ensure_future(self._close(client))
+
+    async def _close(self, client: FanoutClient):
+        try:
+            await client.close()
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        clients = list(self.clients.values())
+        channels = list(self.channels.values())
+        return {
+            "clients": len(clients),
+            "messages": self.messages,
+            "channels": {channel.subscription.describe(): len(channel.clients) for channel in channels},
+            "frames": sum(channel.frames for channel in channels),
+            "queued": sum(len(client.queue) for client in clients),
+            "behind": sum(1 for client in clients if client.behind_since is not None),
+            "coalesced": sum(client.folded for client in clients),
+            "decimated": sum(channel.decimated for channel in channels),
+            "dropped": sum(client.dropped for client in clients),
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "evicted": self.evicted,
+            "history": self.history.stats() if self.history is not None else None
+        }
@@ -0,0 +1,134 @@
+"""
+Recent samples per device, for hydrating charts of clients that just connected
+
+Each device gets a fixed-size ring of typed arrays (time, voltage, power,
+energy, steps) allocated once up front. Recording a sample writes five
+slots; reading the last N seconds is a binary search plus one or two slice
+copies per column, with no per-sample objects. Windows longer than the
+chart can show are reduced to `max_points` buckets, keeping each bucket's
+last sample and its voltage min/max.
+"""
+import math
+import logging
+from array import array
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+class SampleRing:
+    """Fixed-capacity ring of one device's samples, one array per field"""
+
+    COLUMNS = ("t", "v", "p", "e", "s")
+
+    def __init__(self, capacity: int = 65536):
+        self.capacity = capacity
+        self.t = array('d', bytes(8 * capacity))  # Epoch seconds
+        self.v = array('d', bytes(8 * capacity))
+        self.p = array('d', bytes(8 * capacity))
+        self.e = array('d', bytes(8 * capacity))
+        self.s = array('q', bytes(8 * capacity))
+        self.head = 0  # Next slot to write
+        self.count = 0
+        self.led = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, t: float, voltage: float, power: float, energy: float, steps: int, led: Any = None):
+        i = self.head
+        self.t[i] = t
+        self.v[i] = voltage
+        self.p[i] = power
+        self.e[i] = energy
+        self.s[i] = steps
+        self.led = led
+        self.head = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _slot(self, index: int) -> int:
+        """Array slot of the index-th oldest sample"""
+        return (self.head - self.count + index) % self.capacity
+
+    def _first_after(self, since: float) -> int:
+        """Index of the oldest sample with t >= since (times are non-decreasing)"""
+        low, high = 0, self.count
+        t = self.t
+        while low < high:
+            middle = (low + high) // 2
+            if t[self._slot(middle)] < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _slice(self, column: array, start: int) -> array:
+        first = self._slot(start)
+        last = self._slot(self.count - 1) + 1
+        if first < last:
+            return column[first:last]
+        return column[first:] + column[:last]
+
+    def window(self, seconds: float, max_points: int = 600) -> Optional[Dict[str, Any]]:
+        """Columns for the last `seconds` (relative to the newest sample), or None if empty
+
+        Returns arrays keyed "t", "v", "p", "e", "s"; when the window holds
+        more than `max_points` samples they are bucketed and lists "vmin" and
+        "vmax" are added.
+        """
+        if not self.count:
+            return None
+        newest = self.t[self._slot(self.count - 1)]
+        start = self._first_after(newest - seconds)
+        columns = {name: self._slice(getattr(self, name), start) for name in self.COLUMNS}
+        size = self.count - start
+        if size <= max_points:
+            return columns
+
+        bucket = math.ceil(size / max_points)
+        ends = range(bucket - 1, size + bucket - 1, bucket)
+        lasts = [min(end, size - 1) for end in ends]
+        v = columns["v"]
+        reduced = {name: array(values.typecode, [values[i] for i in lasts]) for name, values in columns.items()}
+        reduced["vmin"] = [min(v[i:i + bucket]) for i in range(0, size, bucket)]
+        reduced["vmax"] = [max(v[i:i + bucket]) for i in range(0, size, bucket)]
+        return reduced
+
+class History:
+    """A SampleRing per device"""
+
+    def __init__(self, seconds: float = 60.0, capacity: int = 65536, max_points: int = 600):
+        self.seconds = seconds
+        self.capacity = capacity
+        self.max_points = max_points
+        self.rings: Dict[Optional[str], SampleRing] = {}
+
+    def record(self, device_id: Optional[str], t: float, message: Dict[str, Any]):
+        ring = self.rings.get(device_id)
+        if ring is None:
+            ring = self.rings[device_id] = SampleRing(self.capacity)
+        voltage = message.get('voltage')
+        power = message.get('power')
+        energy = message.get('energy')
+        ring.append(t,
+                    math.nan if voltage is None else voltage,
+                    math.nan if power is None else power,
+                    math.nan if energy is None else energy,
+                    message.get('steps') or 0,
+                    message.get('led'))
+
+    def devices(self) -> List[Optional[str]]:
+        return list(self.rings)
+
+    def window(self, device_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        ring = self.rings.get(device_id)
+        if ring is None:
+            return None
+        return ring.window(self.seconds, self.max_points)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "seconds": self.seconds,
+            "capacity": self.capacity,
+            "samples": {str(device_id): len(ring) for device_id, ring in self.rings.items()}
+        }
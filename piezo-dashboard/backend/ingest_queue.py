@@ -0,0 +1,212 @@
+"""
+Bounded queues between serial ingest and the things that consume samples
+
+Every consumer (CSV writer, WebSocket viewers, ...) gets its own bounded
+queue and task, so a slow consumer only ever delays itself. What happens
+when a queue is full is chosen per consumer:
+
+    block       - publish() waits for space; for storage, where losing
+                  rows is worse than slowing ingest down
+    drop_oldest - the oldest queued sample is discarded to make room
+    latest      - only the newest sample per key (device) is kept; older
+                  ones are coalesced away
+
+Ingest only ever waits on `block` consumers, never on a browser.
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Optional, Dict, Any, Callable, Awaitable, List, Hashable
+
+logger = logging.getLogger(__name__)
+
+POLICY_BLOCK = 'block'
+POLICY_DROP_OLDEST = 'drop_oldest'
+POLICY_LATEST = 'latest'
+POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_LATEST)
+
+ConsumerHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+def device_key(sample: Dict[str, Any]) -> Hashable:
+    return sample.get('device')
+
+class ConsumerQueue:
+    """Bounded queue plus the task that feeds one consumer"""
+
+    def __init__(self, name: str, handler: ConsumerHandler, policy: str = POLICY_DROP_OLDEST,
+                 maxsize: int = 1000, key: Callable[[Dict[str, Any]], Hashable] = device_key):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy '{policy}' (expected one of {', '.join(POLICIES)})")
+        self.name = name
+        self.handler = handler
+        self.policy = policy
+        self.maxsize = maxsize
+        self.key = key
+        self._items = deque()
+        self._latest: Dict[Hashable, Dict[str, Any]] = {}
+        self._ready: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self._busy = False
+
+        self.enqueued = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.blocked = 0
+        self.errors = 0
+        self.high_water = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._latest) if self.policy == POLICY_LATEST else len(self._items)
+
+    def start(self):
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        if self.depth:
+            self._ready.set()
+        self.task = asyncio.create_task(self._run())
+
+    def offer(self, sample: Dict[str, Any]) -> bool:
+        """Queue without waiting; returns False only for a full `block` queue"""
+        if self.policy == POLICY_LATEST:
+            key = self.key(sample)
+            if key in self._latest:
+                self.coalesced += 1
+            elif len(self._latest) >= self.maxsize:
+                del self._latest[next(iter(self._latest))]
+                self.dropped += 1
+            self._latest[key] = sample
+        else:
+            if len(self._items) >= self.maxsize:
+                if self.policy == POLICY_BLOCK:
+                    return False
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(sample)
+
+        self.enqueued += 1
+        depth = self.depth
+        if depth > self.high_water:
+            self.high_water = depth
+        if self._ready is not None:
+            self._ready.set()
+        return True
+
+    async def put(self, sample: Dict[str, Any]):
+        """Queue, waiting for space if this is a full `block` queue"""
+        if self.offer(sample):
+            return
+        self.blocked += 1
+        while not self.offer(sample):
+            self._space.clear()
+            await self._space.wait()
+
+    def _pop(self) -> Optional[Dict[str, Any]]:
+        if self.policy == POLICY_LATEST:
+            if not self._latest:
+                return None
+            key = next(iter(self._latest))
+            return self._latest.pop(key)
+        return self._items.popleft() if self._items else None
+
+    async def _deliver(self, sample: Dict[str, Any]):
+        try:
+            await self.handler(sample)
+            self.delivered += 1
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Consumer '{self.name}' failed: {e}")
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while True:
+                sample = self._pop()
+                if sample is None:
+                    break
+                self._space.set()
+                self._busy = True
+                await self._deliver(sample)
+                self._busy = False
+
+    async def stop(self, flush: bool = False):
+        """Cancel the consumer task; `flush` delivers whatever is still queued first"""
+        if flush and self.task and not self.task.done():
+            # Let the task drain the queue rather than cutting a write in half
+            while self.depth or self._busy:
+                await asyncio.sleep(0.01)
+        if self.task and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+        if flush:
+            while True:
+                sample = self._pop()
+                if sample is None:
+                    break
+                await self._deliver(sample)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy,
+            "maxsize": self.maxsize,
+            "depth": self.depth,
+            "high_water": self.high_water,
+            "enqueued": self.enqueued,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "blocked": self.blocked,
+            "errors": self.errors
+        }
+
+class IngestQueue:
+    """Fan samples out to consumers through their own bounded queues"""
+
+    def __init__(self):
+        self.consumers: Dict[str, ConsumerQueue] = {}
+        self._blocking: List[ConsumerQueue] = []
+        self._nonblocking: List[ConsumerQueue] = []
+
+    def add_consumer(self, name: str, handler: ConsumerHandler, policy: str = POLICY_DROP_OLDEST,
+                     maxsize: int = 1000, **options) -> ConsumerQueue:
+        consumer = ConsumerQueue(name, handler, policy, maxsize, **options)
+        self.consumers[name] = consumer
+        if policy == POLICY_BLOCK:
+            self._blocking.append(consumer)
+        else:
+            self._nonblocking.append(consumer)
+        return consumer
+
+    def start(self):
+        for consumer in self.consumers.values():
+            consumer.start()
+
+    async def stop(self):
+        """Stop every consumer, flushing the ones that must not lose samples"""
+        for consumer in self.consumers.values():
+            await consumer.stop(flush=consumer.policy == POLICY_BLOCK)
+
+    def offer(self, sample: Dict[str, Any]):
+        """Queue for the non-blocking consumers (never waits)"""
+        for consumer in self._nonblocking:
+            consumer.offer(sample)
+
+    async def store(self, sample: Dict[str, Any]):
+        """Queue for the `block` consumers, waiting while any of them is full"""
+        for consumer in self._blocking:
+            await consumer.put(sample)
+
+    async def publish(self, sample: Dict[str, Any]):
+        self.offer(sample)
+        await self.store(sample)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: consumer.as_dict() for name, consumer in self.consumers.items()}
@@ -1,20 +1,27 @@
 import asyncio
-import json
 import csv
 import os
 import sys
-import re
+import time
 from datetime import datetime
-from typing import Optional, Dict, Any, List
-import serial
-import serial.tools.list_ports
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from typing import Optional, Dict, Any, List, AsyncIterator
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 import uvicorn
 from pydantic import BaseModel
 from typing import Optional
 import logging
+from serial_ingest import READER_THREAD, READER_FD
+from device_registry import DeviceRegistry, DEFAULT_DEVICE_ID
+from ingest_queue import IngestQueue, POLICY_BLOCK, POLICY_DROP_OLDEST
+from pipeline import build_pipeline, DEFAULT_STAGES
+from port_probe import is_hc05_candidate, probe_ports, live_port, log_results
+from port_cache import PortCache, reconnect_cached
+from serial_io import port_list, serial_io, SerialIOTimeout
+from fanout import (Fanout, FanoutClient, ENCODING_BINARY, ENCODING_JSON, SUBPROTOCOL_BINARY,
+                    SSE_RETRY_MS, query_subscription)
+from history import History
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -23,124 +30,134 @@ logger = logging.getLogger(__name__)
 app = FastAPI(title="Piezoelectric Energy Dashboard")
 
 # Global variables
-serial_connection: Optional[serial.Serial] = None
-connected_websockets: List[WebSocket] = []
 is_logging = False
 csv_file_path = None
 csv_writer = None
 csv_file = None
 
-class SerialData(BaseModel):
-    voltage: float
-    energy: float
-    steps: int
-    power: float
-    led: str
-    timestamp: str
+# Format auto-detection: samples needed to lock onto a format, and how many
+# consecutive unparsable lines trigger re-detection
+FORMAT_DETECT_FRAMES = 3
+FORMAT_REDETECT_FAILURES = 20
+
+# Ask the device for compact binary frames on connect; devices that don't
+# understand MODE BIN keep sending text, which is still parsed
+SERIAL_PREFER_BINARY = True
+
+# Link supervision: a device that sends nothing for this many seconds is
+# treated as dropped, and dropped links are reopened with jittered
+# exponential backoff capped at SERIAL_BACKOFF_MAX
+SERIAL_STALL_TIMEOUT = 10.0
+SERIAL_BACKOFF_MAX = 30.0
+
+# Auto-connect listens on all candidate ports at once for this long
+PORT_PROBE_TIMEOUT = 3.0
+# A reopened last-known-good port must send a valid frame within this long,
+# or the HC-05 scan runs instead
+CACHED_PORT_VERIFY_TIMEOUT = 3.0
+
+# Blocking serial calls run on a bounded pool: opening a port gives up after
+# SERIAL_OPEN_TIMEOUT, and the port list is reused for PORT_LIST_TTL seconds
+SERIAL_OPEN_TIMEOUT = 5.0
+PORT_LIST_TTL = 2.0
+port_list.ttl = PORT_LIST_TTL
+
+# A WebSocket that can't take a message within this many seconds is dropped.
+# Each viewer has its own queue of WS_QUEUE_SIZE messages; past that its
+# samples are coalesced (latest + min/max/count), and a viewer that stays
+# behind for WS_EVICT_AFTER seconds is dropped
+WS_SEND_TIMEOUT = 1.0
+WS_QUEUE_SIZE = 32
+WS_EVICT_AFTER = 10.0
+# Offer permessage-deflate to WebSocket clients (uvicorn >= 0.19)
+WS_PER_MESSAGE_DEFLATE = True
+# New WebSocket clients get the last HISTORY_SECONDS per device, reduced to
+# at most SNAPSHOT_POINTS points (the dashboard chart's width); each device
+# keeps up to HISTORY_CAPACITY samples in memory
+HISTORY_SECONDS = 60.0
+HISTORY_CAPACITY = 65536
+SNAPSHOT_POINTS = 600
+# /api/stream (Server-Sent Events) writes a comment after this many idle
+# seconds so proxies keep the connection open
+SSE_HEARTBEAT_INTERVAL = 15.0
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Queues between ingest and consumers: the CSV writer never loses rows (ingest
+# waits when it falls behind), live viewers drop old samples instead
+STORAGE_QUEUE_SIZE = 10000
+VIEWER_QUEUE_SIZE = 1000
+VIEWER_QUEUE_POLICY = POLICY_DROP_OLDEST
+
+# Ingest pipeline: stage names (or "module:factory" / {"stage": ..., options})
+# run in order on micro-batches of up to PIPELINE_MAX_BATCH chunks/samples or
+# PIPELINE_MAX_DELAY seconds, whichever comes first
+PIPELINE_STAGES = DEFAULT_STAGES
+PIPELINE_MAX_BATCH = 64
+PIPELINE_MAX_DELAY = 0.005
+# Per-device linear calibration for the calibrate stage: {device: {field: [scale, offset]}}
+CALIBRATION: Dict[str, Dict[str, List[float]]] = {}
+
+# How bytes get from the port to the event loop: 'fd', 'thread' or 'poll'.
+# 'fd' (Linux) sleeps until the kernel reports data; elsewhere use a thread.
+SERIAL_READER_MODE = READER_FD if sys.platform.startswith('linux') else READER_THREAD
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        # Serializes each message once; every socket has its own queue and writer
+        self.fanout = Fanout(send_timeout=WS_SEND_TIMEOUT, max_queue=WS_QUEUE_SIZE,
+                             evict_after=WS_EVICT_AFTER,
+                             history=History(HISTORY_SECONDS, HISTORY_CAPACITY, SNAPSHOT_POINTS))
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        logger.info(f"WebSocket connected. Total connections: {len(self.active_connections)}")
+    async def connect(self, websocket: WebSocket, device_id: Optional[str] = None):
+        """Accept a socket; with `device_id` it only receives that device's samples
+
+        Clients offering the SUBPROTOCOL_BINARY subprotocol get binary batch frames.
+        """
+        if SUBPROTOCOL_BINARY in websocket.scope.get('subprotocols', []):
+            await websocket.accept(subprotocol=SUBPROTOCOL_BINARY)
+            self.fanout.add(id(websocket), websocket.send_bytes, device_id, close=websocket.close,
+                            encoding=ENCODING_BINARY)
+        else:
+            await websocket.accept()
+            self.fanout.add(id(websocket), websocket.send_text, device_id, close=websocket.close,
+                            encoding=ENCODING_JSON)
+        logger.info(f"WebSocket connected. Total connections: {len(self.fanout)}")
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-        logger.info(f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
-
-    async def broadcast(self, message: dict):
-        if self.active_connections:
-            disconnected = []
-            for connection in self.active_connections:
-                try:
-                    await connection.send_text(json.dumps(message))
-                except Exception as e:
-                    logger.error(f"Error sending to WebSocket: {e}")
-                    disconnected.append(connection)
-            
-            # Remove disconnected clients
-            for connection in disconnected:
-                self.disconnect(connection)
+        self.fanout.remove(id(websocket))
+        logger.info(f"WebSocket disconnected. Total connections: {len(self.fanout)}")
 
-manager = ConnectionManager()
+    def connect_stream(self, request: Request) -> FanoutClient:
+        """Register an SSE client subscribed by the request's query; ValueError if invalid"""
+        client = self.fanout.add_stream(id(request), query_subscription(request.query_params))
+        logger.info(f"Event stream connected. Total connections: {len(self.fanout)}")
+        return client
 
-def parse_sensor_data(raw_data: str) -> Optional[Dict[str, Any]]:
-    """Parse the raw sensor data string into structured data
-    
-    Supports two formats:
-    1. Original format (separate lines):
-       Voltage: 1.5
-       Energy: 0.025
-       Steps: 150
-       Power: 2.25
-       LED: ON
-    
-    2. Pico format (single line from voltage.py):
-       V: 0.003V | P: 0.00mW | E_inst: 0.000mJ | E_total: 0.000mWh
-    """
-    try:
-        raw_data = raw_data.strip()
-        
-        # Try parsing Pico format first (single line with | separators)
-        if '|' in raw_data:
-            # Extract values using regex
-            voltage_match = re.search(r'V:\s*([\d.]+)V', raw_data)
-            power_match = re.search(r'P:\s*([\d.]+)mW', raw_data)
-            energy_inst_match = re.search(r'E_inst:\s*([\d.]+)mJ', raw_data)
-            energy_total_match = re.search(r'E_total:\s*([\d.]+)mWh', raw_data)
-            
-            if voltage_match and power_match:
-                voltage = float(voltage_match.group(1))
-                power_mw = float(power_match.group(1))
-                energy_total_mwh = float(energy_total_match.group(1)) if energy_total_match else 0.0
-                
-                # Convert to expected units
-                data = {
-                    'voltage': voltage,  # V
-                    'power': power_mw / 1000.0,  # Convert mW to W
-                    'energy': energy_total_mwh,  # mWh (keep as is)
-                    'steps': 0,  # Not available in Pico format
-                    'led': 'OFF',  # Not available in Pico format
-                    'timestamp': datetime.now().isoformat()
-                }
-                return data
-        
-        # Fall back to original format (separate lines)
-        lines = raw_data.split('\n')
-        data = {}
-        
-        for line in lines:
-            line = line.strip()
-            if not line or line.startswith('-'):
-                continue
-                
-            if ':' in line:
-                key, value = line.split(':', 1)
-                key = key.strip().lower()
-                value = value.strip()
-                
-                if key == 'voltage':
-                    data['voltage'] = float(value)
-                elif key == 'energy':
-                    data['energy'] = float(value)
-                elif key == 'steps':
-                    data['steps'] = int(value)
-                elif key == 'power':
-                    data['power'] = float(value)
-                elif key == 'led':
-                    data['led'] = value.upper()
-        
-        if len(data) >= 5:  # Ensure we have all required fields
-            data['timestamp'] = datetime.now().isoformat()
-            return data
-    except Exception as e:
-        logger.error(f"Error parsing sensor data: {e}")
-    
-    return None
+    async def stream(self, request: Request, client: FanoutClient) -> AsyncIterator[str]:
+        """Body of an SSE response: the client's frames, one chunk per write"""
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        next_check = time.monotonic() + SSE_HEARTBEAT_INTERVAL
+        try:
+            async for chunk in client.stream(SSE_HEARTBEAT_INTERVAL):
+                yield chunk
+                # Not every Starlette version stops a response when the peer goes away
+                if time.monotonic() >= next_check:
+                    if await request.is_disconnected():
+                        break
+                    next_check = time.monotonic() + SSE_HEARTBEAT_INTERVAL
+        finally:
+            if self.fanout.clients.get(client.key) is client:
+                self.fanout.remove(client.key)
+            logger.info(f"Event stream disconnected. Total connections: {len(self.fanout)}")
+
+    def handle_message(self, websocket: WebSocket, text: str):
+        """Apply a subscription such as {"type": "subscribe", "rate": 10}"""
+        self.fanout.handle_message(id(websocket), text)
+
+    async def broadcast(self, message: dict, device_id: Optional[str] = None):
+        await self.fanout.broadcast(message, device_id)
+
+manager = ConnectionManager()
 
 def setup_csv_logging():
     """Setup CSV file for data logging"""
@@ -154,7 +171,7 @@ def setup_csv_logging():
     
     csv_file = open(csv_file_path, 'w', newline='')
     csv_writer = csv.writer(csv_file)
-    csv_writer.writerow(['timestamp', 'voltage', 'energy', 'steps', 'power', 'led'])
+    csv_writer.writerow(['timestamp', 'voltage', 'energy', 'steps', 'power', 'led', 'device'])
     csv_file.flush()
     
     logger.info(f"CSV logging started: {csv_file_path}")
@@ -171,7 +188,8 @@ def log_to_csv(data: Dict[str, Any]):
                 data['energy'],
                 data['steps'],
                 data['power'],
-                data['led']
+                data['led'],
+                data.get('device', DEFAULT_DEVICE_ID)
             ])
             csv_file.flush()
         except Exception as e:
@@ -187,38 +205,53 @@ def close_csv_logging():
         csv_writer = None
         logger.info("CSV logging stopped")
 
-async def read_serial_data():
-    """Continuously read data from serial port"""
-    global serial_connection
-    
-    buffer = ""
-    
-    while serial_connection and serial_connection.is_open:
-        try:
-            if serial_connection.in_waiting > 0:
-                chunk = serial_connection.read(serial_connection.in_waiting).decode('utf-8', errors='ignore')
-                buffer += chunk
-                
-                # Process line by line (Pico sends one reading per line)
-                while '\n' in buffer:
-                    line, buffer = buffer.split('\n', 1)
-                    line = line.strip()
-                    
-                    if line:  # Process non-empty lines
-                        parsed_data = parse_sensor_data(line)
-                        if parsed_data:
-                            # Broadcast to all connected clients
-                            await manager.broadcast(parsed_data)
-                            
-                            # Log to CSV if logging is enabled
-                            if is_logging:
-                                log_to_csv(parsed_data)
-            
-            await asyncio.sleep(0.01)  # Small delay to prevent busy waiting
-            
-        except Exception as e:
-            logger.error(f"Error reading serial data: {e}")
-            break
+async def send_to_viewers(data: Dict[str, Any]):
+    """Viewer consumer: push a sample to the WebSocket clients"""
+    await manager.broadcast(data, data.get('device'))
+
+async def store_sample(data: Dict[str, Any]):
+    """Storage consumer: log to CSV if logging is enabled"""
+    if is_logging:
+        log_to_csv(data)
+
+ingest_queue = IngestQueue()
+ingest_queue.add_consumer("storage", store_sample, POLICY_BLOCK, STORAGE_QUEUE_SIZE)
+ingest_queue.add_consumer("viewers", send_to_viewers, VIEWER_QUEUE_POLICY, VIEWER_QUEUE_SIZE)
+
+pipeline = build_pipeline(
+    PIPELINE_STAGES,
+    {"ingest_queue": ingest_queue, "calibration": CALIBRATION},
+    max_batch=PIPELINE_MAX_BATCH,
+    max_delay=PIPELINE_MAX_DELAY
+)
+
+port_cache = PortCache()
+
+async def save_port(device_id: str, port: str, baudrate: int):
+    try:
+        ports = await port_list.get()
+    except Exception as e:
+        logger.warning(f"Could not list ports for the port cache: {e}")
+        ports = []
+    await asyncio.get_running_loop().run_in_executor(
+        None, port_cache.remember, device_id, port, baudrate, ports)
+
+def remember_port(device):
+    """Persist a port once it has produced valid frames"""
+    asyncio.ensure_future(save_port(device.device_id, device.port, device.baudrate))
+
+# Readers hand raw chunks to the pipeline; it only waits if storage is full
+registry = DeviceRegistry(
+    pipeline.submit_chunk,
+    on_verified=remember_port,
+    reader_mode=SERIAL_READER_MODE,
+    prefer_binary=SERIAL_PREFER_BINARY,
+    detect_frames=FORMAT_DETECT_FRAMES,
+    redetect_failures=FORMAT_REDETECT_FAILURES,
+    stall_timeout=SERIAL_STALL_TIMEOUT,
+    backoff_max=SERIAL_BACKOFF_MAX,
+    open_timeout=SERIAL_OPEN_TIMEOUT
+)
 
 @app.get("/")
 async def get_dashboard():
@@ -227,31 +260,44 @@ async def get_dashboard():
         return HTMLResponse(content=f.read())
 
 @app.get("/api/ports")
-async def get_available_ports():
-    """Get list of available serial ports with HC-05 auto-detection"""
+async def get_available_ports(probe: bool = False):
+    """Get list of available serial ports with HC-05 auto-detection
+
+    With ?probe=true every HC-05 candidate is listened to in parallel and
+    the one sending valid frames is reported as auto_detected_hc05. Ports a
+    registered device is reading are reported as in_use and never probed,
+    since probing would steal the device's bytes (or fail to open it).
+    """
     try:
-        ports = serial.tools.list_ports.comports()
-        port_list = []
+        # Cached for PORT_LIST_TTL; concurrent requests share one comports() call
+        ports = await port_list.get()
+        in_use = registry.ports()
+        port_infos = []
         hc05_port = None
+        candidates = []
         
         for port in ports:
             port_info = {"device": port.device, "description": port.description}
-            
-            # Auto-detect HC-05 on macOS (looks for /dev/tty.* or /dev/cu.* Bluetooth ports)
-            if 'tty.' in port.device.lower() or 'cu.' in port.device.lower():
-                if any(keyword in port.device.lower() for keyword in ['hc-05', 'bluetooth', 'bt', 'serial']):
-                    port_info["is_hc05"] = True
-                    hc05_port = port.device
-            
-            # Auto-detect on Windows (COM ports with Bluetooth in description)
-            if 'com' in port.device.lower():
-                if any(keyword in port.description.lower() for keyword in ['bluetooth', 'hc-05', 'bt']):
-                    port_info["is_hc05"] = True
-                    hc05_port = port.device
-            
-            port_list.append(port_info)
+            if port.device in in_use:
+                port_info["in_use"] = in_use[port.device]
+            if is_hc05_candidate(port):
+                port_info["is_hc05"] = True
+                hc05_port = port.device
+                if port.device not in in_use:
+                    candidates.append(port)
+            port_infos.append(port_info)
         
-        return {"ports": port_list, "auto_detected_hc05": hc05_port}
+        if probe:
+            results = await probe_ports(candidates, 9600, PORT_PROBE_TIMEOUT) if candidates else []
+            by_port = {result.port: result.as_dict() for result in results}
+            for port_info in port_infos:
+                if port_info["device"] in by_port:
+                    port_info["probe"] = by_port[port_info["device"]]
+            live = live_port(results)
+            hc05_port = live.port if live else registry.connected_port(
+                info["device"] for info in port_infos if info.get("is_hc05"))
+        
+        return {"ports": port_infos, "auto_detected_hc05": hc05_port}
     except Exception as e:
         logger.error(f"Error getting ports: {e}")
         return {"ports": [], "auto_detected_hc05": None}
@@ -259,42 +305,103 @@ async def get_available_ports():
 class SerialConnectRequest(BaseModel):
     port: str
     baudrate: int = 9600
+    device_id: str = DEFAULT_DEVICE_ID
 
 @app.post("/api/connect")
 async def connect_serial(request: SerialConnectRequest):
-    """Connect to serial port"""
-    global serial_connection
-    
+    """Connect to serial port (replaces the device with the same id)"""
     try:
-        if serial_connection and serial_connection.is_open:
-            serial_connection.close()
-        
-        serial_connection = serial.Serial(request.port, request.baudrate, timeout=1)
-        
-        # Start reading data in background
-        asyncio.create_task(read_serial_data())
-        
-        return {"status": "connected", "port": request.port, "baudrate": request.baudrate}
+        await registry.add(request.device_id, request.port, request.baudrate)
+        return {"status": "connected", "port": request.port, "baudrate": request.baudrate,
+                "device_id": request.device_id}
     
+    except SerialIOTimeout as e:
+        logger.error(f"Serial port did not respond: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error connecting to serial port: {e}")
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/api/disconnect")
-async def disconnect_serial():
+async def disconnect_serial(device_id: str = DEFAULT_DEVICE_ID):
     """Disconnect from serial port"""
-    global serial_connection
-    
     try:
-        if serial_connection and serial_connection.is_open:
-            serial_connection.close()
-            serial_connection = None
+        await registry.remove(device_id)
         return {"status": "disconnected"}
     
     except Exception as e:
         logger.error(f"Error disconnecting: {e}")
         raise HTTPException(status_code=400, detail=str(e))
 
+class DeviceRequest(BaseModel):
+    device_id: str
+    port: str
+    baudrate: int = 9600
+    reconnect: bool = True
+
+class DeviceUpdateRequest(BaseModel):
+    port: Optional[str] = None
+    baudrate: Optional[int] = None
+    reconnect: Optional[bool] = None
+
+@app.get("/api/devices")
+async def list_devices():
+    """List registered serial devices"""
+    return {"devices": list(registry.status().values())}
+
+@app.post("/api/devices")
+async def create_device(request: DeviceRequest):
+    """Connect a new serial device"""
+    if registry.get(request.device_id):
+        raise HTTPException(status_code=409, detail=f"Device '{request.device_id}' already exists")
+    try:
+        device = await registry.add(request.device_id, request.port, request.baudrate,
+                                    reconnect=request.reconnect)
+        return device.status()
+    except SerialIOTimeout as e:
+        logger.error(f"Serial port did not respond: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error adding device {request.device_id}: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/devices/{device_id}")
+async def get_device(device_id: str):
+    """Get one device's connection, format, link and clock stats"""
+    device = registry.get(device_id)
+    if device is None:
+        raise HTTPException(status_code=404, detail=f"Unknown device '{device_id}'")
+    return device.status()
+
+@app.put("/api/devices/{device_id}")
+async def update_device(device_id: str, request: DeviceUpdateRequest):
+    """Change a device's port, baud rate or reconnect setting (reopens the port)"""
+    device = registry.get(device_id)
+    if device is None:
+        raise HTTPException(status_code=404, detail=f"Unknown device '{device_id}'")
+    try:
+        device = await registry.add(
+            device_id,
+            request.port or device.port,
+            request.baudrate or device.baudrate,
+            reconnect=device.reconnect if request.reconnect is None else request.reconnect
+        )
+        return device.status()
+    except SerialIOTimeout as e:
+        logger.error(f"Serial port did not respond: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error updating device {device_id}: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/api/devices/{device_id}")
+async def delete_device(device_id: str):
+    """Disconnect and forget a device"""
+    if not await registry.remove(device_id):
+        raise HTTPException(status_code=404, detail=f"Unknown device '{device_id}'")
+    port_cache.forget(device_id)
+    return {"status": "removed", "device_id": device_id}
+
 @app.post("/api/logging/start")
 async def start_logging():
     """Start CSV logging"""
@@ -328,10 +435,15 @@ async def stop_logging():
 async def get_status():
     """Get current system status"""
     return {
-        "serial_connected": serial_connection is not None and serial_connection.is_open,
+        "serial_connected": registry.any_connected,
+        "devices": registry.status(),
         "logging": is_logging,
         "csv_file": csv_file_path if is_logging else None,
-        "websocket_connections": len(manager.active_connections)
+        "websocket_connections": len(manager.fanout),
+        "fanout": manager.fanout.stats(),
+        "queues": ingest_queue.stats(),
+        "pipeline": pipeline.stats(),
+        "serial_io": {**serial_io.stats(), "port_list": port_list.stats()}
     }
 
 @app.websocket("/ws")
@@ -340,57 +452,62 @@ async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
     try:
         while True:
-            # Keep connection alive
-            await websocket.receive_text()
+            # Subscription messages; also keeps the connection alive
+            manager.handle_message(websocket, await websocket.receive_text())
+    except WebSocketDisconnect:
+        manager.disconnect(websocket)
+
+@app.websocket("/ws/{device_id}")
+async def device_websocket_endpoint(websocket: WebSocket, device_id: str):
+    """WebSocket channel carrying a single device's samples"""
+    await manager.connect(websocket, device_id)
+    try:
+        while True:
+            manager.handle_message(websocket, await websocket.receive_text())
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
+@app.get("/api/stream")
+async def event_stream(request: Request):
+    """Server-Sent Events carrying the same frames as /ws
+
+    Subscribe with query parameters instead of a message, e.g.
+    /api/stream?rate=10&fields=voltage,power&devices=tile1&batch=250
+    """
+    try:
+        client = manager.connect_stream(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(manager.stream(request, client), media_type="text/event-stream",
+                             headers=SSE_HEADERS)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="frontend"), name="static")
 
 async def auto_connect_hc05():
     """Automatically connect to HC-05 on startup if available"""
-    global serial_connection
-    
     try:
         logger.info("Searching for HC-05 Bluetooth module...")
-        ports = serial.tools.list_ports.comports()
-        
-        # macOS: Look for /dev/tty.* or /dev/cu.* Bluetooth serial ports
-        # Windows: Look for COM ports with Bluetooth in description
-        for port in ports:
-            is_hc05 = False
-            
-            # macOS detection
-            if 'darwin' in os.sys.platform or 'linux' in os.sys.platform:
-                if '/dev/tty.' in port.device or '/dev/cu.' in port.device:
-                    # Check for HC-05, Bluetooth keywords
-                    if any(kw in port.device.lower() for kw in ['hc-05', 'hc05', 'bluetooth', 'bt']):
-                        is_hc05 = True
-                    # Also try any tty/cu port that looks like serial Bluetooth
-                    elif 'serial' in port.device.lower():
-                        is_hc05 = True
-            
-            # Windows detection
-            elif 'win' in os.sys.platform:
-                if any(kw in port.description.lower() for kw in ['bluetooth', 'hc-05', 'hc05', 'bt']):
-                    is_hc05 = True
-            
-            if is_hc05:
-                try:
-                    logger.info(f"Attempting to connect to {port.device}...")
-                    serial_connection = serial.Serial(port.device, 9600, timeout=1)
-                    logger.info(f"✓ Successfully connected to HC-05 on {port.device}")
-                    
-                    # Start reading data in background
-                    asyncio.create_task(read_serial_data())
-                    return True
-                except Exception as e:
-                    logger.warning(f"Failed to connect to {port.device}: {e}")
-                    continue
-        
-        logger.info("No HC-05 Bluetooth module found. Manual connection required.")
-        return False
+        in_use = registry.ports()  # e.g. other tiles reopened from the port cache
+        candidates = [port for port in await port_list.get()
+                      if is_hc05_candidate(port) and port.device not in in_use]
+        if not candidates:
+            logger.info("No HC-05 Bluetooth module found. Manual connection required.")
+            return False
+
+        # Listen on every candidate at once; one deadline for all of them
+        logger.info(f"Probing {len(candidates)} port(s) for live data...")
+        results = await probe_ports(candidates, 9600, PORT_PROBE_TIMEOUT)
+        log_results(results)
+
+        live = live_port(results)
+        if live is None:
+            logger.info("No port is sending sensor data. Manual connection required.")
+            return False
+
+        await registry.add(DEFAULT_DEVICE_ID, live.port, 9600)
+        logger.info(f"✓ Successfully connected to HC-05 on {live.port}")
+        return True
     except Exception as e:
         logger.error(f"Error during auto-connect: {e}")
         return False
@@ -399,7 +516,18 @@ async def auto_connect_hc05():
 async def startup_event():
     """Run on application startup"""
     logger.info("Piezoelectric Dashboard starting...")
-    await auto_connect_hc05()
+    ingest_queue.start()
+    await reconnect_cached(port_cache, registry, port_list.get, CACHED_PORT_VERIFY_TIMEOUT)
+    if registry.get(DEFAULT_DEVICE_ID) is None:
+        await auto_connect_hc05()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close every serial device on shutdown and flush queued rows"""
+    await registry.close_all()
+    await pipeline.close()
+    await ingest_queue.stop()
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
+    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True,
+                ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE)
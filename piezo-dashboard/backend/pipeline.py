@@ -0,0 +1,285 @@
+"""
+Micro-batched ingest pipeline: parse -> calibrate -> derive -> storage -> fanout
+
+Readers submit raw chunks (and generators such as the dummy data task
+submit ready-made samples). Work is collected into a Batch until either
+`max_batch` items are pending or `max_delay` seconds have passed, then the
+batch runs through each stage in order, so per-sample Python overhead
+(awaits, queue wakeups, lookups) is paid once per batch.
+
+Stages are plain functions (sync or async) that take a Batch. They are
+built from a list of specs, so config can reorder, drop or add them:
+
+    PIPELINE_STAGES = [
+        "parse",
+        {"stage": "calibrate", "calibration": {"tile1": {"voltage": [1.02, 0.0]}}},
+        "derive",
+        "mymodule:make_stage",  # factory(context, **options) -> stage function
+        "storage",
+        "fanout",
+    ]
+"""
+import asyncio
+import importlib
+import logging
+import time
+from typing import Optional, Dict, Any, Callable, List, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+StageFunc = Callable[["Batch"], Any]
+StageSpec = Union[str, Dict[str, Any]]
+
+DEFAULT_STAGES = ["parse", "calibrate", "derive", "storage", "fanout"]
+
+class Batch:
+    """Work collected over one batching window"""
+
+    __slots__ = ("chunks", "samples", "metrics")
+
+    def __init__(self, chunks: List[Tuple[Any, bytes, float]], samples: List[Dict[str, Any]]):
+        self.chunks = chunks  # (SerialDevice, raw bytes, time read)
+        self.samples = samples
+        self.metrics: Dict[str, Dict[str, Any]] = {}  # Per-device values from derive
+
+class Stage:
+    """A named stage and its per-batch latency"""
+
+    def __init__(self, name: str, func: StageFunc):
+        self.name = name
+        self.func = func
+        self.is_async = asyncio.iscoroutinefunction(func)
+        self.batches = 0
+        self.samples = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed: float, nsamples: int):
+        ms = elapsed * 1000
+        self.batches += 1
+        self.samples += nsamples
+        self.total_ms += ms
+        self.last_ms = ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def as_dict(self) -> Dict[str, Any]:
+        batches = self.batches or 1
+        return {
+            "batches": self.batches,
+            "samples": self.samples,
+            "errors": self.errors,
+            "mean_ms": round(self.total_ms / batches, 3),
+            "last_ms": round(self.last_ms, 3),
+            "max_ms": round(self.max_ms, 3),
+            "us_per_sample": round(self.total_ms * 1000 / self.samples, 2) if self.samples else 0.0
+        }
+
+# Stage name -> factory(context, **options) returning a stage function
+STAGE_FACTORIES: Dict[str, Callable[..., StageFunc]] = {}
+
+def register_stage(name: str):
+    """Decorator that makes a stage factory available to configs by name"""
+    def decorator(factory):
+        STAGE_FACTORIES[name] = factory
+        return factory
+    return decorator
+
+def resolve_factory(stage: str) -> Callable[..., StageFunc]:
+    if stage in STAGE_FACTORIES:
+        return STAGE_FACTORIES[stage]
+    if ':' in stage:
+        module_name, attr = stage.split(':', 1)
+        return getattr(importlib.import_module(module_name), attr)
+    raise ValueError(f"Unknown pipeline stage '{stage}'")
+
+class Pipeline:
+    """Collect chunks/samples into micro-batches and run them through the stages"""
+
+    def __init__(self, max_batch: int = 64, max_delay: float = 0.005):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.stages: List[Stage] = []
+        self.derived: Dict[str, Dict[str, Any]] = {}  # Latest per-device values from derive
+        self.batches = 0
+        self._chunks: List[Tuple[Any, bytes, float]] = []
+        self._samples: List[Dict[str, Any]] = []
+        self._lock: Optional[asyncio.Lock] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def add_stage(self, name: str, func: StageFunc) -> Stage:
+        stage = Stage(name, func)
+        self.stages.append(stage)
+        return stage
+
+    @property
+    def pending(self) -> int:
+        return len(self._chunks) + len(self._samples)
+
+    async def submit_chunk(self, device, chunk: bytes):
+        """Queue raw bytes read from `device` for the parse stage"""
+        self._chunks.append((device, chunk, time.time()))
+        await self._maybe_flush()
+
+    async def submit_samples(self, samples: List[Dict[str, Any]]):
+        """Queue already-decoded samples (they skip parsing)"""
+        self._samples.extend(samples)
+        await self._maybe_flush()
+
+    async def _maybe_flush(self):
+        if self.pending >= self.max_batch:
+            # Awaiting here is what carries storage backpressure to the reader
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        if self.pending:
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """Run whatever is pending through the stages now"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self.pending:
+                return
+            batch = Batch(self._chunks, self._samples)
+            self._chunks = []
+            self._samples = []
+            await self.run(batch)
+
+    async def run(self, batch: Batch):
+        for stage in self.stages:
+            start = time.perf_counter()
+            try:
+                if stage.is_async:
+                    await stage.func(batch)
+                else:
+                    stage.func(batch)
+            except Exception as e:
+                stage.errors += 1
+                logger.error(f"Pipeline stage '{stage.name}' failed: {e}")
+            stage.record(time.perf_counter() - start, len(batch.samples))
+        self.batches += 1
+
+    async def close(self):
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch": self.max_batch,
+            "max_delay_ms": self.max_delay * 1000,
+            "batches": self.batches,
+            "pending": self.pending,
+            "stages": {stage.name: stage.as_dict() for stage in self.stages},
+            "derived": self.derived
+        }
+
+def build_pipeline(specs: List[StageSpec], context: Optional[Dict[str, Any]] = None,
+                   max_batch: int = 64, max_delay: float = 0.005) -> Pipeline:
+    """Build a pipeline from stage specs: a name or {"stage": name, "name": ..., **options}"""
+    pipeline = Pipeline(max_batch, max_delay)
+    context = dict(context or {})
+    context['pipeline'] = pipeline
+    for spec in specs:
+        if isinstance(spec, str):
+            spec = {"stage": spec}
+        options = dict(spec)
+        stage = options.pop("stage")
+        name = options.pop("name", stage)
+        pipeline.add_stage(name, resolve_factory(stage)(context, **options))
+    logger.info(f"Ingest pipeline: {' -> '.join(stage.name for stage in pipeline.stages)}")
+    return pipeline
+
+@register_stage("parse")
+def parse_stage(context: Dict[str, Any]) -> StageFunc:
+    """Decode raw chunks with each device's StreamDecoder and tag the device id"""
+    def parse(batch: Batch):
+        samples = batch.samples
+        for device, chunk, received_at in batch.chunks:
+            decoded = device.decoder.feed(chunk, received_at)
+            device_id = device.device_id
+            for sample in decoded:
+                sample['device'] = device_id
+            if device.reader:
+                device.reader.stats.record(len(chunk), len(decoded))
+            if decoded and not device.verified:
+                device.mark_verified()
+            samples.extend(decoded)
+        batch.chunks = []
+    return parse
+
+@register_stage("calibrate")
+def calibrate_stage(context: Dict[str, Any], calibration: Optional[Dict[str, Dict[str, Any]]] = None) -> StageFunc:
+    """Per-device linear correction: {device: {field: [scale, offset]}}"""
+    calibration = calibration if calibration is not None else context.get('calibration', {})
+
+    def calibrate(batch: Batch):
+        if not calibration:
+            return
+        for sample in batch.samples:
+            fields = calibration.get(sample.get('device'))
+            if not fields:
+                continue
+            for field, (scale, offset) in fields.items():
+                value = sample.get(field)
+                if value is not None:
+                    sample[field] = value * scale + offset
+    return calibrate
+
+@register_stage("derive")
+def derive_stage(context: Dict[str, Any]) -> StageFunc:
+    """Per-device batch metrics: sample count, voltage min/max/mean, mean power"""
+    derived = context['pipeline'].derived
+
+    def derive(batch: Batch):
+        metrics = batch.metrics
+        for sample in batch.samples:
+            device_id = sample.get('device')
+            voltage = sample['voltage']
+            m = metrics.get(device_id)
+            if m is None:
+                metrics[device_id] = {"count": 1, "v_min": voltage, "v_max": voltage,
+                                      "v_sum": voltage, "p_sum": sample['power']}
+                continue
+            m["count"] += 1
+            m["v_sum"] += voltage
+            m["p_sum"] += sample['power']
+            if voltage < m["v_min"]:
+                m["v_min"] = voltage
+            elif voltage > m["v_max"]:
+                m["v_max"] = voltage
+        for device_id, m in metrics.items():
+            count = m["count"]
+            m["v_mean"] = m.pop("v_sum") / count
+            m["p_mean"] = m.pop("p_sum") / count
+            derived[device_id] = m
+    return derive
+
+@register_stage("storage")
+def storage_stage(context: Dict[str, Any]) -> StageFunc:
+    """Hand samples to the blocking (storage) consumers of the ingest queue"""
+    store = context['ingest_queue'].store
+
+    async def storage(batch: Batch):
+        for sample in batch.samples:
+            await store(sample)
+    return storage
+
+@register_stage("fanout")
+def fanout_stage(context: Dict[str, Any]) -> StageFunc:
+    """Offer samples to the non-blocking (viewer) consumers of the ingest queue"""
+    offer = context['ingest_queue'].offer
+
+    def fanout(batch: Batch):
+        for sample in batch.samples:
+            offer(sample)
+    return fanout
@@ -0,0 +1,150 @@
+"""
+Remember which port each device was last seen working on
+
+Once a device produces valid frames, its port, baud rate and hardware
+identity (USB serial number, or the Bluetooth address inside `hwid`) are
+written to a small JSON file. On the next start those ports are opened
+straight away, before any enumeration or probing; if the OS renamed the
+port (a different COM number, say), the identity finds it again. A reopened
+port is only kept once it sends valid frames again (see reconnect_cached).
+"""
+import os
+import re
+import json
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+
+from device_registry import DeviceRegistry
+
+logger = logging.getLogger(__name__)
+
+PORT_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "port_cache.json")
+
+# 12 hex digits: the Bluetooth address in a Windows BTHENUM hwid
+# ("...&0&98D331F5B2C1_C00000000") or "98:D3:31:F5:B2:C1" elsewhere
+BT_ADDRESS_RE = re.compile(r'(?<![0-9A-F])((?:[0-9A-F]{2}[:-]?){5}[0-9A-F]{2})(?![0-9A-F])', re.I)
+
+def port_identity(port) -> Optional[str]:
+    """Stable identity for a ListPortInfo: USB serial number, BT address, or hwid"""
+    if getattr(port, 'serial_number', None):
+        return f"usb:{port.serial_number}"
+    hwid = getattr(port, 'hwid', None) or ''
+    if 'BTHENUM' in hwid.upper() or 'BLUETOOTH' in hwid.upper():
+        match = BT_ADDRESS_RE.search(hwid.split('\\')[-1])
+        if match:
+            return "bt:" + re.sub(r'[:-]', '', match.group(1)).upper()
+    if hwid and hwid != 'n/a':
+        return f"hwid:{hwid}"
+    return None
+
+def find_port(ports: List, device: str):
+    """ListPortInfo for a port name, or None"""
+    for port in ports:
+        if port.device == device:
+            return port
+    return None
+
+class PortCache:
+    """Last-known-good port per device id, persisted as JSON"""
+
+    def __init__(self, path: str = PORT_CACHE_FILE):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable port cache {self.path}: {e}")
+            self.entries = {}
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def remember(self, device_id: str, port: str, baudrate: int, ports: List):
+        """Record that `port` produced valid frames for `device_id`; `ports` is the current comports()"""
+        info = find_port(ports, port)
+        entry = {
+            "port": port,
+            "baudrate": baudrate,
+            "identity": port_identity(info) if info else None,
+            "last_good": datetime.now().isoformat()
+        }
+        previous = self.entries.get(device_id)
+        if previous and all(previous.get(k) == entry[k] for k in ("port", "baudrate", "identity")):
+            return
+        self.entries[device_id] = entry
+        try:
+            self.save()
+            logger.info(f"[{device_id}] Remembered {port} @ {baudrate} as last known good")
+        except Exception as e:
+            logger.warning(f"Could not write port cache: {e}")
+
+    def forget(self, device_id: str):
+        if self.entries.pop(device_id, None) is not None:
+            try:
+                self.save()
+            except Exception as e:
+                logger.warning(f"Could not write port cache: {e}")
+
+    def relocate(self, device_id: str, ports: List) -> Optional[str]:
+        """Current port name for the cached identity, if the OS renamed it"""
+        identity = self.entries.get(device_id, {}).get("identity")
+        if not identity:
+            return None
+        for port in ports:
+            if port_identity(port) == identity:
+                return port.device
+        return None
+
+    def items(self) -> List:
+        return list(self.entries.items())
+
+async def reconnect_cached(cache: PortCache, registry: DeviceRegistry, get_ports: Callable[[], Awaitable[List]],
+                           verify_timeout: float = 3.0) -> List[str]:
+    """Reopen each device's last known good port before any scanning
+
+    A cached port that no longer opens is looked for under a new name by its
+    hardware identity. A port that opens is kept only if it sends a valid
+    frame within `verify_timeout` seconds; otherwise the device is removed
+    so the caller can fall back to scanning. Returns the reconnected ids.
+    """
+    opened = []
+    for device_id, entry in cache.items():
+        port = entry["port"]
+        baudrate = entry.get("baudrate", 9600)
+        try:
+            opened.append(await registry.add(device_id, port, baudrate))
+            continue
+        except Exception as e:
+            error = e
+        # The OS may have given the same hardware a new port name
+        relocated = cache.relocate(device_id, await get_ports())
+        if not relocated or relocated == port:
+            logger.info(f"[{device_id}] Last known port {port} unavailable: {error}")
+            continue
+        try:
+            opened.append(await registry.add(device_id, relocated, baudrate))
+        except Exception as e:
+            logger.info(f"[{device_id}] Last known device moved to {relocated} but failed to open: {e}")
+
+    verified = await asyncio.gather(*(device.wait_verified(verify_timeout) for device in opened))
+    connected = []
+    for device, ok in zip(opened, verified):
+        if ok:
+            logger.info(f"[{device.device_id}] ✓ Reconnected to last known port {device.port}")
+            connected.append(device.device_id)
+        elif registry.get(device.device_id) is device:
+            logger.info(f"[{device.device_id}] Last known port {device.port} opened but sent no valid "
+                        f"frames in {verify_timeout:g}s")
+            await registry.remove(device.device_id)
+    return connected
@@ -0,0 +1,138 @@
+"""
+Find the serial port a sensor is actually talking on
+
+Every candidate port is opened on its own thread at the same time and
+listened to until one of them yields a frame that parses in a known
+format (Pico text, Arduino text or binary). The whole probe is bounded by
+a single deadline, so ten silent Bluetooth COM ports cost one timeout
+rather than ten.
+
+Used by the backend's auto-connect and /api/ports, and by
+firmware/find_hc05_port.py.
+"""
+import sys
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Optional, Dict, Any, List
+
+import serial
+
+from sensor_parser import DeviceParser
+from serial_ingest import StreamDecoder
+
+logger = logging.getLogger(__name__)
+
+HC05_KEYWORDS = ('hc-05', 'hc05', 'bluetooth', 'bt')
+
+def is_hc05_candidate(port) -> bool:
+    """Guess from the port name/description whether it could be the HC-05"""
+    device = port.device.lower()
+    description = (port.description or '').lower()
+    if sys.platform.startswith('win'):
+        return any(kw in description for kw in HC05_KEYWORDS)
+    # macOS / Linux: Bluetooth serial ports show up as /dev/tty.* or /dev/cu.*
+    if '/dev/tty.' in device or '/dev/cu.' in device:
+        return any(kw in device for kw in HC05_KEYWORDS) or 'serial' in device
+    return False
+
+class ProbeResult:
+    """What listening on one port turned up"""
+
+    def __init__(self, port: str, description: str = ""):
+        self.port = port
+        self.description = description
+        self.live = False
+        self.opened = False
+        self.format: Optional[str] = None
+        self.sample: Optional[Dict[str, Any]] = None
+        self.bytes = 0
+        self.error: Optional[str] = None
+        self.elapsed = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "port": self.port,
+            "description": self.description,
+            "live": self.live,
+            "opened": self.opened,
+            "format": self.format,
+            "bytes": self.bytes,
+            "error": self.error,
+            "elapsed_s": round(self.elapsed, 3)
+        }
+
+def listen(result: ProbeResult, baudrate: int, deadline: float,
+           found: Optional[threading.Event] = None):
+    """Open one port and read until a valid frame, the deadline, or another port sets `found`"""
+    start = time.monotonic()
+    connection = None
+    try:
+        connection = serial.Serial(result.port, baudrate, timeout=0.1)
+        result.opened = True
+        decoder = StreamDecoder(DeviceParser(detect_frames=1))
+        while time.monotonic() < deadline and not (found and found.is_set()):
+            data = connection.read(connection.in_waiting or 1)
+            if not data:
+                continue
+            result.bytes += len(data)
+            samples = decoder.feed(data)
+            if samples:
+                result.live = True
+                result.format = decoder.format
+                result.sample = samples[-1]
+                if found:
+                    found.set()
+                break
+        if not result.live and result.error is None:
+            result.error = "no valid frames" if result.bytes else "no data"
+    except Exception as e:
+        result.error = str(e)
+    finally:
+        if connection is not None and connection.is_open:
+            connection.close()
+        result.elapsed = time.monotonic() - start
+
+def probe_ports_blocking(ports: List, baudrate: int = 9600, timeout: float = 3.0,
+                         stop_on_first: bool = True) -> List[ProbeResult]:
+    """Probe `ports` (ListPortInfo objects or device names) in parallel within `timeout` seconds"""
+    results = [ProbeResult(port.device, port.description) if hasattr(port, 'device') else ProbeResult(port)
+               for port in ports]
+    if not results:
+        return results
+
+    found = threading.Event() if stop_on_first else None
+    deadline = time.monotonic() + timeout
+    executor = ThreadPoolExecutor(max_workers=len(results), thread_name_prefix="port-probe")
+    futures = [executor.submit(listen, result, baudrate, deadline, found) for result in results]
+    # Opening a Bluetooth port can block past the deadline; don't wait for those
+    wait(futures, timeout=timeout + 0.2)
+    executor.shutdown(wait=False)
+
+    for result, future in zip(results, futures):
+        if not future.done():
+            result.error = "timed out opening port"
+            result.elapsed = timeout
+    return results
+
+async def probe_ports(ports: List, baudrate: int = 9600, timeout: float = 3.0,
+                      stop_on_first: bool = True) -> List[ProbeResult]:
+    """Async wrapper around probe_ports_blocking for the servers"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, probe_ports_blocking, ports, baudrate, timeout, stop_on_first)
+
+def live_port(results: List[ProbeResult]) -> Optional[ProbeResult]:
+    """The first port that produced a valid frame"""
+    for result in results:
+        if result.live:
+            return result
+    return None
+
+def log_results(results: List[ProbeResult]):
+    for result in results:
+        if result.live:
+            logger.info(f"  {result.port}: live ({result.format}) after {result.elapsed:.2f}s")
+        else:
+            logger.info(f"  {result.port}: {result.error}")
@@ -0,0 +1,424 @@
+"""
+Sensor line parsers shared by main.py and simple_server.py
+
+The Pico firmware (voltage.py) sends one reading per line:
+    V: 0.003V | P: 0.00mW | E_inst: 0.000mJ | E_total: 0.000mWh | seq: 12 | ticks: 48213
+
+seq (u16, wrapping) and ticks (time.ticks_ms) are optional so older
+firmware still parses.
+
+The Arduino sketch sends a multi-line block:
+    Voltage: 1.5
+    Energy: 0.025
+    Steps: 150
+    Power: 2.25
+    LED: ON
+
+When asked with MODE BIN, voltage.py switches to 11-byte binary frames
+(little-endian): sync 0xA5, u16 seq, u32 ticks_ms, u16 raw ADC, u16 CRC-16
+(CCITT-FALSE over the first 9 bytes).
+"""
+import re
+import struct
+import binascii
+import logging
+from array import array
+from datetime import datetime
+from typing import Optional, Dict, Any, Iterable, List
+
+from clock_sync import TICKS_PERIOD
+
+logger = logging.getLogger(__name__)
+
+# One compiled pattern for the whole Pico line. The gaps are lazy so extra
+# fields (E_inst, or I: from piezo_energy_monitor.py) are skipped, and the
+# E_total/seq/ticks groups are optional just like the old per-field searches.
+PICO_LINE_RE = re.compile(
+    r'V:\s*([\d.]+)V'
+    r'.*?P:\s*([\d.]+)mW'
+    r'(?:.*?E_total:\s*([\d.]+)mWh)?'
+    r'(?:.*?seq:\s*(\d+))?'
+    r'(?:.*?ticks:\s*(\d+))?'
+)
+
+def parse_pico_line(line: str) -> Optional[Dict[str, Any]]:
+    """Parse a single Pico line (V/P/E_total) into a sample dict"""
+    match = PICO_LINE_RE.search(line)
+    if match is None:
+        return None
+
+    voltage, power_mw, energy_total_mwh, seq, ticks = match.groups()
+    try:
+        data = {
+            'voltage': float(voltage),  # V
+            'power': float(power_mw) / 1000.0,  # Convert mW to W
+            'energy': float(energy_total_mwh) if energy_total_mwh else 0.0,  # mWh (keep as is)
+            'steps': 0,  # Not available in Pico format
+            'led': 'OFF',  # Not available in Pico format
+            'timestamp': datetime.now().isoformat()
+        }
+    except ValueError:
+        # e.g. "1.2.3" matched [\d.]+ but is not a number
+        return None
+
+    if seq is not None:
+        data['seq'] = int(seq)
+    if ticks is not None:
+        data['ticks_ms'] = int(ticks)
+    return data
+
+def parse_arduino_block(raw_data: str) -> Optional[Dict[str, Any]]:
+    """Parse the multi-line Voltage/Energy/Steps/Power/LED block"""
+    data = {}
+
+    for line in raw_data.split('\n'):
+        line = line.strip()
+        if not line or line.startswith('-'):
+            continue
+
+        if ':' in line:
+            key, value = line.split(':', 1)
+            key = key.strip().lower()
+            value = value.strip()
+
+            if key == 'voltage':
+                data['voltage'] = float(value)
+            elif key == 'energy':
+                data['energy'] = float(value)
+            elif key == 'steps':
+                data['steps'] = int(value)
+            elif key == 'power':
+                data['power'] = float(value)
+            elif key == 'led':
+                data['led'] = value.upper()
+
+    if len(data) >= 5:  # Ensure we have all required fields
+        data['timestamp'] = datetime.now().isoformat()
+        return data
+    return None
+
+def parse_sensor_data(raw_data: str) -> Optional[Dict[str, Any]]:
+    """Parse the raw sensor data string into structured data
+
+    Tries the Pico single-line format first, then falls back to the
+    multi-line Arduino block.
+    """
+    try:
+        raw_data = raw_data.strip()
+
+        if '|' in raw_data:
+            data = parse_pico_line(raw_data)
+            if data:
+                return data
+
+        return parse_arduino_block(raw_data)
+    except Exception as e:
+        logger.error(f"Error parsing sensor data: {e}")
+
+    return None
+
+def parse_lines(lines: Iterable[str]) -> Dict[str, array]:
+    """Parse a batch of Pico lines into column arrays
+
+    Returns {'voltage', 'power', 'energy'} as array('d') columns in the same
+    units as parse_sensor_data, plus 'seq' and 'ticks_ms' as array('q')
+    columns holding -1 where a line has none. Lines that don't match are
+    skipped, so all columns always have the same length.
+    """
+    voltage = array('d')
+    power = array('d')
+    energy = array('d')
+    seqs = array('q')
+    ticks = array('q')
+    search = PICO_LINE_RE.search
+
+    for line in lines:
+        match = search(line)
+        if match is None:
+            continue
+        v, p, e, seq, tick = match.groups()
+        try:
+            v = float(v)
+            p = float(p) / 1000.0
+            e = float(e) if e else 0.0
+        except ValueError:
+            continue
+        voltage.append(v)
+        power.append(p)
+        energy.append(e)
+        seqs.append(int(seq) if seq is not None else -1)
+        ticks.append(int(tick) if tick is not None else -1)
+
+    return {'voltage': voltage, 'power': power, 'energy': energy, 'seq': seqs, 'ticks_ms': ticks}
+
+FORMAT_PICO = 'pico'
+FORMAT_ARDUINO = 'arduino'
+FORMAT_BINARY = 'binary'
+
+ARDUINO_FIELDS = ('voltage', 'energy', 'steps', 'power', 'led')
+
+def detect_format(line: str) -> Optional[str]:
+    """Fingerprint a single line as Pico or Arduino output"""
+    if '|' in line and PICO_LINE_RE.search(line):
+        return FORMAT_PICO
+    key = line.split(':', 1)[0].strip().lower() if ':' in line else ''
+    if key in ARDUINO_FIELDS:
+        return FORMAT_ARDUINO
+    return None
+
+class DeviceParser:
+    """Line parser that locks onto the format a device speaks
+
+    A port only ever talks one format, so after `detect_frames` samples of
+    the same format the matching parser is bound and every later line goes
+    straight to it. After `max_failures` consecutive lines the bound parser
+    rejects, the device is fingerprinted again.
+    """
+
+    def __init__(self, detect_frames: int = 3, max_failures: int = 20):
+        self.detect_frames = detect_frames
+        self.max_failures = max_failures
+        self.format: Optional[str] = None
+        self.failures = 0
+        self._votes = {FORMAT_PICO: 0, FORMAT_ARDUINO: 0}
+        self._block: Dict[str, Any] = {}
+        self._parse_line = self._detect_line
+
+    def feed_line(self, line: str) -> Optional[Dict[str, Any]]:
+        """Feed one stripped line, returning a sample when one is complete"""
+        return self._parse_line(line)
+
+    def feed_lines(self, lines: List[str]) -> List[Dict[str, Any]]:
+        """Feed a batch of stripped lines, returning every complete sample
+
+        Once the device is bound to the Pico format the rest of the batch is
+        parsed in one parse_lines call instead of line by line.
+        """
+        samples = []
+        index = 0
+        while index < len(lines) and self.format != FORMAT_PICO:
+            sample = self._parse_line(lines[index])
+            if sample:
+                samples.append(sample)
+            index += 1
+        if index < len(lines):
+            samples.extend(self._pico_lines(lines[index:]))
+        return samples
+
+    def reset(self):
+        """Forget the bound format and start fingerprinting again"""
+        self.format = None
+        self.failures = 0
+        self._votes = {FORMAT_PICO: 0, FORMAT_ARDUINO: 0}
+        self._block = {}
+        self._parse_line = self._detect_line
+
+    def _bind(self, fmt: str):
+        self.format = fmt
+        self.failures = 0
+        self._parse_line = self._pico_line if fmt == FORMAT_PICO else self._arduino_line
+        logger.info(f"Serial format detected: {fmt}")
+
+    def _detect_line(self, line: str) -> Optional[Dict[str, Any]]:
+        fmt = detect_format(line)
+        if fmt == FORMAT_PICO:
+            data = parse_pico_line(line)
+        elif fmt == FORMAT_ARDUINO:
+            try:
+                data = self._arduino_field(line)
+            except ValueError:
+                return None
+        else:
+            return None
+
+        if data:
+            # Samples seen while detecting are still delivered
+            self._votes[fmt] += 1
+            if self._votes[fmt] >= self.detect_frames:
+                self._bind(fmt)
+        return data
+
+    def _failed(self):
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            logger.warning(f"{self.failures} unparsable lines in {self.format} format - re-detecting")
+            self.reset()
+
+    def _pico_line(self, line: str) -> Optional[Dict[str, Any]]:
+        data = parse_pico_line(line)
+        if data is None:
+            if line:
+                self._failed()
+            return None
+        self.failures = 0
+        return data
+
+    def _pico_lines(self, lines: List[str]) -> List[Dict[str, Any]]:
+        columns = parse_lines(lines)
+        count = len(columns['voltage'])
+        if count:
+            self.failures = 0
+        else:
+            # Only a batch with no good line at all counts towards re-detection
+            self.failures += len(lines) - 1
+            self._failed()
+            return []
+
+        timestamp = datetime.now().isoformat()
+        samples = []
+        for voltage, power, energy, seq, ticks in zip(columns['voltage'], columns['power'], columns['energy'],
+                                                      columns['seq'], columns['ticks_ms']):
+            data = {
+                'voltage': voltage,
+                'power': power,
+                'energy': energy,
+                'steps': 0,
+                'led': 'OFF',
+                'timestamp': timestamp
+            }
+            if seq >= 0:
+                data['seq'] = seq
+            if ticks >= 0:
+                data['ticks_ms'] = ticks
+            samples.append(data)
+        return samples
+
+    def _arduino_line(self, line: str) -> Optional[Dict[str, Any]]:
+        if not line or line.startswith('-'):
+            return None
+        if ':' not in line:
+            self._failed()
+            return None
+        try:
+            data = self._arduino_field(line)
+        except ValueError:
+            self._failed()
+            return None
+        self.failures = 0
+        return data
+
+    def _arduino_field(self, line: str) -> Optional[Dict[str, Any]]:
+        """Accumulate one Key: value line, returning the block once complete"""
+        key, value = line.split(':', 1)
+        key = key.strip().lower()
+        value = value.strip()
+
+        if key == 'voltage':
+            # Voltage opens a new block, so drop any half-received one
+            self._block = {'voltage': float(value)}
+        elif key == 'energy':
+            self._block['energy'] = float(value)
+        elif key == 'steps':
+            self._block['steps'] = int(value)
+        elif key == 'power':
+            self._block['power'] = float(value)
+        elif key == 'led':
+            self._block['led'] = value.upper()
+        else:
+            return None
+
+        if len(self._block) >= 5:
+            data = self._block
+            data['timestamp'] = datetime.now().isoformat()
+            self._block = {}
+            return data
+        return None
+
+BINARY_SYNC = 0xA5
+BINARY_FRAME = struct.Struct('<BHIHH')  # sync, seq, ticks_ms, raw ADC, crc
+BINARY_CRC_SPAN = BINARY_FRAME.size - 2
+MODE_BINARY_COMMAND = b"MODE BIN\n"
+
+class BinaryFrameDecoder:
+    """Decode binary frames from voltage.py with struct.unpack_from
+
+    Raw ADC values are converted with the same calibration as
+    VoltageSensor.voltage(), and energy is integrated from the device's
+    ticks_ms so Bluetooth batching doesn't skew it.
+    """
+
+    def __init__(self, load_resistance: float = 330.0, min_analog: int = 600,
+                 max_analog: int = 65535, max_voltage: float = 16.3):
+        self.load_resistance = load_resistance
+        self.min_analog = min_analog
+        self.max_analog = max_analog
+        self.max_voltage = max_voltage
+        self.frames = 0
+        self.crc_errors = 0
+        self.skipped = 0  # Bytes discarded since the last good frame
+        self._buf = bytearray()
+        self._last_ticks: Optional[int] = None
+        self._total_energy_j = 0.0
+
+    def voltage(self, raw: int) -> float:
+        """Same conversion as VoltageSensor.voltage() on the Pico"""
+        v = (raw - self.min_analog) / (self.max_analog - self.min_analog) * self.max_voltage
+        return min(max(v, 0.0), self.max_voltage)
+
+    def feed(self, data: bytes) -> List[Dict[str, Any]]:
+        """Append bytes and return a sample for every frame with a valid CRC"""
+        buf = self._buf
+        buf += data
+        samples = []
+        size = BINARY_FRAME.size
+        unpack_from = BINARY_FRAME.unpack_from
+        pos = 0
+
+        while True:
+            start = buf.find(BINARY_SYNC, pos)
+            if start == -1:
+                self.skipped += len(buf) - pos
+                pos = len(buf)
+                break
+            self.skipped += start - pos
+            if len(buf) - start < size:
+                pos = start
+                break
+
+            _, seq, ticks, raw, crc = unpack_from(buf, start)
+            if binascii.crc_hqx(buf[start:start + BINARY_CRC_SPAN], 0xFFFF) != crc:
+                # Not a frame boundary (or corrupted) - resync from the next byte
+                self.crc_errors += 1
+                self.skipped += 1
+                pos = start + 1
+                continue
+
+            samples.append(self._sample(seq, ticks, raw))
+            self.skipped = 0
+            pos = start + size
+
+        del buf[:pos]
+        return samples
+
+    @property
+    def pending(self) -> int:
+        """Bytes of a partial frame waiting for the rest"""
+        return len(self._buf)
+
+    def take_pending(self) -> bytes:
+        """Hand back undecoded bytes (used when falling back to text)"""
+        data = bytes(self._buf)
+        self._buf = bytearray()
+        return data
+
+    def _sample(self, seq: int, ticks: int, raw: int) -> Dict[str, Any]:
+        voltage = self.voltage(raw)
+        power_w = voltage * voltage / self.load_resistance
+
+        if self._last_ticks is not None:
+            delta_s = ((ticks - self._last_ticks) % TICKS_PERIOD) / 1000.0
+            self._total_energy_j += power_w * delta_s
+        self._last_ticks = ticks
+        self.frames += 1
+
+        return {
+            'voltage': voltage,  # V
+            'power': power_w,  # W
+            'energy': self._total_energy_j / 3.6,  # mWh, same as E_total
+            'steps': 0,
+            'led': 'OFF',
+            'timestamp': datetime.now().isoformat(),
+            'seq': seq,
+            'ticks_ms': ticks,
+            'raw': raw
+        }
@@ -0,0 +1,422 @@
+"""
+Serial port readers that hand raw bytes to the asyncio loop
+
+Readers expose `chunks()`, an async iterator of bytes batches, so the
+framing/parsing loop in the servers doesn't care how bytes arrive:
+
+    poll   - check in_waiting on the event loop and sleep between checks
+    thread - blocking reads with a short timeout on a dedicated thread,
+             handed to the loop through an asyncio.Queue
+    fd     - (Linux) register the port fd with loop.add_reader and read only
+             when the kernel says data is ready; no wakeups while idle
+"""
+import asyncio
+import os
+import sys
+import time
+import threading
+import logging
+from datetime import datetime
+from typing import Optional, Dict, Any, AsyncIterator, List
+
+import serial
+
+from sensor_parser import DeviceParser, BinaryFrameDecoder, BINARY_SYNC, FORMAT_BINARY
+from clock_sync import ClockAligner
+
+logger = logging.getLogger(__name__)
+
+READER_POLL = 'poll'
+READER_THREAD = 'thread'
+READER_FD = 'fd'
+
+class IngestStats:
+    """Bytes and frames moved per reader wakeup"""
+
+    def __init__(self):
+        self.wakeups = 0
+        self.bytes = 0
+        self.frames = 0
+        self.last_bytes = 0
+        self.last_frames = 0
+
+    def record(self, nbytes: int, nframes: int):
+        self.wakeups += 1
+        self.bytes += nbytes
+        self.frames += nframes
+        self.last_bytes = nbytes
+        self.last_frames = nframes
+
+    def as_dict(self) -> Dict[str, Any]:
+        wakeups = self.wakeups or 1
+        return {
+            "wakeups": self.wakeups,
+            "bytes": self.bytes,
+            "frames": self.frames,
+            "bytes_per_wakeup": round(self.bytes / wakeups, 1),
+            "frames_per_wakeup": round(self.frames / wakeups, 2),
+            "last_bytes": self.last_bytes,
+            "last_frames": self.last_frames
+        }
+
+class PollingReader:
+    """Poll in_waiting from the event loop (works everywhere)"""
+
+    mode = READER_POLL
+
+    def __init__(self, connection: serial.Serial, interval: float = 0.01):
+        self.connection = connection
+        self.interval = interval
+        self.stats = IngestStats()
+        self._stopped = False
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        while not self._stopped and self.connection.is_open:
+            waiting = self.connection.in_waiting
+            if waiting > 0:
+                yield self.connection.read(waiting)
+            await asyncio.sleep(self.interval)  # Small delay to prevent busy waiting
+
+    def stop(self):
+        self._stopped = True
+
+class ThreadedReader:
+    """Blocking reads on a dedicated thread, batched onto the event loop
+
+    The thread blocks in read() for at most `read_timeout` seconds, so a slow
+    Bluetooth read never stalls the loop. Whatever arrived while the loop was
+    busy is drained in one go, so one wakeup can carry many frames.
+    """
+
+    mode = READER_THREAD
+
+    def __init__(self, connection: serial.Serial, read_timeout: float = 0.05):
+        self.connection = connection
+        self.read_timeout = read_timeout
+        self.stats = IngestStats()
+        self._queue: Optional[asyncio.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def _post(self, loop: asyncio.AbstractEventLoop, item: Any):
+        """Hand `item` to the loop; dropped if the loop has already shut down"""
+        if loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._queue.put_nowait, item)
+        except RuntimeError:
+            pass  # Closed between the check and the call
+
+    def _run(self, loop: asyncio.AbstractEventLoop):
+        try:
+            while not self._stopped.is_set() and self.connection.is_open:
+                data = self.connection.read(self.connection.in_waiting or 1)
+                if data:
+                    self._post(loop, data)
+        except Exception as e:
+            # Closing the port from disconnect is a normal way to stop
+            if not self._stopped.is_set() and self.connection.is_open:
+                self._post(loop, e)
+        finally:
+            self._post(loop, None)
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self.connection.timeout = self.read_timeout
+        self._thread = threading.Thread(target=self._run, args=(loop,),
+                                        name="serial-reader", daemon=True)
+        self._thread.start()
+
+        while True:
+            item = await self._queue.get()
+            # Drain everything the thread queued while we were busy
+            batch = []
+            while True:
+                if item is None:
+                    if batch:
+                        yield b"".join(batch)
+                    return
+                if isinstance(item, Exception):
+                    if batch:
+                        yield b"".join(batch)
+                    raise item
+                batch.append(item)
+                if self._queue.empty():
+                    break
+                item = self._queue.get_nowait()
+            yield b"".join(batch)
+
+    def stop(self):
+        self._stopped.set()
+
+class FdReader:
+    """Event-driven reads via loop.add_reader on the port's file descriptor
+
+    Nothing runs while the device is idle; the kernel wakes the loop when
+    bytes arrive and everything available is read in one os.read().
+    """
+
+    mode = READER_FD
+    MAX_EMPTY_READS = 10
+
+    def __init__(self, connection: serial.Serial, read_size: int = 65536,
+                 idle_check: float = 1.0):
+        self.connection = connection
+        self.read_size = read_size
+        self.idle_check = idle_check  # How often to notice a port closed elsewhere
+        self.stats = IngestStats()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._fd: Optional[int] = None
+        self._ready = asyncio.Event()
+        self._stopped = False
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        self._loop = asyncio.get_running_loop()
+        self._fd = self.connection.fileno()
+        self._loop.add_reader(self._fd, self._ready.set)
+
+        empty_reads = 0
+        try:
+            while not self._stopped and self.connection.is_open:
+                try:
+                    await asyncio.wait_for(self._ready.wait(), self.idle_check)
+                except asyncio.TimeoutError:
+                    continue
+                self._ready.clear()
+                if self._stopped or not self.connection.is_open:
+                    break
+
+                try:
+                    data = os.read(self._fd, self.read_size)
+                except BlockingIOError:
+                    continue
+                if not data:
+                    # A readiness callback queued before our last read can fire
+                    # once more; only a persistent empty read means hang-up.
+                    empty_reads += 1
+                    if empty_reads >= self.MAX_EMPTY_READS:
+                        raise serial.SerialException("device reports readiness to read but returned no data")
+                    continue
+                empty_reads = 0
+                yield data
+        finally:
+            self._remove_reader()
+
+    def _remove_reader(self):
+        if self._loop is not None and self._fd is not None:
+            try:
+                self._loop.remove_reader(self._fd)
+            except (OSError, ValueError):
+                pass
+            self._fd = None
+
+    def _wake(self):
+        self._remove_reader()
+        self._ready.set()
+
+    def stop(self):
+        """Stop reading; call before closing the port so the fd is unregistered first"""
+        self._stopped = True
+        if self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wake()
+        else:
+            self._loop.call_soon_threadsafe(self._wake)
+
+def fd_reader_supported(connection: serial.Serial) -> bool:
+    """Whether the port can be watched with loop.add_reader"""
+    if not sys.platform.startswith('linux') or not hasattr(connection, 'fileno'):
+        return False
+    try:
+        connection.fileno()
+    except Exception:
+        return False
+    return True
+
+def open_reader(connection: serial.Serial, mode: str = READER_THREAD, poll_interval: float = 0.01):
+    """Create a reader for an open serial connection
+
+    'fd' falls back to polling every `poll_interval` seconds where the port
+    isn't a selectable file descriptor.
+    """
+    if mode == READER_FD:
+        if fd_reader_supported(connection):
+            return FdReader(connection)
+        logger.info("fd-readiness ingest not available here - polling the serial port instead")
+        return PollingReader(connection, poll_interval)
+    if mode == READER_THREAD:
+        return ThreadedReader(connection)
+    return PollingReader(connection, poll_interval)
+
+class LineFramer:
+    """Split a byte stream into newline-terminated frames
+
+    Bytes are appended to one reusable bytearray and delimiters are found
+    with find() from a moving offset, so a large backlog is framed in linear
+    time. Consumed bytes are only compacted away once they make up most of
+    the buffer, and only complete frames are decoded to str.
+    """
+
+    def __init__(self, delimiter: bytes = b'\n', compact_at: int = 64 * 1024,
+                 max_partial: int = 64 * 1024):
+        self.delimiter = delimiter
+        self.compact_at = compact_at
+        self.max_partial = max_partial  # Drop a runaway frame with no delimiter
+        self._buf = bytearray()
+        self._pos = 0
+
+    def feed(self, data: bytes) -> List[str]:
+        """Append bytes and return every complete frame, stripped and decoded"""
+        buf = self._buf
+        buf += data
+        frames = []
+        find = buf.find
+        delimiter = self.delimiter
+        step = len(delimiter)
+        pos = self._pos
+
+        end = find(delimiter, pos)
+        while end != -1:
+            if end > pos:
+                frame = buf[pos:end].decode('utf-8', errors='ignore').strip()
+                if frame:
+                    frames.append(frame)
+            pos = end + step
+            end = find(delimiter, pos)
+
+        if len(buf) - pos > self.max_partial:
+            logger.warning(f"Dropping {len(buf) - pos} bytes with no frame delimiter")
+            pos = len(buf)
+
+        # Compact only once the consumed prefix dominates the buffer
+        if pos >= self.compact_at or pos == len(buf):
+            del buf[:pos]
+            pos = 0
+        self._pos = pos
+        return frames
+
+    @property
+    def pending(self) -> int:
+        """Bytes of an incomplete frame waiting for its delimiter"""
+        return len(self._buf) - self._pos
+
+class SequenceTracker:
+    """Received/lost/out-of-order accounting from device sequence numbers
+
+    Sequence numbers are u16 and wrap. A gap counts the skipped numbers as
+    lost; a number slightly behind the newest one is a late (out-of-order)
+    frame and is taken back off the lost count. A big backwards jump means
+    the device restarted.
+    """
+
+    def __init__(self, modulus: int = 1 << 16, reorder_window: int = 64):
+        self.modulus = modulus
+        self.reorder_window = reorder_window
+        self.received = 0
+        self.lost = 0
+        self.out_of_order = 0
+        self.duplicates = 0
+        self.restarts = 0
+        self.last_seq: Optional[int] = None
+
+    def observe(self, seq: int):
+        self.received += 1
+        if self.last_seq is None:
+            self.last_seq = seq
+            return
+
+        ahead = (seq - self.last_seq) % self.modulus
+        if ahead == 0:
+            self.duplicates += 1
+        elif ahead <= self.modulus // 2:
+            self.lost += ahead - 1
+            self.last_seq = seq
+        elif self.modulus - ahead <= self.reorder_window:
+            self.out_of_order += 1
+            self.lost = max(0, self.lost - 1)
+        else:
+            self.restarts += 1
+            self.last_seq = seq
+
+    def as_dict(self) -> Dict[str, Any]:
+        expected = self.received + self.lost
+        return {
+            "received": self.received,
+            "lost": self.lost,
+            "out_of_order": self.out_of_order,
+            "duplicates": self.duplicates,
+            "restarts": self.restarts,
+            "loss_ratio": round(self.lost / expected, 4) if expected else 0.0
+        }
+
+class StreamDecoder:
+    """Turn raw serial bytes into samples, whether the device sends text or binary
+
+    Text goes through LineFramer and DeviceParser. The binary sync byte never
+    appears in the text formats, so the first chunk carrying it is tried as
+    binary; once a frame passes its CRC the stream stays binary until
+    `max_skipped` bytes go by without a valid frame.
+    """
+
+    def __init__(self, parser: DeviceParser, binary: Optional[BinaryFrameDecoder] = None,
+                 max_skipped: int = 512):
+        self.parser = parser
+        self.binary = binary or BinaryFrameDecoder()
+        self.framer = LineFramer()
+        self.max_skipped = max_skipped
+        self.is_binary = False
+        self.sequence = SequenceTracker()
+        self.clock = ClockAligner()
+
+    @property
+    def format(self) -> Optional[str]:
+        return FORMAT_BINARY if self.is_binary else self.parser.format
+
+    def feed(self, data: bytes, received_at: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Decode one chunk; `received_at` is when it was read (defaults to now)"""
+        samples = self._decode(data)
+        if not samples:
+            return samples
+
+        # Everything in one chunk arrived together; device ticks tell them apart
+        host_time = received_at if received_at is not None else time.time()
+        observe = self.sequence.observe
+        align = self.clock.align
+        for sample in samples:
+            seq = sample.get('seq')
+            if seq is not None:
+                observe(seq)
+            ticks = sample.get('ticks_ms')
+            if ticks is not None:
+                sample['timestamp'] = datetime.fromtimestamp(align(ticks, host_time)).isoformat()
+        return samples
+
+    def _decode(self, data: bytes) -> List[Dict[str, Any]]:
+        if self.is_binary:
+            samples = self.binary.feed(data)
+            if self.binary.skipped > self.max_skipped:
+                logger.warning("Binary frames lost - falling back to text parsing")
+                self.is_binary = False
+                self.parser.reset()
+                samples.extend(self._feed_text(self.binary.take_pending()))
+            return samples
+
+        if BINARY_SYNC in data or self.binary.pending:
+            # Keep a partial frame around until the next chunk completes it
+            samples = self.binary.feed(data)
+            if samples:
+                logger.info(f"Serial format detected: {FORMAT_BINARY}")
+                self.is_binary = True
+                return samples
+
+        return self._feed_text(data)
+
+    def _feed_text(self, data: bytes) -> List[Dict[str, Any]]:
+        lines = self.framer.feed(data)
+        return self.parser.feed_lines(lines) if lines else []
@@ -0,0 +1,144 @@
+"""
+Blocking serial calls kept off the event loop
+
+Opening, writing to or closing a Bluetooth SPP port, or enumerating COM
+ports, can block for seconds. These helpers run them on a small dedicated
+thread pool with a timeout, so a stuck port can never freeze WebSocket
+broadcasts, and cache the port list so many dashboards polling /api/ports
+share one enumeration.
+"""
+import time
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Callable
+
+import serial
+import serial.tools.list_ports
+
+logger = logging.getLogger(__name__)
+
+class SerialIOTimeout(serial.SerialException):
+    """A blocking serial call did not finish in time"""
+
+class BlockingIO:
+    """Bounded thread pool for blocking serial calls
+
+    At most `max_workers` calls run at once and at most `max_pending` may be
+    waiting for a worker; beyond that callers wait (within their timeout)
+    rather than piling up threads.
+    """
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 16):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="serial-io")
+        self.max_pending = max_pending
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.calls = 0
+        self.timeouts = 0
+
+    async def run(self, func: Callable, *args, timeout: float = 5.0, name: Optional[str] = None,
+                  on_late_result: Optional[Callable[[Any], None]] = None):
+        """Run func(*args) on the pool; raise SerialIOTimeout after `timeout` seconds
+
+        The worker thread can't be interrupted, so a call that finishes after
+        the timeout hands its result to `on_late_result` (e.g. to close a port
+        nobody is waiting for any more).
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        name = name or getattr(func, '__qualname__', repr(func))
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise SerialIOTimeout(f"{name} timed out waiting for a worker")
+
+        self.calls += 1
+        future = loop.run_in_executor(self.executor, functools.partial(func, *args))
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            if on_late_result is not None:
+                future.add_done_callback(functools.partial(_late_result, on_late_result))
+            raise SerialIOTimeout(f"{name} timed out after {timeout:g}s")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "timeouts": self.timeouts}
+
+def _late_result(callback: Callable[[Any], None], future: asyncio.Future):
+    if not future.cancelled() and future.exception() is None:
+        callback(future.result())
+
+def _close_port(connection: serial.Serial):
+    logger.warning(f"Closing {connection.port}: it opened after the caller gave up")
+    connection.close()
+
+serial_io = BlockingIO()
+
+async def open_serial(port: str, baudrate: int = 9600, open_timeout: float = 5.0, **serial_kwargs) -> serial.Serial:
+    """serial.Serial(port, baudrate, **serial_kwargs) without blocking the loop"""
+    return await serial_io.run(functools.partial(serial.Serial, port, baudrate, **serial_kwargs),
+                               timeout=open_timeout, name=f"Opening {port}", on_late_result=_close_port)
+
+async def write_serial(connection: serial.Serial, data: bytes, timeout: float = 5.0) -> int:
+    """connection.write(data) without blocking the loop"""
+    return await serial_io.run(connection.write, data, timeout=timeout, name=f"Writing to {connection.port}")
+
+async def close_serial(connection: serial.Serial, timeout: float = 5.0):
+    """connection.close() without blocking the loop
+
+    A close that times out is left to finish on its worker; the caller
+    carries on as if the port were closed.
+    """
+    try:
+        await serial_io.run(connection.close, timeout=timeout, name=f"Closing {connection.port}")
+    except SerialIOTimeout as e:
+        logger.warning(str(e))
+
+class PortListCache:
+    """comports() with a short TTL; concurrent refreshes share one enumeration"""
+
+    def __init__(self, ttl: float = 2.0, timeout: float = 5.0):
+        self.ttl = ttl
+        self.timeout = timeout
+        self._ports: Optional[List] = None
+        self._fetched_at = 0.0
+        self._refresh: Optional[asyncio.Future] = None
+        self.hits = 0
+        self.refreshes = 0
+        self.shared = 0
+
+    async def get(self, max_age: Optional[float] = None) -> List:
+        max_age = self.ttl if max_age is None else max_age
+        if self._ports is not None and time.monotonic() - self._fetched_at < max_age:
+            self.hits += 1
+            return self._ports
+
+        if self._refresh is None or self._refresh.done():
+            self.refreshes += 1
+            self._refresh = asyncio.ensure_future(self._enumerate())
+        else:
+            self.shared += 1
+        # shield: one caller giving up must not cancel the others' refresh
+        return await asyncio.shield(self._refresh)
+
+    async def _enumerate(self) -> List:
+        ports = await serial_io.run(serial.tools.list_ports.comports, timeout=self.timeout,
+                                    name="Listing serial ports")
+        self._ports = list(ports)
+        self._fetched_at = time.monotonic()
+        return self._ports
+
+    def invalidate(self):
+        self._ports = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"ttl_s": self.ttl, "hits": self.hits, "refreshes": self.refreshes, "shared": self.shared}
+
+port_list = PortListCache()
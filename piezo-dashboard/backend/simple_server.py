@@ -1,34 +1,73 @@
+"""
+Lightweight dashboard server without FastAPI
+
+One asyncio server on one port serves the frontend's static files, the JSON
+API, /api/stream (Server-Sent Events) and WebSocket upgrades (/ws, or
+/ws/<device_id> for one device). Every connection is a coroutine on the
+same loop as serial ingest, so a slow request never holds up another and
+API handlers await the registry directly. WebSocket framing and
+permessage-deflate come from the websockets package's sans-I/O
+ServerConnection.
+"""
 import asyncio
 import json
 import csv
 import os
-import re
-import http.server
-import socketserver
-import threading
+import mimetypes
 import urllib.parse
 import random
 import time
 from datetime import datetime
-from typing import Optional, Dict, Any, List
-import serial
-import serial.tools.list_ports
-import websockets
+from http import HTTPStatus
+from typing import Optional, Dict, Any, List, Tuple
+from websockets.connection import OPEN, CLOSED
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+from websockets.frames import OP_TEXT, OP_CONT
+from websockets.server import ServerConnection
 import logging
+from serial_ingest import READER_FD
+from device_registry import DeviceRegistry, DEFAULT_DEVICE_ID
+from ingest_queue import IngestQueue, POLICY_BLOCK, POLICY_DROP_OLDEST
+from pipeline import build_pipeline, DEFAULT_STAGES
+from port_probe import is_hc05_candidate, probe_ports, live_port
+from port_cache import PortCache, reconnect_cached
+from serial_io import port_list
+from fanout import (Fanout, ENCODING_BINARY, ENCODING_JSON, SUBPROTOCOL_BINARY, SSE_RETRY_MS,
+                    query_subscription)
+from history import History
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# HTTP, API, event streams and WebSockets all share this port. Idle
+# keep-alive connections are closed after HTTP_KEEPALIVE_TIMEOUT seconds;
+# idle event streams get a comment every SSE_HEARTBEAT_INTERVAL seconds
+HOST = ""  # All interfaces
+PORT = 8888
+FRONTEND_DIR = os.path.realpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frontend'))
+HTTP_KEEPALIVE_TIMEOUT = 60.0
+SSE_HEARTBEAT_INTERVAL = 15.0
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type'
+}
+
 # Global variables
-serial_connection: Optional[serial.Serial] = None
-connected_websockets: List = []
+# Connected WebSocket clients; each message is serialized once for all of them
+# and queued per client, slow clients get coalesced samples. New clients get a
+# snapshot of the last 60 s per device (at most 600 points)
+fanout = Fanout(send_timeout=1.0, max_queue=32, evict_after=10.0,
+                history=History(seconds=60.0, capacity=65536, max_points=600))
 is_logging = False
 csv_file_path = None
 csv_writer = None
 csv_file = None
 dummy_data_enabled = False
 dummy_data_task = None
+# Static file contents by path, with the ETag they were read at
+static_cache: Dict[str, Tuple[str, bytes, str]] = {}
 
 # Dummy data simulation state
 dummy_state = {
@@ -81,12 +120,8 @@ async def generate_dummy_data():
                 'led': dummy_state['led']
             }
             
-            # Broadcast to all connected clients immediately
-            await broadcast_to_websockets(data)
-            
-            # Log to CSV if logging is enabled
-            if is_logging:
-                log_to_csv(data)
+            # Already decoded, so this skips the parse stage
+            await pipeline.submit_samples([data])
             
             # Fast update rate: 100ms (10 updates per second) for smooth animation
             await asyncio.sleep(0.1)
@@ -97,41 +132,6 @@ async def generate_dummy_data():
     
     logger.info("🎭 Dummy data generator stopped - File deleted or disabled")
 
-def parse_sensor_data(raw_data: str) -> Optional[Dict[str, Any]]:
-    """Parse the raw sensor data string into structured data"""
-    try:
-        lines = raw_data.strip().split('\n')
-        data = {}
-        
-        for line in lines:
-            line = line.strip()
-            if not line or line.startswith('-'):
-                continue
-                
-            if ':' in line:
-                key, value = line.split(':', 1)
-                key = key.strip().lower()
-                value = value.strip()
-                
-                if key == 'voltage':
-                    data['voltage'] = float(value)
-                elif key == 'energy':
-                    data['energy'] = float(value)
-                elif key == 'steps':
-                    data['steps'] = int(value)
-                elif key == 'power':
-                    data['power'] = float(value)
-                elif key == 'led':
-                    data['led'] = value.upper()
-        
-        if len(data) >= 5:  # Ensure we have all required fields
-            data['timestamp'] = datetime.now().isoformat()
-            return data
-    except Exception as e:
-        logger.error(f"Error parsing sensor data: {e}")
-    
-    return None
-
 def setup_csv_logging():
     """Setup CSV file for data logging"""
     global csv_file_path, csv_writer, csv_file
@@ -144,7 +144,7 @@ def setup_csv_logging():
     
     csv_file = open(csv_file_path, 'w', newline='')
     csv_writer = csv.writer(csv_file)
-    csv_writer.writerow(['timestamp', 'voltage', 'energy', 'steps', 'power', 'led'])
+    csv_writer.writerow(['timestamp', 'voltage', 'energy', 'steps', 'power', 'led', 'device'])
     csv_file.flush()
     
     logger.info(f"CSV logging started: {csv_file_path}")
@@ -161,7 +161,8 @@ def log_to_csv(data: Dict[str, Any]):
                 data['energy'],
                 data['steps'],
                 data['power'],
-                data['led']
+                data['led'],
+                data.get('device', DEFAULT_DEVICE_ID)
             ])
             csv_file.flush()
         except Exception as e:
@@ -177,238 +178,450 @@ def close_csv_logging():
         csv_writer = None
         logger.info("CSV logging stopped")
 
-async def broadcast_to_websockets(data):
-    """Broadcast data to all connected WebSocket clients"""
-    if connected_websockets:
-        disconnected = []
-        for websocket in connected_websockets:
-            try:
-                await websocket.send(json.dumps(data))
-            except Exception as e:
-                logger.error(f"Error sending to WebSocket: {e}")
-                disconnected.append(websocket)
-        
-        # Remove disconnected clients
-        for websocket in disconnected:
-            if websocket in connected_websockets:
-                connected_websockets.remove(websocket)
-
-async def read_serial_data():
-    """Continuously read data from serial port with minimal latency"""
-    global serial_connection
+async def broadcast_to_websockets(data, device_id: Optional[str] = None):
+    """Broadcast data to all-devices clients and to the device's own channel"""
+    await fanout.broadcast(data, device_id)
+
+async def send_to_viewers(data: Dict[str, Any]):
+    """Viewer consumer: push a sample to the WebSocket clients"""
+    await broadcast_to_websockets(data, data.get('device'))
+
+async def store_sample(data: Dict[str, Any]):
+    """Storage consumer: log to CSV if logging is enabled"""
+    if is_logging:
+        log_to_csv(data)
+
+# The CSV writer never loses rows; viewers drop the oldest samples when behind
+ingest_queue = IngestQueue()
+ingest_queue.add_consumer("storage", store_sample, POLICY_BLOCK, 10000)
+ingest_queue.add_consumer("viewers", send_to_viewers, POLICY_DROP_OLDEST, 1000)
+
+pipeline = build_pipeline(DEFAULT_STAGES, {"ingest_queue": ingest_queue})
+
+port_cache = PortCache()
+
+async def save_port(device_id: str, port: str, baudrate: int):
+    try:
+        ports = await port_list.get()
+    except Exception as e:
+        logger.warning(f"Could not list ports for the port cache: {e}")
+        ports = []
+    await asyncio.get_running_loop().run_in_executor(None, port_cache.remember, device_id, port, baudrate, ports)
+
+def remember_port(device):
+    """Persist a port once it has produced valid frames"""
+    asyncio.ensure_future(save_port(device.device_id, device.port, device.baudrate))
+
+# Wake only when a port has data (Linux); elsewhere fall back to 1ms polling
+registry = DeviceRegistry(pipeline.submit_chunk, on_verified=remember_port,
+                          reader_mode=READER_FD, poll_interval=0.001)
+
+async def connect_device(device_id: str, port: str, baudrate: int, reconnect: bool = True):
+    """Open a device on the loop and stop dummy data once a real sensor is connected"""
+    device = await registry.add(device_id, port, baudrate, reconnect=reconnect)
     
-    buffer = ""
+    # Stop dummy data when real connection is made
+    if dummy_data_task and not dummy_data_task.done():
+        logger.info("🔌 Real sensor connected - stopping dummy data")
+        dummy_data_task.cancel()
     
-    while serial_connection and serial_connection.is_open:
-        try:
-            if serial_connection.in_waiting > 0:
-                chunk = serial_connection.read(serial_connection.in_waiting).decode('utf-8', errors='ignore')
-                buffer += chunk
-                
-                # Look for complete data blocks (ending with dashes or newlines)
-                if '-------' in buffer or buffer.count('\n') >= 5:
-                    parts = buffer.split('-------')
-                    for part in parts[:-1]:  # Process all complete parts
-                        if part.strip():
-                            parsed_data = parse_sensor_data(part)
-                            if parsed_data:
-                                # Broadcast immediately - no buffering
-                                await broadcast_to_websockets(parsed_data)
-                                
-                                # Log to CSV if logging is enabled
-                                if is_logging:
-                                    log_to_csv(parsed_data)
-                    
-                    # Keep the incomplete part in buffer
-                    buffer = parts[-1]
-            
-            # Ultra-short delay for instant response (1ms)
-            await asyncio.sleep(0.001)
-            
-        except Exception as e:
-            logger.error(f"Error reading serial data: {e}")
-            break
+    return device.status()
 
-async def websocket_handler(websocket, path):
-    """Handle WebSocket connections"""
-    connected_websockets.append(websocket)
-    logger.info(f"WebSocket connected. Total connections: {len(connected_websockets)}")
-    
+class HTTPRequest:
+    """A parsed HTTP/1.1 request; `head` keeps the raw request line and headers"""
+
+    def __init__(self, head: bytes):
+        self.head = head
+        lines = head.decode('latin-1').split('\r\n')
+        self.method, target, self.version = lines[0].split(' ', 2)
+        url = urllib.parse.urlsplit(target)
+        self.path = urllib.parse.unquote(url.path)
+        self.query = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        self.headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                self.headers[name.strip().lower()] = value.strip()
+        self.body = b''
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return 'keep-alive' in connection
+        return 'close' not in connection
+
+    @property
+    def is_websocket(self) -> bool:
+        return self.headers.get('upgrade', '').lower() == 'websocket'
+
+    def json(self) -> Dict[str, Any]:
+        """The body as a JSON object; ValueError (a 400) if it is anything else"""
+        data = json.loads(self.body.decode('utf-8')) if self.body else {}
+        if not isinstance(data, dict):
+            raise ValueError(f"Request body must be a JSON object, got {type(data).__name__}")
+        return data
+
+def response_head(status: int, headers: Dict[str, str]) -> bytes:
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+async def send_response(writer: asyncio.StreamWriter, status: int, body: bytes = b'',
+                        content_type: Optional[str] = None, headers: Optional[Dict[str, str]] = None,
+                        keep_alive: bool = True):
+    """Write a complete response (head and body in one write)"""
+    all_headers = {"Content-Length": str(len(body)), "Connection": "keep-alive" if keep_alive else "close"}
+    if content_type:
+        all_headers["Content-Type"] = content_type
+    all_headers.update(headers or {})
+    writer.write(response_head(status, all_headers) + body)
+    await writer.drain()
+
+async def send_api_response(writer: asyncio.StreamWriter, data: Any, keep_alive: bool = True, status: int = 200):
+    """Send JSON API response"""
+    await send_response(writer, status, json.dumps(data).encode(), 'application/json', CORS_HEADERS, keep_alive)
+
+def static_file(path: str) -> Optional[Tuple[str, bytes, str]]:
+    """Path, contents and ETag of a file under FRONTEND_DIR, or None; contents are cached until it changes"""
+    if path == '/':
+        path = '/index.html'
+    elif path.startswith('/static/'):
+        # Remove /static/ prefix since files are in frontend folder
+        path = path[len('/static'):]
+    full_path = os.path.realpath(os.path.join(FRONTEND_DIR, path.lstrip('/')))
+    if not full_path.startswith(FRONTEND_DIR + os.sep):
+        return None
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        return None
+    if not os.path.isfile(full_path):
+        return None
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    cached = static_cache.get(full_path)
+    if cached is None or cached[2] != etag:
+        with open(full_path, 'rb') as f:
+            cached = static_cache[full_path] = (full_path, f.read(), etag)
+    return cached
+
+async def serve_static(request: HTTPRequest, writer: asyncio.StreamWriter):
+    found = static_file(request.path)
+    if found is None:
+        await send_response(writer, 404, b'Not found', 'text/plain', keep_alive=request.keep_alive)
+        return
+    full_path, body, etag = found
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get('if-none-match') == etag:
+        await send_response(writer, 304, headers=headers, keep_alive=request.keep_alive)
+        return
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if request.method == 'HEAD':
+        headers["Content-Length"] = str(len(body))
+        body = b''
+    await send_response(writer, 200, body, content_type, headers, request.keep_alive)
+
+async def get_available_ports(probe: bool = False):
+    """Get list of available serial ports (?probe=1 listens on HC-05 candidates in parallel)
+
+    Ports a registered device is reading are marked in_use and not probed.
+    """
     try:
-        async for message in websocket:
-            # Handle incoming messages if needed
-            pass
+        # Cached briefly; concurrent requests share one comports() call
+        ports = await port_list.get()
+        in_use = registry.ports()
+        port_infos = []
+        for port in ports:
+            port_info = {"device": port.device, "description": port.description}
+            if port.device in in_use:
+                port_info["in_use"] = in_use[port.device]
+            port_infos.append(port_info)
+        if not probe:
+            return {"ports": port_infos}
+        
+        hc05 = [port for port in ports if is_hc05_candidate(port)]
+        candidates = [port for port in hc05 if port.device not in in_use]
+        results = {result.port: result for result in await probe_ports(candidates)} if candidates else {}
+        for port_info in port_infos:
+            if port_info["device"] in results:
+                port_info["probe"] = results[port_info["device"]].as_dict()
+        live = live_port(list(results.values()))
+        hc05_port = live.port if live else registry.connected_port(port.device for port in hc05)
+        return {"ports": port_infos, "auto_detected_hc05": hc05_port}
     except Exception as e:
-        logger.error(f"WebSocket error: {e}")
-    finally:
-        if websocket in connected_websockets:
-            connected_websockets.remove(websocket)
-        logger.info(f"WebSocket disconnected. Total connections: {len(connected_websockets)}")
+        logger.error(f"Error getting ports: {e}")
+        return {"ports": []}
 
-class DashboardHTTPHandler(http.server.SimpleHTTPRequestHandler):
-    """HTTP handler for the dashboard"""
+async def connect_serial(data):
+    """Connect to serial port (replaces the device with the same id)"""
+    try:
+        port = data.get('port')
+        baudrate = data.get('baudrate', 9600)
+        device_id = data.get('device_id', DEFAULT_DEVICE_ID)
+        
+        await connect_device(device_id, port, baudrate, data.get('reconnect', True))
+        
+        return {"status": "connected", "port": port, "baudrate": baudrate, "device_id": device_id}
     
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory="../frontend", **kwargs)
+    except Exception as e:
+        logger.error(f"Error connecting to serial port: {e}")
+        return {"status": "error", "message": str(e)}
+
+async def disconnect_serial(device_id: str = DEFAULT_DEVICE_ID):
+    """Disconnect from serial port"""
+    try:
+        await registry.remove(device_id)
+        return {"status": "disconnected"}
     
-    def do_GET(self):
-        if self.path == '/':
-            self.path = '/index.html'
-        elif self.path.startswith('/static/'):
-            # Remove /static/ prefix since files are in frontend folder
-            self.path = self.path.replace('/static/', '/')
-        elif self.path == '/api/ports':
-            self.send_api_response(self.get_available_ports())
-            return
-        elif self.path == '/api/status':
-            self.send_api_response(self.get_status())
-            return
-        
-        super().do_GET()
+    except Exception as e:
+        logger.error(f"Error disconnecting: {e}")
+        return {"status": "error", "message": str(e)}
+
+def start_logging():
+    """Start CSV logging"""
+    global is_logging
     
-    def do_POST(self):
-        if self.path == '/api/connect':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
-            self.send_api_response(self.connect_serial(data))
-        elif self.path == '/api/disconnect':
-            self.send_api_response(self.disconnect_serial())
-        elif self.path == '/api/logging/start':
-            self.send_api_response(self.start_logging())
-        elif self.path == '/api/logging/stop':
-            self.send_api_response(self.stop_logging())
-        else:
-            super().do_POST()
+    try:
+        if not is_logging:
+            setup_csv_logging()
+            is_logging = True
+        return {"status": "logging_started", "file": csv_file_path}
     
-    def send_api_response(self, data):
-        """Send JSON API response"""
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
+    except Exception as e:
+        logger.error(f"Error starting logging: {e}")
+        return {"status": "error", "message": str(e)}
+
+def stop_logging():
+    """Stop CSV logging"""
+    global is_logging
     
-    def get_available_ports(self):
-        """Get list of available serial ports"""
-        try:
-            ports = serial.tools.list_ports.comports()
-            port_list = [{"device": port.device, "description": port.description} for port in ports]
-            return {"ports": port_list}
-        except Exception as e:
-            logger.error(f"Error getting ports: {e}")
-            return {"ports": []}
+    try:
+        is_logging = False
+        close_csv_logging()
+        return {"status": "logging_stopped"}
     
-    def connect_serial(self, data):
-        """Connect to serial port"""
-        global serial_connection, dummy_data_task
-        
-        try:
-            if serial_connection and serial_connection.is_open:
-                serial_connection.close()
-            
-            port = data.get('port')
-            baudrate = data.get('baudrate', 9600)
-            
-            serial_connection = serial.Serial(port, baudrate, timeout=1)
-            
-            # Stop dummy data when real connection is made
-            if dummy_data_task and not dummy_data_task.done():
-                logger.info("🔌 Real sensor connected - stopping dummy data")
-                dummy_data_task.cancel()
-            
-            # Start reading data in background
-            asyncio.create_task(read_serial_data())
-            
-            return {"status": "connected", "port": port, "baudrate": baudrate}
-        
-        except Exception as e:
-            logger.error(f"Error connecting to serial port: {e}")
-            return {"status": "error", "message": str(e)}
+    except Exception as e:
+        logger.error(f"Error stopping logging: {e}")
+        return {"status": "error", "message": str(e)}
+
+def get_status():
+    """Get current system status"""
+    return {
+        "serial_connected": registry.any_connected,
+        "devices": registry.status(),
+        "logging": is_logging,
+        "csv_file": csv_file_path if is_logging else None,
+        "websocket_connections": len(fanout),
+        "queues": ingest_queue.stats(),
+        "pipeline": pipeline.stats(),
+        "fanout": fanout.stats()
+    }
+
+async def handle_api(request: HTTPRequest) -> Optional[Any]:
+    """JSON body for an /api/ request, or None if there is no such endpoint"""
+    method, path = request.method, request.path
+    if path.startswith('/api/devices/'):
+        device_id = path[len('/api/devices/'):].strip('/')
+        current = registry.status().get(device_id)
+        if method == 'GET':
+            return current or {"status": "error", "message": "Unknown device"}
+        if method == 'PUT':
+            if current is None:
+                return {"status": "error", "message": "Unknown device"}
+            data = request.json()
+            return await connect_serial({
+                'device_id': device_id,
+                'port': data.get('port') or current['port'],
+                'baudrate': data.get('baudrate') or current['baudrate'],
+                'reconnect': data.get('reconnect', current['reconnect'])
+            })
+        if method == 'DELETE':
+            removed = await registry.remove(device_id)
+            if removed:
+                port_cache.forget(device_id)
+            return {"status": "removed" if removed else "error"}
+        return None
     
-    def disconnect_serial(self):
-        """Disconnect from serial port"""
-        global serial_connection
-        
-        try:
-            if serial_connection and serial_connection.is_open:
-                serial_connection.close()
-                serial_connection = None
-            return {"status": "disconnected"}
-        
-        except Exception as e:
-            logger.error(f"Error disconnecting: {e}")
-            return {"status": "error", "message": str(e)}
+    if method == 'GET':
+        if path == '/api/ports':
+            return await get_available_ports(request.query.get('probe', 'false').lower() in ('1', 'true', 'yes'))
+        if path == '/api/status':
+            return get_status()
+        if path == '/api/devices':
+            return {"devices": list(registry.status().values())}
+    elif method == 'POST':
+        if path == '/api/connect':
+            return await connect_serial(request.json())
+        if path == '/api/disconnect':
+            return await disconnect_serial(request.query.get('device_id', DEFAULT_DEVICE_ID))
+        if path == '/api/devices':
+            data = request.json()
+            if data.get('device_id') in registry.status():
+                return {"status": "error", "message": "Device already exists"}
+            return await connect_serial(data)
+        if path == '/api/logging/start':
+            return start_logging()
+        if path == '/api/logging/stop':
+            return stop_logging()
+    return None
+
+async def serve_event_stream(request: HTTPRequest, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """/api/stream: Server-Sent Events from the fan-out, one HTTP chunk per write"""
+    try:
+        client = fanout.add_stream(writer, query_subscription(request.query))
+    except ValueError as e:
+        await send_api_response(writer, {"status": "error", "message": str(e)}, request.keep_alive, 400)
+        return
+    logger.info(f"Event stream connected. Total connections: {len(fanout)}")
+    try:
+        writer.write(response_head(200, {"Content-Type": "text/event-stream; charset=utf-8",
+                                         "Cache-Control": "no-cache", "X-Accel-Buffering": "no",
+                                         "Transfer-Encoding": "chunked", **CORS_HEADERS}))
+        chunks = client.stream(SSE_HEARTBEAT_INTERVAL)
+        first = f"retry: {SSE_RETRY_MS}\n\n"
+        async for chunk in chunks:
+            data = (first + chunk).encode() if first else chunk.encode()
+            first = None
+            writer.write(b'%x\r\n%b\r\n' % (len(data), data))
+            await writer.drain()
+            if reader.at_eof():
+                # Nobody reads from an event stream, so EOF means the peer went away
+                break
+        else:
+            writer.write(b'0\r\n\r\n')
+    finally:
+        if fanout.clients.get(writer) is client:
+            fanout.remove(writer)
+        logger.info(f"Event stream disconnected. Total connections: {len(fanout)}")
+
+def flush_websocket(connection: ServerConnection, writer: asyncio.StreamWriter):
+    for data in connection.data_to_send():
+        if data:
+            writer.write(data)
+        elif writer.can_write_eof():
+            writer.write_eof()
+
+async def serve_websocket(request: HTTPRequest, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Handle WebSocket connections (/ or /ws for all devices, /ws/<device_id> for one)"""
+    # permessage-deflate is negotiated with every client that offers it
+    connection = ServerConnection(extensions=[ServerPerMessageDeflateFactory()],
+                                  subprotocols=[SUBPROTOCOL_BINARY])
+    connection.receive_data(request.head)
+    handshake = connection.events_received()[0]
+    response = connection.accept(handshake)
+    connection.send_response(response)
+    flush_websocket(connection, writer)
+    await writer.drain()
+    if response.status_code != 101:
+        return
     
-    def start_logging(self):
-        """Start CSV logging"""
-        global is_logging
-        
-        try:
-            if not is_logging:
-                setup_csv_logging()
-                is_logging = True
-            return {"status": "logging_started", "file": csv_file_path}
-        
-        except Exception as e:
-            logger.error(f"Error starting logging: {e}")
-            return {"status": "error", "message": str(e)}
+    path = request.path.strip('/')
+    device_id = path.split('/')[-1] if path not in ('', 'ws') else None
+    subprotocol = response.headers.get('Sec-WebSocket-Protocol')
+    encoding = ENCODING_BINARY if subprotocol == SUBPROTOCOL_BINARY else ENCODING_JSON
     
-    def stop_logging(self):
-        """Stop CSV logging"""
-        global is_logging
-        
-        try:
-            is_logging = False
-            close_csv_logging()
-            return {"status": "logging_stopped"}
-        
-        except Exception as e:
-            logger.error(f"Error stopping logging: {e}")
-            return {"status": "error", "message": str(e)}
+    async def send(frame):
+        if isinstance(frame, bytes):
+            connection.send_binary(frame)
+        else:
+            connection.send_text(frame.encode())
+        flush_websocket(connection, writer)
+        await writer.drain()
+    
+    async def close():
+        if connection.state is OPEN:
+            connection.send_close(1008, "too slow")
+            flush_websocket(connection, writer)
+        writer.close()
     
-    def get_status(self):
-        """Get current system status"""
-        return {
-            "serial_connected": serial_connection is not None and serial_connection.is_open,
-            "logging": is_logging,
-            "csv_file": csv_file_path if is_logging else None,
-            "websocket_connections": len(connected_websockets)
-        }
+    key = writer
+    fanout.add(key, send, device_id or None, close=close, encoding=encoding)
+    logger.info(f"WebSocket connected. Total connections: {len(fanout)}")
     
-    def do_OPTIONS(self):
-        """Handle preflight CORS requests"""
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
-
-def start_http_server():
-    """Start the HTTP server"""
-    PORT = 8888
-    with socketserver.TCPServer(("", PORT), DashboardHTTPHandler) as httpd:
-        logger.info(f"HTTP server serving at port {PORT}")
-        logger.info(f"Dashboard available at: http://localhost:{PORT}")
-        httpd.serve_forever()
-
-def start_websocket_server():
-    """Start the WebSocket server"""
-    return websockets.serve(websocket_handler, "localhost", 8889)
+    message: List[bytes] = []
+    try:
+        while connection.state is not CLOSED:
+            data = await reader.read(65536)
+            if data:
+                connection.receive_data(data)
+            else:
+                connection.receive_eof()
+            for frame in connection.events_received():
+                if frame.opcode is OP_TEXT or (frame.opcode is OP_CONT and message):
+                    message.append(frame.data)
+                    if frame.fin:
+                        # Subscription messages such as {"type": "subscribe", "rate": 10}
+                        fanout.handle_message(key, b''.join(message).decode('utf-8', 'replace'))
+                        message = []
+            flush_websocket(connection, writer)
+            await writer.drain()
+            if not data or connection.close_expected():
+                break
+    except Exception as e:
+        logger.error(f"WebSocket error: {e}")
+    finally:
+        fanout.remove(key)
+        logger.info(f"WebSocket disconnected. Total connections: {len(fanout)}")
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """One TCP connection: HTTP/1.1 requests (kept alive) until it closes or upgrades"""
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), HTTP_KEEPALIVE_TIMEOUT)
+                request = HTTPRequest(head)
+                length = int(request.headers.get('content-length') or 0)
+                if length:
+                    request.body = await reader.readexactly(length)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                return
+            except (asyncio.LimitOverrunError, ValueError):
+                await send_response(writer, 400, b'Bad request', 'text/plain', keep_alive=False)
+                return
+            
+            if request.is_websocket:
+                await serve_websocket(request, reader, writer)
+                return
+            if request.method == 'OPTIONS':
+                # Preflight CORS requests
+                await send_response(writer, 200, headers=CORS_HEADERS, keep_alive=request.keep_alive)
+            elif request.path == '/api/stream' and request.method == 'GET':
+                await serve_event_stream(request, reader, writer)
+                return
+            elif request.path.startswith('/api/'):
+                try:
+                    data = await handle_api(request)
+                except ValueError as e:
+                    # Unreadable JSON body, or not an object
+                    await send_api_response(writer, {"status": "error", "message": str(e)}, request.keep_alive, 400)
+                else:
+                    if data is None:
+                        await send_api_response(writer, {"status": "error", "message": "Not found"},
+                                                request.keep_alive, 404)
+                    else:
+                        await send_api_response(writer, data, request.keep_alive)
+            elif request.method in ('GET', 'HEAD'):
+                await serve_static(request, writer)
+            else:
+                await send_response(writer, 405, b'Method not allowed', 'text/plain', keep_alive=request.keep_alive)
+            if not request.keep_alive:
+                return
+    except ConnectionError:
+        pass
+    except Exception as e:
+        logger.error(f"Error handling HTTP request: {e}")
+    finally:
+        writer.close()
 
 async def main():
-    """Main function to start both servers"""
+    """Start the server (HTTP, API and WebSockets on one port)"""
     global dummy_data_task
     
-    # Start WebSocket server
-    websocket_server = await start_websocket_server()
-    logger.info("WebSocket server started on port 8889")
+    ingest_queue.start()
     
-    # Start HTTP server in a separate thread
-    http_thread = threading.Thread(target=start_http_server, daemon=True)
-    http_thread.start()
+    server = await asyncio.start_server(handle_connection, HOST, PORT)
+    logger.info(f"Server listening on port {PORT} (HTTP, API and WebSocket)")
+    logger.info(f"Dashboard available at: http://localhost:{PORT}")
     
     # Check if dummy data should be enabled
     if check_dummy_data_enabled():
@@ -418,6 +631,11 @@ async def main():
     else:
         logger.info("📡 Real sensor mode - connect via Bluetooth/Serial")
     
+    # Reopen last known good ports straight away (stops dummy data if one works)
+    if await reconnect_cached(port_cache, registry, port_list.get) and dummy_data_task:
+        logger.info("🔌 Real sensor connected - stopping dummy data")
+        dummy_data_task.cancel()
+    
     # Periodically check if dummy data file status changed
     async def check_dummy_status():
         global dummy_data_task
@@ -441,15 +659,16 @@ async def main():
     # Start the status checker
     asyncio.create_task(check_dummy_status())
     
-    # Keep the WebSocket server running
-    await websocket_server.wait_closed()
+    async with server:
+        await server.serve_forever()
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Shutting down servers...")
-        if serial_connection and serial_connection.is_open:
-            serial_connection.close()
+        for device in registry.devices.values():
+            if device.connection and device.connection.is_open:
+                device.connection.close()
         if is_logging:
             close_csv_logging()
@@ -0,0 +1,147 @@
+"""
+Benchmark for WebSocket frame encodings
+
+Encodes 10k samples of a 1 kHz stream the ways fanout.Fanout can send
+them - one JSON frame per sample, JSON batches, quantised delta batches and
+binary batches - and reports bytes per viewer on the wire, raw and with
+permessage-deflate, plus CPU per 10k samples to encode (server) and decode
+(client). Deflate is zlib with the settings websockets negotiates by
+default (12-bit window, memLevel 5, context kept between messages).
+Decoding is measured in Python: json.loads for JSON, memoryview casts over
+the frame for binary, which is what the browser's typed-array views amount
+to. Delta batches are checked to round-trip at display precision.
+
+Usage (from piezo-dashboard/):
+    python benchmarks/bench_encoding.py [samples] [batch_size]
+"""
+import os
+import sys
+import json
+import math
+import time
+import zlib
+import random
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from fanout import Columns, BINARY_HEADER, ENCODING_DELTA  # noqa: E402
+
+def make_samples(count):
+    """A noisy idle signal with a decaying spike every footstep (every 500 ms)"""
+    rng = random.Random(1)
+    start = datetime(2025, 1, 1, 12, 0, 0)
+    samples = []
+    energy = 0.0
+    for i in range(count):
+        voltage = abs(rng.gauss(0.05, 0.02)) + 3.0 * math.exp(-(i % 500) / 20.0)
+        power = voltage * voltage / 1000.0
+        energy += power / 3600.0
+        samples.append({
+            'voltage': round(voltage, 3),
+            'power': round(power, 6),
+            'energy': round(energy, 6),
+            'steps': i // 500,
+            'led': 'ON' if voltage > 1.0 else 'OFF',
+            'timestamp': (start + timedelta(milliseconds=i)).isoformat(),
+            'device': 'default'
+        })
+    return samples
+
+def batches(samples, size):
+    for i in range(0, len(samples), size):
+        columns = Columns()
+        for sample in samples[i:i + size]:
+            columns.append(sample)
+        yield columns
+
+def encode_json_samples(samples, size):
+    return [json.dumps(sample) for sample in samples]
+
+def encode_json_batches(samples, size):
+    return [json.dumps(columns.frame('default')) for columns in batches(samples, size)]
+
+def encode_delta_batches(samples, size):
+    return [columns.encode('default', ENCODING_DELTA) for columns in batches(samples, size)]
+
+def encode_binary_batches(samples, size):
+    return [columns.pack('default') for columns in batches(samples, size)]
+
+def decode_json(frames):
+    return [json.loads(frame) for frame in frames]
+
+def decode_delta(frames):
+    decoded = []
+    for frame in map(json.loads, frames):
+        for column, scale in frame["scale"].items():
+            total = 0
+            values = frame[column]
+            for i, delta in enumerate(values):
+                total += delta
+                values[i] = total / scale
+        decoded.append(frame)
+    return decoded
+
+def check_delta(samples, frames):
+    """Delta batches must give back every value at the precision app.js shows"""
+    decoded = [value for frame in decode_delta(frames) for value in zip(frame["v"], frame["p"], frame["e"])]
+    for sample, (v, p, e) in zip(samples, decoded):
+        assert f"{v:.3f}" == f"{sample['voltage']:.3f}", (v, sample['voltage'])
+        assert f"{p * 1000:.3f}" == f"{sample['power'] * 1000:.3f}", (p, sample['power'])
+        assert f"{e * 1000:.3f}" == f"{sample['energy'] * 1000:.3f}", (e, sample['energy'])
+
+def deflated_size(frames):
+    """Bytes after permessage-deflate with context takeover"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -12, 5)
+    total = 0
+    for frame in frames:
+        data = frame.encode() if isinstance(frame, str) else frame
+        total += len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return total
+
+def decode_binary(frames):
+    decoded = []
+    for frame in frames:
+        count = BINARY_HEADER.unpack_from(frame)[3]
+        offset = -(-(BINARY_HEADER.size + frame[BINARY_HEADER.size - 1]) // 4) * 4
+        view = memoryview(frame)
+        columns = []
+        for code in ('I', 'f', 'f', 'f', 'I'):
+            columns.append(view[offset:offset + count * 4].cast(code))
+            offset += count * 4
+        decoded.append(columns)
+    return decoded
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def main(count, size):
+    samples = make_samples(count)
+    per_10k = 10000 / count
+    encodings = (
+        ("JSON per sample", encode_json_samples, decode_json),
+        (f"JSON batch of {size}", encode_json_batches, decode_json),
+        (f"delta batch of {size}", encode_delta_batches, decode_delta),
+        (f"binary batch of {size}", encode_binary_batches, decode_binary),
+    )
+    print(f"{count} samples, per 10k samples (KiB per viewer, reduction vs JSON per sample without deflate):")
+    baseline = None
+    for name, encode, decode in encodings:
+        frames, encode_s = timed(encode, samples, size)
+        if decode is decode_delta:
+            check_delta(samples, frames)
+        _, decode_s = timed(decode, frames)
+        raw = sum(len(frame) for frame in frames) * per_10k
+        deflated = deflated_size(frames) * per_10k
+        baseline = baseline or raw
+        print(f"  {name:<22} {len(frames) * per_10k:6.0f} frames"
+              f"  raw {raw / 1024:7.1f} ({baseline / raw:4.1f}x)"
+              f"  deflate {deflated / 1024:7.1f} ({baseline / deflated:5.1f}x)"
+              f"  encode {encode_s * per_10k * 1000:6.2f} ms  decode {decode_s * per_10k * 1000:6.2f} ms")
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    main(count, size)
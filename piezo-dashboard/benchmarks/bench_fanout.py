@@ -0,0 +1,139 @@
+"""
+Benchmark for WebSocket fan-out
+
+Broadcasts samples to 10/100/1000 in-process fake clients and reports, per
+message, how long until every fast client has it: the old
+ConnectionManager.broadcast (json.dumps per client, one awaited send after
+another) against fanout.Fanout (serialize once, per-client queues and
+writers), and the same Fanout feeding Server-Sent Events streams (each fake
+response pulls FanoutClient.stream and writes every chunk it gets). Each
+fake send or chunk write yields to the loop once. Two scenarios: every
+client fast (pure CPU cost), and a share of clients with `slow_ms` of send
+latency, as viewers on bad Wi-Fi would have (at least one). For Fanout the
+number of samples folded into slow clients' coalesced frames is shown.
+
+Usage (from piezo-dashboard/):
+    python benchmarks/bench_fanout.py [messages] [slow_ms] [slow_percent]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from fanout import Fanout  # noqa: E402
+
+CLIENT_COUNTS = (10, 100, 1000)
+
+class Delivery:
+    """Counts fast-client sends so a run can wait until all of them got a message"""
+
+    def __init__(self):
+        self.expected = 0
+        self.received = 0
+        self.done = asyncio.Event()
+
+    def reset(self, expected):
+        self.expected = expected
+        self.received = 0
+        self.done.clear()
+
+    def record(self, count=1):
+        self.received += count
+        if self.received >= self.expected:
+            self.done.set()
+
+class FakeSocket:
+    def __init__(self, latency: float = 0.0, delivery: Delivery = None):
+        self.latency = latency
+        self.delivery = delivery
+        self.bytes = 0
+
+    async def send(self, text: str):
+        self.bytes += len(text)
+        await asyncio.sleep(self.latency)
+        if self.delivery is not None:
+            self.delivery.record()
+
+async def consume_stream(client, latency, delivery):
+    """A streaming response writing each chunk of SSE events to a fake peer"""
+    async for chunk in client.stream():
+        await asyncio.sleep(latency)
+        if delivery is not None:
+            delivery.record(chunk.count('\n\n'))
+
+def make_sample(i):
+    return {
+        'voltage': round((i % 1000) * 0.0163, 3),
+        'power': 0.00312,
+        'energy': 0.1234,
+        'steps': i,
+        'led': 'OFF',
+        'timestamp': '2025-01-01T12:00:00.000000',
+        'device': 'default'
+    }
+
+async def legacy_broadcast(sockets, message):
+    """ConnectionManager.broadcast before the shared fan-out"""
+    for websocket in sockets:
+        await websocket.send(json.dumps(message))
+
+def make_sockets(count, slow, slow_share, delivery):
+    slow_count = max(1, int(count * slow_share)) if slow_share else 0
+    fast_count = count - slow_count
+    return [FakeSocket(slow) for _ in range(slow_count)] + [FakeSocket(0.0, delivery) for _ in range(fast_count)]
+
+async def run(broadcast, delivery, fast_count, messages):
+    latencies = []
+    for i in range(messages):
+        delivery.reset(fast_count)
+        start = time.perf_counter()
+        await broadcast(make_sample(i))
+        await delivery.done.wait()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def report(name, latencies):
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"  {name:<24} mean {statistics.mean(latencies):8.2f} ms   p99 {p99:8.2f} ms")
+    return statistics.mean(latencies)
+
+async def main(messages, slow, slow_share):
+    scenarios = (("all clients fast", 0.0), (f"{slow_share * 100:g}% clients {slow * 1000:g} ms slow", slow_share))
+    for count in CLIENT_COUNTS:
+        for label, share in scenarios:
+            print(f"{count} clients, {label} ({messages} messages)")
+            delivery = Delivery()
+            sockets = make_sockets(count, slow, share, delivery)
+            fast_count = sum(1 for websocket in sockets if websocket.delivery is not None)
+            before = report("legacy sequential",
+                            await run(lambda m: legacy_broadcast(sockets, m), delivery, fast_count, messages))
+
+            fanout = Fanout(send_timeout=1.0)
+            for i, websocket in enumerate(make_sockets(count, slow, share, delivery)):
+                fanout.add(i, websocket.send)
+            after = report("Fanout (client queues)", await run(fanout.broadcast, delivery, fast_count, messages))
+            print(f"  speedup {before / after:.1f}x   coalesced {fanout.stats()['coalesced']} samples")
+            for key in list(fanout.clients):
+                fanout.remove(key)
+
+            fanout = Fanout(send_timeout=1.0)
+            readers = []
+            for i, websocket in enumerate(make_sockets(count, slow, share, delivery)):
+                client = fanout.add_stream(i)
+                readers.append(asyncio.ensure_future(consume_stream(client, websocket.latency, websocket.delivery)))
+            after = report("Fanout SSE (chunked)", await run(fanout.broadcast, delivery, fast_count, messages))
+            print(f"  speedup {before / after:.1f}x   coalesced {fanout.stats()['coalesced']} samples")
+            for key in list(fanout.clients):
+                fanout.remove(key)
+            await asyncio.gather(*readers)
+
+if __name__ == "__main__":
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    slow = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.005
+    slow_share = float(sys.argv[3]) / 100 if len(sys.argv) > 3 else 0.05
+    asyncio.run(main(messages, slow, slow_share))
@@ -0,0 +1,71 @@
+"""
+Benchmark for serial framing on a backlog burst
+
+Replays a backlog of Pico lines (10 MB by default), as it arrives after a
+Bluetooth hiccup, through the old str buffer + split('\n', 1) loop and
+through serial_ingest.LineFramer.
+
+Usage (from piezo-dashboard/):
+    python benchmarks/bench_framing.py [megabytes] [chunk_kb]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from serial_ingest import LineFramer  # noqa: E402
+
+def make_backlog(size):
+    """Build roughly `size` bytes of voltage.py output"""
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        v = (i % 1000) * 0.0163
+        line = "V: {:.3f}V | P: {:.2f}mW | E_inst: {:.3f}mJ | E_total: {:.3f}mWh\n".format(
+            v, v * v / 0.33, v * v / 0.66, i * 0.001).encode()
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return b"".join(lines), i
+
+def legacy_frames(chunks):
+    """Old read_serial_data framing: decode every chunk, then split one line at a time"""
+    buffer = ""
+    count = 0
+    for chunk in chunks:
+        buffer += chunk.decode('utf-8', errors='ignore')
+        while '\n' in buffer:
+            line, buffer = buffer.split('\n', 1)
+            if line.strip():
+                count += 1
+    return count
+
+def framer_frames(chunks):
+    framer = LineFramer()
+    count = 0
+    for chunk in chunks:
+        count += len(framer.feed(chunk))
+    return count
+
+def bench(name, func, chunks, size):
+    start = time.perf_counter()
+    frames = func(chunks)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {elapsed * 1000:9.1f} ms  {size / elapsed / 1e6:8.1f} MB/s  {frames:,} frames")
+    return elapsed
+
+if __name__ == "__main__":
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    chunk_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    backlog, lines = make_backlog(int(megabytes * 1024 * 1024))
+    step = chunk_kb * 1024
+    chunks = [backlog[i:i + step] for i in range(0, len(backlog), step)]
+
+    print(f"Replaying {len(backlog) / 1e6:.1f} MB backlog ({lines:,} lines) in {chunk_kb} KB reads")
+    print("-" * 72)
+    before = bench("legacy str split", legacy_frames, chunks, len(backlog))
+    after = bench("LineFramer (bytearray)", framer_frames, chunks, len(backlog))
+    print("-" * 72)
+    print(f"speedup: {before / after:.1f}x")
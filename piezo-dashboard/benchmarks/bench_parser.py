@@ -0,0 +1,86 @@
+"""
+Micro-benchmark for the Pico line parser
+
+Compares the old four-regex parse_sensor_data against the compiled
+single-pass parser, the parse_lines batch API and binary frame decoding.
+
+Usage (from piezo-dashboard/):
+    python benchmarks/bench_parser.py [lines]
+"""
+import os
+import re
+import sys
+import time
+import struct
+import binascii
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from sensor_parser import parse_sensor_data, parse_lines, BinaryFrameDecoder  # noqa: E402
+
+def legacy_parse_sensor_data(raw_data):
+    """Pico branch of parse_sensor_data before the compiled parser"""
+    raw_data = raw_data.strip()
+    if '|' in raw_data:
+        voltage_match = re.search(r'V:\s*([\d.]+)V', raw_data)
+        power_match = re.search(r'P:\s*([\d.]+)mW', raw_data)
+        energy_inst_match = re.search(r'E_inst:\s*([\d.]+)mJ', raw_data)
+        energy_total_match = re.search(r'E_total:\s*([\d.]+)mWh', raw_data)
+
+        if voltage_match and power_match:
+            return {
+                'voltage': float(voltage_match.group(1)),
+                'power': float(power_match.group(1)) / 1000.0,
+                'energy': float(energy_total_match.group(1)) if energy_total_match else 0.0,
+                'steps': 0,
+                'led': 'OFF',
+                'timestamp': datetime.now().isoformat()
+            }
+    return None
+
+def make_lines(count):
+    """Build realistic voltage.py output lines"""
+    lines = []
+    total = 0.0
+    for i in range(count):
+        v = (i % 1000) * 0.0163
+        p = v * v / 330.0 * 1000
+        total += p * 0.5 / 3600.0
+        lines.append("V: {:.3f}V | P: {:.2f}mW | E_inst: {:.3f}mJ | E_total: {:.3f}mWh".format(
+            v, p, p * 0.5, total))
+    return lines
+
+def make_frames(count):
+    """Build the same readings as voltage.py binary frames"""
+    frames = []
+    for i in range(count):
+        head = struct.pack('<BHIH', 0xA5, i & 0xFFFF, i * 2, 600 + (i % 1000) * 64)
+        frames.append(head + struct.pack('<H', binascii.crc_hqx(head, 0xFFFF)))
+    return b"".join(frames)
+
+def bench(name, func, data, count):
+    start = time.perf_counter()
+    func(data)
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed
+    print(f"{name:<32} {elapsed * 1000:9.1f} ms  {rate:12,.0f} lines/s")
+    return rate
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    lines = make_lines(count)
+
+    print(f"Parsing {count:,} Pico lines")
+    print("-" * 64)
+    before = bench("legacy (4x re.search)", lambda ls: [legacy_parse_sensor_data(l) for l in ls], lines, count)
+    after = bench("parse_sensor_data (compiled)", lambda ls: [parse_sensor_data(l) for l in ls], lines, count)
+    batch = bench("parse_lines (columns)", parse_lines, lines, count)
+    frames = make_frames(count)
+    binary = bench("BinaryFrameDecoder", lambda data: BinaryFrameDecoder().feed(data), frames, count)
+    print("-" * 64)
+    print(f"per-line speedup: {after / before:.2f}x   batch speedup: {batch / before:.2f}x   "
+          f"binary speedup: {binary / before:.2f}x")
+    text_bytes = sum(len(line) + 1 for line in lines)
+    print(f"bytes on the link: text {text_bytes / count:.1f}/sample, binary {len(frames) / count:.1f}/sample "
+          f"({text_bytes / len(frames):.1f}x fewer)")
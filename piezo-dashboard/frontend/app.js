@@ -14,6 +14,11 @@ class PiezoelectricDashboard {
         };
         this.maxDataPoints = 600; // 60 seconds at 10Hz for smooth graphs
         this.maxSparklinePoints = 50; // More points for smoother sparklines
+        this.updateRate = 10; // Hz requested from the server ('full' for every sample)
+        this.batchFrames = { ms: 250, max: 100 }; // Column-oriented batches (null: one frame per sample)
+        // Batch encoding: 'binary' (typed arrays, least CPU), 'delta' (quantised deltas,
+        // fewest bytes over a slow link) or 'json' (readable, for debugging)
+        this.frameEncoding = 'binary';
         this.totalEnergy = 0;
         this.lastUpdate = Date.now();
         this.updateQueue = []; // Queue for smooth animations
@@ -289,21 +294,38 @@ class PiezoelectricDashboard {
 
     connectWebSocket() {
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const wsUrl = `${protocol}//${window.location.hostname}:8889`;
+        const wsUrl = `${protocol}//${window.location.host}/ws`;
         
         console.log('🔌 Attempting to connect WebSocket to:', wsUrl);
         
-        this.websocket = new WebSocket(wsUrl);
+        this.websocket = this.frameEncoding === 'binary' ?
+            new WebSocket(wsUrl, ['piezo.binary.v1']) : new WebSocket(wsUrl);
+        this.websocket.binaryType = 'arraybuffer';
         
         this.websocket.onopen = () => {
             console.log('✅ WebSocket connected successfully!');
+            // The server decimates to this rate, keeping min/max in data.summary
+            this.websocket.send(JSON.stringify({
+                type: 'subscribe',
+                rate: this.updateRate,
+                batch: this.batchFrames || false,
+                encoding: this.frameEncoding === 'delta' ? 'delta' : undefined
+            }));
         };
         
         this.websocket.onmessage = (event) => {
-            const data = JSON.parse(event.data);
-            console.log('📊 Received data:', data);
-            this.updateMetrics(data);
-            this.updateGraph(data);
+            const data = event.data instanceof ArrayBuffer ?
+                this.decodeBinaryFrame(event.data) : JSON.parse(event.data);
+            if (data.type === 'batch') {
+                this.handleBatch(data.encoding === 'delta' ? this.decodeDeltaFrame(data) : data);
+            } else if (data.type === 'snapshot') {
+                // Recent history sent on (re)connect: replace the chart contents
+                this.resetSeries();
+                this.handleBatch(data, false);
+            } else {
+                this.updateMetrics(data);
+                this.updateGraph(data);
+            }
             this.updateLastUpdate();
         };
         
@@ -318,13 +340,113 @@ class PiezoelectricDashboard {
         };
     }
 
+    decodeBinaryFrame(buffer) {
+        // Layout: backend/fanout.py BINARY_HEADER. Columns are 4-byte aligned,
+        // so the typed arrays are views on the received buffer, not copies
+        const view = new DataView(buffer);
+        const flags = view.getUint8(3);
+        const count = view.getUint32(4, true);
+        const t0 = view.getFloat64(8, true);
+        const led = view.getUint8(16);
+        const nameLength = view.getUint8(17);
+        const device = new TextDecoder().decode(new Uint8Array(buffer, 18, nameLength));
+
+        let offset = Math.ceil((18 + nameLength) / 4) * 4;
+        const column = (Type) => {
+            const values = new Type(buffer, offset, count);
+            offset += count * 4;
+            return values;
+        };
+        const type = flags & 0x40 ? 'snapshot' : 'batch';
+        const frame = { type, device, t0, led: led === 1 ? 'ON' : 'OFF' };
+        frame.dt = column(Uint32Array);
+        // Flags 0x04-0x20 mark columns left out by a field-selective subscription
+        const layout = [['v', Float32Array, 0x04], ['p', Float32Array, 0x08],
+                        ['e', Float32Array, 0x10], ['s', Uint32Array, 0x20]];
+        for (const [name, Type, omitted] of layout) {
+            if (!(flags & omitted)) {
+                frame[name] = column(Type);
+            }
+        }
+        if (flags & 0x01) {
+            frame.vmin = column(Float32Array);
+            frame.vmax = column(Float32Array);
+        }
+        if (flags & 0x80) {
+            frame.esum = column(Float32Array);
+        }
+        return frame;
+    }
+
+    decodeDeltaFrame(frame) {
+        // Columns are integer differences from the previous sample; running
+        // sums divided by frame.scale give the values back
+        const undelta = (deltas, scale) => {
+            const values = new Float64Array(deltas.length);
+            let total = 0;
+            for (let i = 0; i < deltas.length; i++) {
+                total += deltas[i];
+                values[i] = total / scale;
+            }
+            return values;
+        };
+        frame.dt = undelta(frame.dt, 1);
+        frame.s = undelta(frame.s, 1);
+        for (const [column, scale] of Object.entries(frame.scale)) {
+            frame[column] = undelta(frame[column], scale);
+        }
+        return frame;
+    }
+
+    resetSeries() {
+        this.chart.data.labels = [];
+        this.chart.data.datasets[0].data = [];
+        for (const type of Object.keys(this.sparklineData)) {
+            this.sparklineData[type] = [];
+        }
+    }
+
+    handleBatch(frame, countEnergy = true) {
+        // Columns: dt (ms after t0), v, p, e, s; vmin/vmax/esum when decimated
+        const count = frame.v.length;
+        if (!count) return;
+        const peaks = frame.vmax || frame.v;
+        // Decimated entries stand for several samples; esum is their total energy
+        const energies = frame.esum || frame.e;
+
+        for (let i = 0; i < count; i++) {
+            const energyMJ = frame.e[i] * 1000;
+            if (countEnergy) {
+                this.totalEnergy += energies[i] * 1000;
+            }
+            this.pushGraphPoint(frame.t0 + frame.dt[i], peaks[i]);
+            this.pushSparklinePoint('voltage', frame.v[i]);
+            this.pushSparklinePoint('energy', energyMJ);
+            this.pushSparklinePoint('steps', frame.s[i]);
+            this.pushSparklinePoint('power', frame.p[i] * 1000);
+        }
+        this.chart.update('none');
+        for (const type of Object.keys(this.sparklines)) {
+            this.renderSparkline(type);
+        }
+
+        const last = count - 1;
+        this.updateMetricValue('totalEnergyValue', this.totalEnergy, '0.00');
+        this.updateMetricValue('voltageValue', frame.v[last], '0.000');
+        this.updateMetricValue('energyValue', frame.e[last] * 1000, '0.000');
+        this.updateMetricValue('stepsValue', frame.s[last], '0');
+        this.updateMetricValue('powerValue', frame.p[last] * 1000, '0.000');
+        this.updateLed(frame.led);
+    }
+
     updateMetrics(data) {
         // Convert to millijoules and milliwatts for display
         const energyMJ = data.energy * 1000; // J to mJ
         const powerMW = data.power * 1000; // W to mW
         
-        // Update total energy
-        this.totalEnergy += energyMJ;
+        // Update total energy (a decimated frame stands for summary.count samples)
+        const summary = data.summary;
+        this.totalEnergy += summary && summary.energy_sum != null ? summary.energy_sum * 1000 : energyMJ;
         this.updateMetricValue('totalEnergyValue', this.totalEnergy, '0.00');
         
         // Update metric values instantly - no animation delay
@@ -339,12 +461,15 @@ class PiezoelectricDashboard {
         this.updateSparkline('steps', data.steps);
         this.updateSparkline('power', powerMW);
         
-        // Update LED status
+        this.updateLed(data.led);
+    }
+
+    updateLed(led) {
         const ledIndicator = document.getElementById('ledIndicator');
         const ledStatus = document.getElementById('ledStatus');
         
         if (ledIndicator && ledStatus) {
-            if (data.led === 'ON') {
+            if (led === 'ON') {
                 ledIndicator.classList.add('on');
                 ledStatus.textContent = 'ON';
                 ledStatus.style.color = '#48bb78';
@@ -358,7 +483,11 @@ class PiezoelectricDashboard {
 
     updateSparkline(type, value) {
         if (!this.sparklines[type]) return;
-        
+        this.pushSparklinePoint(type, value);
+        this.renderSparkline(type);
+    }
+
+    pushSparklinePoint(type, value) {
         // Add new data point
         this.sparklineData[type].push(value);
         
@@ -366,7 +495,9 @@ class PiezoelectricDashboard {
         if (this.sparklineData[type].length > this.maxSparklinePoints) {
             this.sparklineData[type].shift();
         }
-        
+    }
+
+    renderSparkline(type) {
         // Update the sparkline chart instantly
         const chart = this.sparklines[type];
         chart.data.labels = Array(this.sparklineData[type].length).fill('');
@@ -412,8 +543,17 @@ class PiezoelectricDashboard {
     }
 
     updateGraph(data) {
-        const now = Date.now();
-        const timeLabel = new Date(now).toLocaleTimeString('en-US', { 
+        // For decimated frames plot the peak so spikes stay visible
+        const voltage = data.summary && data.summary.voltage_max !== undefined ?
+            data.summary.voltage_max : data.voltage;
+        this.pushGraphPoint(Date.now(), voltage);
+
+        // Instant update with no animation
+        this.chart.update('none');
+    }
+
+    pushGraphPoint(time, voltage) {
+        const timeLabel = new Date(time).toLocaleTimeString('en-US', { 
             hour12: false, 
             minute: '2-digit', 
             second: '2-digit' 
@@ -421,16 +561,13 @@ class PiezoelectricDashboard {
         
         // Add new data point
         this.chart.data.labels.push(timeLabel);
-        this.chart.data.datasets[0].data.push(data.voltage);
+        this.chart.data.datasets[0].data.push(voltage);
 
         // Keep only the last maxDataPoints for smooth scrolling
         if (this.chart.data.labels.length > this.maxDataPoints) {
             this.chart.data.labels.shift();
             this.chart.data.datasets[0].data.shift();
         }
-
-        // Instant update with no animation
-        this.chart.update('none');
     }
 
     clearGraph() {
@@ -0,0 +1,5 @@
+"""Backend modules import each other by name, as when run from backend/"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
@@ -0,0 +1,35 @@
+"""ClockAligner: device ticks to host time"""
+import pytest
+
+from clock_sync import ClockAligner, TICKS_PERIOD
+
+class TestClockAligner:
+    def test_unwrap_across_wrap(self):
+        aligner = ClockAligner()
+        assert aligner.unwrap(TICKS_PERIOD - 10) == pytest.approx((TICKS_PERIOD - 10) / 1000)
+        assert aligner.unwrap(20) == pytest.approx((TICKS_PERIOD + 20) / 1000)
+
+    def test_late_frame_does_not_wrap(self):
+        aligner = ClockAligner()
+        aligner.unwrap(5000)
+        assert aligner.unwrap(4990) == pytest.approx(4.99)
+        assert aligner.unwrap(5010) == pytest.approx(5.01)
+        assert aligner.resets == 0
+
+    def test_reboot_resets(self):
+        aligner = ClockAligner()
+        aligner.unwrap(60000)
+        aligner.unwrap(100)
+        assert aligner.resets == 1
+
+    def test_fits_offset_and_drift_under_jitter(self):
+        aligner = ClockAligner(bucket_s=1.0)
+        offset, drift = 1.7e9, 50e-6
+        for i in range(3000):
+            ticks = i * 10
+            jitter = 0.1 * ((i * 7919) % 13) / 13  # Always-positive delay, 0 on some samples per bucket
+            aligner.align(ticks, offset + ticks / 1000 * (1 + drift) + jitter)
+        assert aligner.offset == pytest.approx(offset, abs=1e-3)
+        assert aligner.drift == pytest.approx(drift, abs=2e-6)
+        corrected = aligner.align(30000, offset + 30 * (1 + drift) + 0.08)
+        assert corrected == pytest.approx(offset + 30 * (1 + drift), abs=2e-3)
@@ -0,0 +1,162 @@
+"""DeviceRegistry and SerialDevice against pseudo-terminals standing in for serial ports"""
+import asyncio
+import os
+import time
+
+import pytest
+
+from device_registry import DeviceRegistry, backoff_delay
+from sensor_parser import MODE_BINARY_COMMAND
+from serial_ingest import READER_FD, READER_THREAD, READER_POLL
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs pseudo-terminals")
+
+@pytest.fixture
+def ptys():
+    """Factory for (master fd, port path) pairs; the device side opens the path"""
+    opened = []
+
+    def make():
+        master, slave = os.openpty()
+        opened.extend((master, slave))
+        return master, os.ttyname(slave)
+
+    yield make
+    for fd in opened:
+        os.close(fd)
+
+async def ignore_chunk(device, chunk):
+    pass
+
+def test_concurrent_adds_with_one_id_keep_one_device(ptys):
+    async def main():
+        registry = DeviceRegistry(ignore_chunk, stall_timeout=None, reconnect=False)
+        (_, first), (_, second) = ptys(), ptys()
+        results = await asyncio.gather(registry.add("tile1", first), registry.add("tile1", second))
+        current = registry.get("tile1")
+        states = [(device is current, device.is_connected, device.task is not None) for device in results]
+        await registry.close_all()
+        return states, current.port, second
+
+    states, port, second = asyncio.run(main())
+    assert port == second
+    # The first device was replaced by the second, so it was stopped rather than leaked
+    assert states == [(False, False, False), (True, True, True)]
+
+def test_concurrent_adds_of_one_port_open_it_once(ptys):
+    async def main():
+        registry = DeviceRegistry(ignore_chunk, stall_timeout=None, reconnect=False)
+        _, port = ptys()
+        results = await asyncio.gather(registry.add("tile1", port), registry.add("tile2", port),
+                                       return_exceptions=True)
+        ids = registry.ids()
+        await registry.close_all()
+        return results, ids
+
+    results, ids = asyncio.run(main())
+    assert ids == ["tile1"]
+    assert isinstance(results[1], ValueError)
+
+def test_binary_mode_command_is_written_to_the_port(ptys):
+    async def main():
+        registry = DeviceRegistry(ignore_chunk, stall_timeout=None, reconnect=False, prefer_binary=True)
+        master, port = ptys()
+        await registry.add("tile1", port)
+        for _ in range(50):
+            await asyncio.sleep(0.01)
+            if registry.get("tile1").reader is not None:
+                break
+        await asyncio.sleep(0.05)
+        written = os.read(master, 64)
+        await registry.close_all()
+        return written
+
+    assert asyncio.run(main()) == MODE_BINARY_COMMAND
+
+def test_stuck_close_does_not_block_the_loop(ptys):
+    async def main():
+        registry = DeviceRegistry(ignore_chunk, stall_timeout=None, reconnect=False, open_timeout=0.1)
+        _, port = ptys()
+        device = await registry.add("tile1", port)
+        close = device.connection.close
+        device.connection.close = lambda: (time.sleep(0.5), close())
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        start = time.monotonic()
+        await registry.remove("tile1")
+        elapsed = time.monotonic() - start
+        ticker.cancel()
+        await asyncio.sleep(0.5)
+        return elapsed, ticks
+
+    elapsed, ticks = asyncio.run(main())
+    assert elapsed < 0.4
+    assert ticks >= 5
+
+def test_backoff_delay_grows_with_jitter_and_a_cap():
+    for attempt in range(12):
+        delay = min(30.0, 0.5 * 2 ** attempt)
+        for _ in range(20):
+            assert delay / 2 <= backoff_delay(attempt, 0.5, 30.0) <= delay
+
+@pytest.mark.parametrize("mode", [READER_FD, READER_THREAD, READER_POLL])
+def test_stalled_link_is_reopened(ptys, mode):
+    async def main():
+        chunks = []
+
+        async def on_chunk(device, chunk):
+            chunks.append(chunk)
+
+        registry = DeviceRegistry(on_chunk, reader_mode=mode, poll_interval=0.01, stall_timeout=0.2,
+                                  backoff_initial=0.02, backoff_max=0.05)
+        master, port = ptys()
+        device = await registry.add("tile1", port)
+        await asyncio.sleep(0.05)
+        os.write(master, b"V: 1.000V | P: 1.00mW\n")
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if device.health.reconnects:
+                break
+        # Still reading after the reopen
+        os.write(master, b"V: 2.000V | P: 1.00mW\n")
+        await asyncio.sleep(0.2)
+        health = device.health.as_dict()
+        connected = device.is_connected
+        await registry.close_all()
+        return health, connected, b"".join(chunks)
+
+    health, connected, data = asyncio.run(main())
+    assert health["stalls"] >= 1
+    assert health["reconnects"] >= 1
+    assert health["last_error"] == "no data for 0.2s"
+    assert connected
+    assert b"V: 2.000V" in data
+
+def test_vanished_port_is_retried_with_backoff():
+    async def main():
+        master, slave = os.openpty()
+        port = os.ttyname(slave)
+        registry = DeviceRegistry(ignore_chunk, reader_mode=READER_THREAD, stall_timeout=None,
+                                  backoff_initial=0.02, backoff_max=0.08)
+        device = await registry.add("tile1", port)
+        os.close(master)
+        os.close(slave)
+        for _ in range(150):
+            await asyncio.sleep(0.02)
+            if device.health.failed_attempts >= 3:
+                break
+        health = device.health.as_dict()
+        await registry.close_all()
+        return health
+
+    health = asyncio.run(main())
+    assert health["failed_attempts"] >= 3
+    assert health["reconnects"] == 0
+    assert health["down_for_s"] > 0
@@ -0,0 +1,299 @@
+"""Fanout: serialize-once delivery and the batch frame encodings"""
+import asyncio
+import json
+import math
+from array import array
+
+import pytest
+
+from history import History
+from fanout import (Fanout, Columns, BINARY_HEADER, BINARY_MAGIC, BINARY_VERSION, FLAG_RANGE, FLAG_SNAPSHOT,
+                    FLAG_ENERGY_SUM, FLAG_NO_COLUMN, LED_STATES, ENCODING_BINARY, ENCODING_DELTA,
+                    DELTA_SCALE, DELTA_BATCH_SAMPLES, BATCH_MS, BATCH_MAX, Subscription)
+
+def sample(i: int, voltage: float = None, **extra):
+    message = {
+        "voltage": 1.0 + i * 0.001 if voltage is None else voltage,
+        "power": 0.002 + i * 1e-6,
+        "energy": 0.0001 * i,
+        "steps": i,
+        "led": "ON",
+        "timestamp": f"2026-01-01T00:00:{i // 1000:02d}.{i % 1000:03d}000",
+    }
+    message.update(extra)
+    return message
+
+def batch(count: int, kind: str = "batch") -> Columns:
+    columns = Columns(kind)
+    for i in range(count):
+        columns.append(sample(i))
+    return columns
+
+def unpack(data: bytes):
+    """Decode a binary batch frame the way the dashboard does (little-endian)"""
+    magic, version, flags, count, t0, led, name_len = BINARY_HEADER.unpack_from(data)
+    assert (magic, version) == (BINARY_MAGIC, BINARY_VERSION)
+    offset = BINARY_HEADER.size
+    frame = {"flags": flags, "t0": t0, "led": led, "device": data[offset:offset + name_len].decode()}
+    offset += name_len
+    offset += -offset % 4
+
+    def column(typecode):
+        nonlocal offset
+        values = array(typecode)
+        values.frombytes(data[offset:offset + 4 * count])
+        offset += 4 * count
+        return list(values)
+
+    frame["dt"] = column("I")
+    for name, typecode in (("v", "f"), ("p", "f"), ("e", "f"), ("s", "I")):
+        if not flags & FLAG_NO_COLUMN[name]:
+            frame[name] = column(typecode)
+    if flags & FLAG_RANGE:
+        frame["vmin"] = column("f")
+        frame["vmax"] = column("f")
+    if flags & FLAG_ENERGY_SUM:
+        frame["esum"] = column("f")
+    assert offset == len(data)
+    return frame
+
+def undelta(values, scale=1):
+    """Running sum of a delta column, divided back by its scale"""
+    total = 0
+    restored = []
+    for value in values:
+        total += value
+        restored.append(total / scale)
+    return restored
+
+async def drain():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_publish_serializes_once_for_every_client():
+    async def main():
+        fanout = Fanout()
+        inboxes = {"a": [], "b": []}
+        for key, inbox in inboxes.items():
+            async def send(frame, inbox=inbox):
+                inbox.append(frame)
+            fanout.add(key, send)
+        fanout.publish(sample(1), "tile1")
+        await drain()
+        for key in list(inboxes):
+            fanout.remove(key)
+        return inboxes
+
+    inboxes = asyncio.run(main())
+    assert len(inboxes["a"]) == len(inboxes["b"]) == 1
+    assert inboxes["a"][0] is inboxes["b"][0]
+    assert json.loads(inboxes["a"][0]) == sample(1)
+
+def test_slow_client_does_not_hold_up_others():
+    async def main():
+        fanout = Fanout(max_queue=2)
+        fast, slow = [], []
+        stalled = asyncio.Event()
+
+        async def send_fast(frame):
+            fast.append(frame)
+
+        async def send_slow(frame):
+            slow.append(frame)
+            await stalled.wait()
+
+        fanout.add("fast", send_fast)
+        fanout.add("slow", send_slow)
+        for i in range(10):
+            fanout.publish(sample(i, voltage=5.0 if i == 6 else 1.0), "tile1")
+            await drain()
+        stalled.set()
+        await drain()
+        for key in ("fast", "slow"):
+            fanout.remove(key)
+        return fast, slow
+
+    fast, slow = asyncio.run(main())
+    assert len(fast) == 10
+    # First frame in flight, two queued, the remaining seven coalesced into one
+    assert len(slow) == 4
+    merged = json.loads(slow[-1])
+    assert merged["steps"] == 9
+    assert merged["summary"]["count"] == 7
+    assert merged["summary"]["voltage_max"] == 5.0
+
+def test_json_batch_frame():
+    columns = batch(3)
+    frame = json.loads(columns.encode("tile1", "json"))
+    assert frame["type"] == "batch"
+    assert frame["device"] == "tile1"
+    assert frame["dt"] == [0, 1, 2]
+    assert frame["v"] == [1.0, 1.001, 1.002]
+    assert frame["s"] == [0, 1, 2]
+    assert frame["led"] == "ON"
+    assert "vmax" not in frame and "esum" not in frame
+
+def test_batch_frame_fields_projection():
+    frame = json.loads(batch(2).encode("tile1", "json", ("voltage",)))
+    assert frame["v"] == [1.0, 1.001]
+    assert frame["dt"] == [0, 1]
+    assert "t0" in frame
+    assert not {"p", "e", "s"} & set(frame)
+
+def test_binary_round_trip():
+    columns = batch(4)
+    frame = unpack(columns.encode("tile1", ENCODING_BINARY))
+    assert frame["flags"] == 0
+    assert frame["device"] == "tile1"
+    assert frame["t0"] == columns.t0 * 1000
+    assert frame["led"] == LED_STATES["ON"]
+    assert frame["dt"] == columns.dt
+    assert frame["s"] == columns.s
+    for name in ("v", "p", "e"):
+        assert frame[name] == pytest.approx(getattr(columns, name), rel=1e-6)
+
+def test_binary_range_energy_sum_and_missing_values():
+    columns = Columns("snapshot")
+    columns.append(sample(0))
+    columns.append(sample(1, voltage=0.5, summary={"count": 3, "voltage_min": 0.2, "voltage_max": 4.0,
+                                                     "energy_sum": 0.25}))
+    columns.append({"timestamp": sample(2)["timestamp"], "voltage": 1.5})
+    frame = unpack(columns.pack("tile1"))
+    assert frame["flags"] == FLAG_RANGE | FLAG_ENERGY_SUM | FLAG_SNAPSHOT
+    assert frame["vmin"] == pytest.approx([1.0, 0.2, 1.5])
+    assert frame["vmax"] == pytest.approx([1.0, 4.0, 1.5])
+    assert frame["esum"][:2] == pytest.approx([0.0, 0.25])
+    assert math.isnan(frame["esum"][2]) and math.isnan(frame["p"][2])
+    assert frame["s"][2] == 0
+
+def test_binary_fields_projection():
+    frame = unpack(batch(2).pack("tile1", ("voltage",)))
+    assert frame["flags"] == FLAG_NO_COLUMN["p"] | FLAG_NO_COLUMN["e"] | FLAG_NO_COLUMN["s"]
+    assert frame["v"] == pytest.approx([1.0, 1.001])
+    assert frame["dt"] == [0, 1]
+    assert not {"p", "e", "s"} & set(frame)
+
+def test_binary_client_gets_a_batch_of_one_per_sample():
+    async def main():
+        fanout = Fanout()
+        frames = []
+
+        async def send(frame):
+            frames.append(frame)
+
+        fanout.add("viewer", send, encoding=ENCODING_BINARY)
+        fanout.publish(sample(5), "tile1")
+        await drain()
+        fanout.remove("viewer")
+        return frames
+
+    frame, = asyncio.run(main())
+    assert isinstance(frame, bytes)
+    decoded = unpack(frame)
+    assert decoded["device"] == "tile1"
+    assert decoded["dt"] == [0]
+    assert decoded["v"] == pytest.approx([1.005])
+
+def test_delta_round_trip():
+    columns = Columns()
+    columns.append(sample(0))
+    columns.append(sample(7, summary={"count": 2, "voltage_min": 0.9, "voltage_max": 1.2, "energy_sum": 0.0014}))
+    columns.append(sample(9))
+    frame = json.loads(columns.encode("tile1", ENCODING_DELTA))
+    assert frame["encoding"] == ENCODING_DELTA
+    assert frame["scale"] == {column: DELTA_SCALE[column] for column in ("v", "p", "e", "vmin", "vmax", "esum")}
+    assert all(isinstance(x, int) for x in frame["v"])
+    assert undelta(frame["dt"]) == columns.dt
+    assert undelta(frame["s"]) == columns.s
+    for column, scale in frame["scale"].items():
+        assert undelta(frame[column], scale) == pytest.approx(getattr(columns, column), abs=0.5 / scale)
+
+def test_delta_subscription_is_always_batched():
+    subscription = Subscription.from_message({"type": "subscribe", "encoding": ENCODING_DELTA})
+    assert subscription.batched
+    assert (subscription.batch_ms, subscription.batch_max) == (BATCH_MS, BATCH_MAX)
+    slow = Subscription.from_message({"type": "subscribe", "encoding": ENCODING_DELTA, "rate": 2})
+    assert (slow.batch_ms, slow.batch_max) == (DELTA_BATCH_SAMPLES * 500, BATCH_MAX)
+    explicit = Subscription.from_message({"encoding": ENCODING_DELTA, "batch": {"ms": 50, "max": 3}})
+    assert (explicit.batch_ms, explicit.batch_max) == (50, 3)
+    with pytest.raises(ValueError):
+        Subscription.from_message({"encoding": ENCODING_DELTA}, ENCODING_BINARY)
+
+def test_delta_client_end_to_end():
+    async def main():
+        fanout = Fanout()
+        frames = []
+
+        async def send(frame):
+            frames.append(frame)
+
+        fanout.add("viewer", send)
+        fanout.handle_message("viewer", json.dumps({"type": "subscribe", "encoding": ENCODING_DELTA,
+                                                    "batch": {"ms": 1000, "max": 3}}))
+        for i in range(3):
+            fanout.publish(sample(i), "tile1")
+        await drain()
+        fanout.remove("viewer")
+        return frames
+
+    frame, = asyncio.run(main())
+    frame = json.loads(frame)
+    assert frame["encoding"] == ENCODING_DELTA
+    assert undelta(frame["v"], frame["scale"]["v"]) == pytest.approx([1.0, 1.001, 1.002])
+
+def test_projected_samples_keep_their_timestamp():
+    async def main():
+        fanout = Fanout()
+        frames = []
+
+        async def send(frame):
+            frames.append(frame)
+
+        fanout.add("viewer", send)
+        fanout.subscribe("viewer", {"type": "subscribe", "fields": ["voltage"]})
+        fanout.publish(dict(sample(3), device="tile1"), "tile1")
+        await drain()
+        fanout.remove("viewer")
+        return frames
+
+    frame, = asyncio.run(main())
+    assert json.loads(frame) == {"voltage": 1.003, "device": "tile1", "timestamp": sample(3)["timestamp"]}
+
+def test_stream_snapshot_follows_the_subscription():
+    async def main():
+        fanout = Fanout(history=History(seconds=60.0, capacity=64))
+        for i in range(5):
+            fanout.publish(sample(i), "tile1")
+        client = fanout.add_stream("stream", {"fields": ["voltage"], "encoding": ENCODING_DELTA})
+        frames = list(client.queue)
+        fanout.remove("stream")
+        return frames
+
+    frame, = asyncio.run(main())
+    assert frame.startswith("data: ") and frame.endswith("\n\n")
+    snapshot = json.loads(frame[len("data: "):])
+    assert snapshot["type"] == "snapshot"
+    assert snapshot["encoding"] == ENCODING_DELTA
+    assert undelta(snapshot["v"], snapshot["scale"]["v"]) == pytest.approx([1.0, 1.001, 1.002, 1.003, 1.004])
+    assert undelta(snapshot["dt"]) == [0, 1, 2, 3, 4]
+    assert not {"p", "e", "s"} & set(snapshot)
+
+def test_low_rate_delta_batches_hold_several_samples():
+    async def main():
+        fanout = Fanout()
+        frames = []
+
+        async def send(frame):
+            frames.append(json.loads(frame))
+
+        fanout.add("viewer", send)
+        fanout.subscribe("viewer", {"type": "subscribe", "encoding": ENCODING_DELTA, "rate": 20})
+        for i in range(70):
+            fanout.publish(sample(i), "tile1")
+            await asyncio.sleep(0.01)
+        fanout.remove("viewer")
+        return frames
+
+    frames = asyncio.run(main())
+    assert frames
+    assert len(frames[0]["v"]) >= DELTA_BATCH_SAMPLES // 2
@@ -0,0 +1,64 @@
+"""Per-device sample rings and snapshot windows"""
+import math
+
+import pytest
+
+from history import History, SampleRing
+
+def fill(ring: SampleRing, count: int, start: int = 0):
+    for i in range(start, start + count):
+        ring.append(float(i), i * 0.1, i * 0.01, i * 0.001, i, "ON")
+
+def test_window_of_a_partial_ring():
+    ring = SampleRing(capacity=8)
+    assert ring.window(60.0) is None
+    fill(ring, 3)
+    window = ring.window(60.0)
+    assert list(window["t"]) == [0.0, 1.0, 2.0]
+    assert list(window["s"]) == [0, 1, 2]
+    assert "vmin" not in window
+
+def test_wraparound_keeps_the_newest_in_order():
+    ring = SampleRing(capacity=8)
+    fill(ring, 13)
+    assert len(ring) == 8
+    window = ring.window(60.0)
+    assert list(window["t"]) == [float(i) for i in range(5, 13)]
+    assert list(window["s"]) == list(range(5, 13))
+    assert ring.led == "ON"
+
+def test_window_is_relative_to_the_newest_sample():
+    ring = SampleRing(capacity=8)
+    fill(ring, 13)
+    # Still correct when the window starts before the wrap point
+    assert list(ring.window(4.0)["t"]) == [8.0, 9.0, 10.0, 11.0, 12.0]
+    assert list(ring.window(0.0)["t"]) == [12.0]
+
+def test_bucketing_keeps_last_sample_and_voltage_range():
+    ring = SampleRing(capacity=64)
+    fill(ring, 10)
+    ring.append(10.0, 9.9, 0.0, 0.0, 10)  # A spike inside the last bucket
+    ring.append(11.0, 1.1, 0.0, 0.0, 11)
+    window = ring.window(60.0, max_points=4)
+    # 12 samples in buckets of 3: the last of each bucket, plus min/max of each
+    assert list(window["t"]) == [2.0, 5.0, 8.0, 11.0]
+    assert window["vmin"] == pytest.approx([0.0, 0.3, 0.6, 0.9])
+    assert window["vmax"] == pytest.approx([0.2, 0.5, 0.8, 9.9])
+
+def test_uneven_last_bucket():
+    ring = SampleRing(capacity=64)
+    fill(ring, 10)
+    window = ring.window(60.0, max_points=4)
+    assert list(window["t"]) == [2.0, 5.0, 8.0, 9.0]
+    assert len(window["vmin"]) == len(window["vmax"]) == 4
+
+def test_history_records_per_device_with_nan_for_missing():
+    history = History(seconds=60.0, capacity=16)
+    history.record("tile1", 1.0, {"voltage": 1.5, "power": 0.2, "energy": 0.01, "steps": 3, "led": "ON"})
+    history.record("tile2", 1.0, {"voltage": 2.5})
+    assert history.devices() == ["tile1", "tile2"]
+    window = history.window("tile2")
+    assert list(window["v"]) == [2.5]
+    assert math.isnan(window["p"][0]) and list(window["s"]) == [0]
+    assert history.window("tile3") is None
+    assert history.stats()["samples"] == {"tile1": 1, "tile2": 1}
@@ -0,0 +1,58 @@
+"""Serial ingest: binary frames from voltage.py"""
+import binascii
+
+import pytest
+
+from clock_sync import TICKS_PERIOD
+from sensor_parser import BinaryFrameDecoder, BINARY_FRAME, BINARY_CRC_SPAN, BINARY_SYNC
+
+def binary_frame(seq: int, ticks: int, raw: int) -> bytes:
+    """An 11-byte frame as voltage.py sends it"""
+    head = BINARY_FRAME.pack(BINARY_SYNC, seq, ticks, raw, 0)[:BINARY_CRC_SPAN]
+    return BINARY_FRAME.pack(BINARY_SYNC, seq, ticks, raw, binascii.crc_hqx(head, 0xFFFF))
+
+class TestBinaryFrameDecoder:
+    def test_decodes_frames(self):
+        decoder = BinaryFrameDecoder()
+        samples = decoder.feed(binary_frame(1, 1000, 600) + binary_frame(2, 1010, 65535))
+        assert [s['seq'] for s in samples] == [1, 2]
+        assert [s['ticks_ms'] for s in samples] == [1000, 1010]
+        assert samples[0]['voltage'] == 0.0
+        assert samples[1]['voltage'] == pytest.approx(16.3)
+        # 16.3 V into 330 ohm for 10 ms, in mWh
+        assert samples[1]['energy'] == pytest.approx(16.3 ** 2 / 330 * 0.01 / 3.6)
+        assert decoder.frames == 2 and decoder.crc_errors == 0
+
+    def test_partial_frame_waits_for_the_rest(self):
+        decoder = BinaryFrameDecoder()
+        frame = binary_frame(7, 5, 30000)
+        assert decoder.feed(frame[:4]) == []
+        assert decoder.pending == 4
+        assert [s['seq'] for s in decoder.feed(frame[4:])] == [7]
+        assert decoder.pending == 0
+
+    def test_bad_crc_is_rejected(self):
+        decoder = BinaryFrameDecoder()
+        frame = bytearray(binary_frame(3, 100, 30000))
+        frame[7] ^= 0xFF
+        assert decoder.feed(bytes(frame)) == []
+        assert decoder.crc_errors >= 1
+        assert decoder.frames == 0
+
+    def test_resyncs_after_garbage(self):
+        decoder = BinaryFrameDecoder()
+        corrupt = bytearray(binary_frame(4, 200, 30000))
+        corrupt[-1] ^= 0x01
+        data = b"\x00\xA5junk" + bytes(corrupt) + binary_frame(5, 210, 30000) + binary_frame(6, 220, 30000)
+        samples = []
+        for i in range(0, len(data), 3):
+            samples += decoder.feed(data[i:i + 3])
+        assert [s['seq'] for s in samples] == [5, 6]
+        assert decoder.crc_errors >= 2
+        assert decoder.skipped == 0
+
+    def test_energy_across_ticks_wrap(self):
+        decoder = BinaryFrameDecoder()
+        decoder.feed(binary_frame(1, TICKS_PERIOD - 5, 65535))
+        sample, = decoder.feed(binary_frame(2, 5, 65535))
+        assert sample['energy'] == pytest.approx(16.3 ** 2 / 330 * 0.01 / 3.6)
@@ -0,0 +1,107 @@
+"""Per-consumer bounded queues and their full-queue policies"""
+import asyncio
+
+import pytest
+
+from ingest_queue import ConsumerQueue, IngestQueue, POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_LATEST
+
+def sample(i: int, device: str = "tile1"):
+    return {"device": device, "voltage": float(i)}
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        ConsumerQueue("x", None, policy="fifo")
+
+def test_drop_oldest_keeps_the_newest():
+    queue = ConsumerQueue("viewers", None, POLICY_DROP_OLDEST, maxsize=3)
+    for i in range(5):
+        assert queue.offer(sample(i))
+    assert [queue._pop()["voltage"] for _ in range(3)] == [2.0, 3.0, 4.0]
+    assert queue.dropped == 2
+    assert queue.high_water == 3
+
+def test_latest_keeps_one_sample_per_device():
+    queue = ConsumerQueue("status", None, POLICY_LATEST, maxsize=2)
+    for i in range(3):
+        queue.offer(sample(i, "tile1"))
+    queue.offer(sample(9, "tile2"))
+    assert queue.depth == 2
+    assert queue.coalesced == 2
+    queue.offer(sample(5, "tile3"))
+    assert queue.dropped == 1  # tile1, the oldest key, made room
+    assert [queue._pop()["device"] for _ in range(2)] == ["tile2", "tile3"]
+
+def test_block_waits_for_space_and_loses_nothing():
+    async def main():
+        delivered = []
+        release = asyncio.Event()
+
+        async def slow_store(item):
+            await release.wait()
+            delivered.append(item["voltage"])
+
+        queue = ConsumerQueue("storage", slow_store, POLICY_BLOCK, maxsize=2)
+        queue.start()
+        await queue.put(sample(0))
+        await asyncio.sleep(0)  # The consumer takes it and waits in slow_store
+        for i in (1, 2):
+            await queue.put(sample(i))
+        assert not queue.offer(sample(99))
+        writer = asyncio.create_task(queue.put(sample(3)))
+        await asyncio.sleep(0.02)
+        assert not writer.done()
+        release.set()
+        await asyncio.wait_for(writer, 1.0)
+        await queue.stop(flush=True)
+        return delivered, queue
+
+    delivered, queue = asyncio.run(main())
+    assert delivered == [0.0, 1.0, 2.0, 3.0]
+    assert queue.blocked == 1
+    assert queue.dropped == 0
+
+def test_handler_errors_are_counted_not_fatal():
+    async def main():
+        seen = []
+
+        async def flaky(item):
+            if item["voltage"] == 1.0:
+                raise RuntimeError("disk full")
+            seen.append(item["voltage"])
+
+        queue = ConsumerQueue("csv", flaky, POLICY_DROP_OLDEST)
+        queue.start()
+        for i in range(3):
+            queue.offer(sample(i))
+        await queue.stop(flush=True)
+        return seen, queue.errors
+
+    assert asyncio.run(main()) == ([0.0, 2.0], 1)
+
+def test_slow_viewer_does_not_slow_storage():
+    async def main():
+        stored = []
+        stuck = asyncio.Event()
+
+        async def store(item):
+            stored.append(item["voltage"])
+
+        async def viewer(item):
+            await stuck.wait()
+
+        ingest = IngestQueue()
+        ingest.add_consumer("storage", store, POLICY_BLOCK, 10)
+        ingest.add_consumer("viewers", viewer, POLICY_DROP_OLDEST, 5)
+        ingest.start()
+        for i in range(50):
+            await asyncio.wait_for(ingest.publish(sample(i)), 0.5)
+            await asyncio.sleep(0)
+        stats = ingest.stats()
+        stuck.set()
+        await ingest.stop()
+        return stored, stats
+
+    stored, stats = asyncio.run(main())
+    assert stored == [float(i) for i in range(50)]
+    assert stats["viewers"]["dropped"] > 0
+    assert stats["viewers"]["depth"] <= 5
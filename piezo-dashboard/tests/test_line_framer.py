@@ -0,0 +1,31 @@
+"""LineFramer: newline framing of serial bytes"""
+from serial_ingest import LineFramer
+
+class TestLineFramer:
+    def test_complete_lines(self):
+        framer = LineFramer()
+        assert framer.feed(b"V: 1.0V\nV: 2.0V\n") == ["V: 1.0V", "V: 2.0V"]
+        assert framer.pending == 0
+
+    def test_line_split_across_chunks(self):
+        framer = LineFramer()
+        assert framer.feed(b"V: 1.") == []
+        assert framer.pending == 5
+        assert framer.feed(b"5V\r\nV: 2") == ["V: 1.5V"]
+        assert framer.feed(b".0V\n") == ["V: 2.0V"]
+        assert framer.pending == 0
+
+    def test_blank_lines_are_skipped(self):
+        assert LineFramer().feed(b"\n\r\n  \nLED: ON\n") == ["LED: ON"]
+
+    def test_compacts_consumed_bytes(self):
+        framer = LineFramer(compact_at=16)
+        for i in range(100):
+            assert framer.feed(b"line %d\npart" % i) == ["line %d" % i if i == 0 else "partline %d" % i]
+        assert len(framer._buf) < 32
+
+    def test_drops_runaway_partial(self):
+        framer = LineFramer(max_partial=8)
+        assert framer.feed(b"x" * 20) == []
+        assert framer.pending == 0
+        assert framer.feed(b"ok\n") == ["ok"]
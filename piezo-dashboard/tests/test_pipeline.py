@@ -0,0 +1,106 @@
+"""Micro-batched ingest pipeline: batching, stage specs and the built-in stages"""
+import asyncio
+import sys
+import types
+
+import pytest
+
+from pipeline import Batch, Pipeline, build_pipeline, STAGE_FACTORIES
+from sensor_parser import DeviceParser
+from serial_ingest import StreamDecoder
+
+def sample(i: int, device: str = "tile1"):
+    return {"device": device, "voltage": float(i), "power": 0.5}
+
+def recording_pipeline(max_batch: int, max_delay: float):
+    sizes = []
+    pipeline = Pipeline(max_batch, max_delay)
+    pipeline.add_stage("record", lambda batch: sizes.append(len(batch.samples)))
+    return pipeline, sizes
+
+def test_flushes_at_max_batch_then_after_max_delay():
+    async def main():
+        pipeline, sizes = recording_pipeline(max_batch=4, max_delay=0.05)
+        for i in range(10):
+            await pipeline.submit_samples([sample(i)])
+        full = list(sizes)
+        await asyncio.sleep(0.1)
+        return full, sizes, pipeline
+
+    full, sizes, pipeline = asyncio.run(main())
+    assert full == [4, 4]
+    assert sizes == [4, 4, 2]
+    assert pipeline.batches == 3
+    assert pipeline.pending == 0
+
+def test_close_flushes_pending_work():
+    async def main():
+        pipeline, sizes = recording_pipeline(max_batch=100, max_delay=10.0)
+        await pipeline.submit_samples([sample(i) for i in range(3)])
+        await pipeline.close()
+        return sizes
+
+    assert asyncio.run(main()) == [3]
+
+def test_failing_stage_is_counted_and_later_stages_still_run():
+    async def main():
+        sizes = []
+        pipeline = Pipeline(max_batch=1, max_delay=1.0)
+
+        def broken(batch):
+            raise RuntimeError("boom")
+
+        pipeline.add_stage("broken", broken)
+        pipeline.add_stage("record", lambda batch: sizes.append(len(batch.samples)))
+        await pipeline.submit_samples([sample(0)])
+        return pipeline.stats()["stages"], sizes
+
+    stages, sizes = asyncio.run(main())
+    assert stages["broken"]["errors"] == 1
+    assert stages["record"]["batches"] == 1
+    assert sizes == [1]
+
+def test_build_pipeline_from_specs(monkeypatch):
+    calls = []
+
+    def tag_stage(context, value="x"):
+        def tag(batch):
+            for item in batch.samples:
+                item["tag"] = value
+        return tag
+
+    monkeypatch.setitem(STAGE_FACTORIES, "test-tag", tag_stage)
+
+    module = types.ModuleType("custom_stages")
+    module.make = lambda context, **options: (lambda batch: calls.append(options))
+    monkeypatch.setitem(sys.modules, "custom_stages", module)
+
+    pipeline = build_pipeline([{"stage": "test-tag", "name": "tagger", "value": "y"},
+                               {"stage": "custom_stages:make", "limit": 3}])
+    assert [stage.name for stage in pipeline.stages] == ["tagger", "custom_stages:make"]
+    batch = Batch([], [sample(0)])
+    asyncio.run(pipeline.run(batch))
+    assert batch.samples[0]["tag"] == "y"
+    assert calls == [{"limit": 3}]
+    with pytest.raises(ValueError):
+        build_pipeline(["no-such-stage"])
+
+def test_parse_calibrate_derive_stages():
+    verified = []
+    device = types.SimpleNamespace(device_id="tile1", reader=None, verified=False,
+                                   decoder=StreamDecoder(DeviceParser(detect_frames=1)),
+                                   mark_verified=lambda: verified.append(True))
+    context = {"calibration": {"tile1": {"voltage": [2.0, 0.1]}}}
+    pipeline = build_pipeline(["parse", "calibrate", "derive"], context)
+    lines = b"".join(b"V: %d.000V | P: 1.00mW\n" % i for i in (1, 2, 3))
+    batch = Batch([(device, lines, 0.0)], [])
+    asyncio.run(pipeline.run(batch))
+
+    assert [item["device"] for item in batch.samples] == ["tile1"] * 3
+    assert [item["voltage"] for item in batch.samples] == pytest.approx([2.1, 4.1, 6.1])
+    assert verified == [True]
+    metrics = pipeline.derived["tile1"]
+    assert metrics["count"] == 3
+    assert (metrics["v_min"], metrics["v_max"]) == pytest.approx((2.1, 6.1))
+    assert metrics["v_mean"] == pytest.approx(4.1)
+    assert metrics["p_mean"] == pytest.approx(0.001)
@@ -0,0 +1,88 @@
+"""Last-known-good ports: identities, persistence and reconnecting on startup"""
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from device_registry import DeviceRegistry
+from port_cache import PortCache, port_identity, reconnect_cached
+
+PICO_LINE = b"V: 1.000V | P: 2.00mW | E_inst: 0.001mJ | E_total: 0.001mWh\n"
+
+def port_info(device, hwid="n/a", serial_number=None):
+    return SimpleNamespace(device=device, hwid=hwid, serial_number=serial_number)
+
+@pytest.fixture
+def cache(tmp_path):
+    return PortCache(str(tmp_path / "port_cache.json"))
+
+def test_port_identity():
+    assert port_identity(port_info("COM3", "USB VID:PID=2E8A:0005", "E6614103")) == "usb:E6614103"
+    windows = port_info("COM7", "BTHENUM\\{00001101-0000-1000-8000-00805F9B34FB}_LOCALMFG&0002\\7&1C4A&0&98D331F5B2C1_C00000000")
+    assert port_identity(windows) == "bt:98D331F5B2C1"
+    assert port_identity(port_info("/dev/rfcomm0", "BLUETOOTH 98:d3:31:f5:b2:c1")) == "bt:98D331F5B2C1"
+    assert port_identity(port_info("/dev/ttyS0", "PNP0501")) == "hwid:PNP0501"
+    assert port_identity(port_info("/dev/pts/3")) is None
+
+def test_remember_persists_and_relocates(cache):
+    ports = [port_info("COM7", "BTHENUM\\X&0&98D331F5B2C1_C00000000")]
+    cache.remember("tile1", "COM7", 9600, ports)
+    reloaded = PortCache(cache.path)
+    assert reloaded.entries["tile1"]["identity"] == "bt:98D331F5B2C1"
+    renamed = [port_info("COM3", "USB VID:PID=1A86:7523"), port_info("COM9", "BTHENUM\\Y&0&98D331F5B2C1_C00000000")]
+    assert reloaded.relocate("tile1", renamed) == "COM9"
+    reloaded.forget("tile1")
+    assert PortCache(cache.path).entries == {}
+
+def test_unreadable_cache_is_ignored(tmp_path):
+    path = tmp_path / "port_cache.json"
+    path.write_text("{not json")
+    assert PortCache(str(path)).entries == {}
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="needs pseudo-terminals")
+def test_reconnect_cached_keeps_only_verified_ports(cache):
+    fds = []
+
+    def pty():
+        master, slave = os.openpty()
+        fds.extend((master, slave))
+        return master, os.ttyname(slave)
+
+    async def on_chunk(device, chunk):
+        if device.decoder.feed(chunk):
+            device.mark_verified()
+
+    async def main():
+        registry = DeviceRegistry(on_chunk, stall_timeout=None, reconnect=False)
+        live_master, live = pty()
+        _, silent = pty()
+        _, moved = pty()
+        cache.entries = {
+            "live": {"port": live, "baudrate": 9600, "identity": None},
+            "silent": {"port": silent, "baudrate": 9600, "identity": None},
+            "moved": {"port": "/dev/gone", "baudrate": 9600, "identity": "usb:ABC"},
+        }
+
+        async def get_ports():
+            return [port_info(moved, "USB", "ABC")]
+
+        async def send_lines():
+            # Opening the port flushes its input, so keep sending like a real device
+            while True:
+                os.write(live_master, PICO_LINE)
+                await asyncio.sleep(0.02)
+
+        sender = asyncio.create_task(send_lines())
+        connected = await reconnect_cached(cache, registry, get_ports, verify_timeout=0.3)
+        sender.cancel()
+        ports = {device_id: device.port for device_id, device in registry.devices.items()}
+        await registry.close_all()
+        return connected, ports, live
+
+    connected, ports, live = asyncio.run(main())
+    for fd in fds:
+        os.close(fd)
+    assert connected == ["live"]
+    # The silent port and the relocated one (which never sends) are given up for scanning
+    assert ports == {"live": live}
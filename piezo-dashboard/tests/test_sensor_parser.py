@@ -0,0 +1,87 @@
+"""Pico / Arduino line parsing and format detection"""
+import pytest
+
+from sensor_parser import (parse_lines, parse_pico_line, parse_sensor_data, DeviceParser, FORMAT_PICO,
+                           FORMAT_ARDUINO)
+
+ARDUINO_BLOCK = ["Voltage: 1.5", "Energy: 0.025", "Steps: 150", "Power: 2.25", "LED: ON", "----"]
+
+def pico_line(i: int, seq: bool = True) -> str:
+    line = f"V: {i / 100:.3f}V | P: {i / 10:.2f}mW | E_inst: 0.001mJ | E_total: {i / 1000:.3f}mWh"
+    if seq:
+        line += f" | seq: {i} | ticks: {1000 + i * 10}"
+    return line
+
+def test_parse_lines_columns():
+    lines = [pico_line(1), "garbage", pico_line(2, seq=False), "V: 1.2.3V | P: 1mW"]
+    columns = parse_lines(lines)
+    assert list(columns['voltage']) == [0.01, 0.02]
+    assert list(columns['power']) == pytest.approx([0.0001, 0.0002])
+    assert list(columns['energy']) == [0.001, 0.002]
+    assert list(columns['seq']) == [1, -1]
+    assert list(columns['ticks_ms']) == [1010, -1]
+
+def test_parse_lines_matches_per_line_parser():
+    lines = [pico_line(i, seq=i % 2 == 0) for i in range(20)]
+    columns = parse_lines(lines)
+    for i, line in enumerate(lines):
+        sample = parse_pico_line(line)
+        assert columns['voltage'][i] == sample['voltage']
+        assert columns['power'][i] == sample['power']
+        assert columns['energy'][i] == sample['energy']
+        assert columns['seq'][i] == sample.get('seq', -1)
+
+def test_bound_pico_parser_parses_batches():
+    parser = DeviceParser(detect_frames=3)
+    samples = parser.feed_lines([pico_line(i) for i in range(10)])
+    assert parser.format == FORMAT_PICO
+    assert [s['seq'] for s in samples] == list(range(10))
+    assert samples[-1]['ticks_ms'] == 1090
+    assert samples[-1]['steps'] == 0 and samples[-1]['led'] == 'OFF'
+    assert 'seq' not in parser.feed_lines([pico_line(3, seq=False)])[0]
+
+def test_parse_sensor_data_both_formats():
+    assert parse_sensor_data(pico_line(5))['voltage'] == 0.05
+    sample = parse_sensor_data("\n".join(ARDUINO_BLOCK))
+    assert sample['steps'] == 150 and sample['led'] == 'ON'
+    assert parse_sensor_data("hello") is None
+
+def test_detects_arduino_blocks():
+    parser = DeviceParser(detect_frames=3)
+    samples = [parser.feed_line(line) for line in ARDUINO_BLOCK * 3]
+    samples = [s for s in samples if s]
+    assert parser.format == FORMAT_ARDUINO
+    # Samples seen while detecting are delivered too
+    assert len(samples) == 3
+    assert samples[0]['voltage'] == 1.5 and samples[0]['power'] == 2.25
+
+def test_detection_needs_agreeing_frames():
+    parser = DeviceParser(detect_frames=3)
+    for line in [pico_line(1), "noise", pico_line(2)]:
+        parser.feed_line(line)
+    assert parser.format is None
+    parser.feed_line(pico_line(3))
+    assert parser.format == FORMAT_PICO
+
+def test_redetects_after_consecutive_failures():
+    parser = DeviceParser(detect_frames=3, max_failures=5)
+    parser.feed_lines([pico_line(i) for i in range(3)])
+    assert parser.format == FORMAT_PICO
+    # The device was reflashed with the Arduino sketch
+    for line in ARDUINO_BLOCK[:4]:
+        assert parser.feed_line(line) is None
+    assert parser.format == FORMAT_PICO
+    parser.feed_line("Steps: 1")
+    assert parser.format is None
+    samples = [parser.feed_line(line) for line in ARDUINO_BLOCK * 3]
+    assert parser.format == FORMAT_ARDUINO
+    assert sum(1 for s in samples if s) == 3
+
+def test_one_good_line_resets_the_failure_count():
+    parser = DeviceParser(detect_frames=1, max_failures=3)
+    parser.feed_line(pico_line(0))
+    for _ in range(5):
+        parser.feed_lines(["junk", "junk", pico_line(1)])
+    assert parser.format == FORMAT_PICO
+    parser.feed_lines(["junk"] * 3)
+    assert parser.format is None
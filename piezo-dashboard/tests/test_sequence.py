@@ -0,0 +1,39 @@
+"""SequenceTracker: link loss accounting from device sequence numbers"""
+from serial_ingest import SequenceTracker
+
+class TestSequenceTracker:
+    def test_in_order(self):
+        tracker = SequenceTracker()
+        for seq in range(10):
+            tracker.observe(seq)
+        assert tracker.as_dict() == {"received": 10, "lost": 0, "out_of_order": 0, "duplicates": 0,
+                                     "restarts": 0, "loss_ratio": 0.0}
+
+    def test_gap_counts_lost(self):
+        tracker = SequenceTracker()
+        for seq in (0, 1, 5, 6):
+            tracker.observe(seq)
+        assert tracker.lost == 3
+        assert tracker.as_dict()["loss_ratio"] == round(3 / 7, 4)
+
+    def test_late_frame_is_not_lost(self):
+        tracker = SequenceTracker()
+        for seq in (0, 2, 1, 3):
+            tracker.observe(seq)
+        assert tracker.lost == 0
+        assert tracker.out_of_order == 1
+
+    def test_wraparound(self):
+        tracker = SequenceTracker()
+        for seq in (65534, 65535, 0, 2):
+            tracker.observe(seq)
+        assert tracker.lost == 1
+        assert tracker.restarts == 0
+
+    def test_duplicate_and_restart(self):
+        tracker = SequenceTracker()
+        for seq in (1000, 1000, 1001, 3):
+            tracker.observe(seq)
+        assert tracker.duplicates == 1
+        assert tracker.restarts == 1
+        assert tracker.last_seq == 3
@@ -0,0 +1,105 @@
+"""Server-Sent Event streams: chunking, heartbeats and query subscriptions"""
+import asyncio
+import json
+
+import pytest
+
+from fanout import Fanout, SSE_HEARTBEAT, query_subscription, sse_event
+
+def sample(i: int, device: str = "tile1"):
+    return {"device": device, "voltage": 1.0 + i, "power": 0.5, "energy": 0.01, "steps": i, "led": "ON"}
+
+def events(chunk: str):
+    """The JSON payloads of the `data:` events in one chunk"""
+    assert chunk.endswith("\n\n")
+    return [json.loads(event[len("data: "):]) for event in chunk[:-2].split("\n\n")]
+
+def test_sse_event_format():
+    assert sse_event('{"a":1}') == 'data: {"a":1}\n\n'
+
+def test_queued_frames_are_joined_into_one_chunk():
+    async def main():
+        fanout = Fanout()
+        client = fanout.add_stream("viewer")
+        for i in range(3):
+            fanout.publish(sample(i), "tile1")
+        chunks = client.stream(heartbeat=10.0)
+        chunk = await asyncio.wait_for(chunks.__anext__(), 1.0)
+        await chunks.aclose()
+        return chunk, client.sent
+
+    chunk, sent = asyncio.run(main())
+    assert [event["steps"] for event in events(chunk)] == [0, 1, 2]
+    assert sent == 3
+
+def test_heartbeat_only_when_idle_for_a_whole_period():
+    async def main():
+        fanout = Fanout()
+        client = fanout.add_stream("viewer")
+        chunks = client.stream(heartbeat=0.05)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        first = await asyncio.wait_for(chunks.__anext__(), 1.0)
+        waited = loop.time() - start
+        fanout.publish(sample(0), "tile1")
+        second = await asyncio.wait_for(chunks.__anext__(), 1.0)
+        await chunks.aclose()
+        return first, waited, second
+
+    first, waited, second = asyncio.run(main())
+    assert first == SSE_HEARTBEAT
+    assert waited >= 0.04
+    assert events(second)[0]["steps"] == 0
+
+def test_stream_ends_when_the_client_is_removed():
+    async def main():
+        fanout = Fanout()
+        client = fanout.add_stream("viewer")
+        received = []
+
+        async def consume():
+            async for chunk in client.stream(heartbeat=10.0):
+                received.append(chunk)
+
+        reader = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        fanout.remove("viewer")
+        await asyncio.wait_for(reader, 1.0)
+        return received, len(fanout), fanout.channels
+
+    received, clients, channels = asyncio.run(main())
+    assert received == []
+    assert clients == 0 and channels == {}
+
+def test_query_subscription_filters_devices_and_fields():
+    params = {"fields": "voltage,,power", "devices": "tile2", "rate": "10"}
+    message = query_subscription(params)
+    assert message == {"type": "subscribe", "rate": "10", "fields": ["voltage", "power"], "devices": ["tile2"]}
+
+    async def main():
+        fanout = Fanout()
+        client = fanout.add_stream("viewer", {**message, "rate": "full"})
+        fanout.publish(sample(0), "tile1")
+        fanout.publish(sample(1, "tile2"), "tile2")
+        chunks = client.stream(heartbeat=10.0)
+        chunk = await asyncio.wait_for(chunks.__anext__(), 1.0)
+        await chunks.aclose()
+        return chunk
+
+    event, = events(asyncio.run(main()))
+    assert event == {"device": "tile2", "voltage": 2.0, "power": 0.5}
+
+def test_query_subscription_batch_values():
+    assert query_subscription({"batch": "true"})["batch"] is True
+    assert query_subscription({"batch": "250", "batch_max": "50"})["batch"] == {"ms": 250, "max": 50}
+    with pytest.raises(ValueError):
+        query_subscription({"batch": "soon"})
+
+def test_invalid_subscription_leaves_nothing_registered():
+    async def main():
+        fanout = Fanout()
+        with pytest.raises(ValueError):
+            fanout.add_stream("viewer", query_subscription({"encoding": "binary"}))
+        return len(fanout), fanout.channels
+
+    assert asyncio.run(main()) == (0, {})